@@ -0,0 +1,201 @@
+"""
+Column operations on alignments, vectorized with NumPy.
+
+Sequences are held as rows of a 2-D uint8 matrix. Rows are kept in memory up
+to ``max_memory`` bytes, then spilled to a memory-mapped temporary file;
+column statistics are computed over blocks of rows.
+
+NumPy is optional: ``available()`` is False without it, and callers should
+fall back to the pure-Python implementations in seqmagick2.transform.
+"""
+import tempfile
+
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Bytes of sequence data held in memory before spilling to disk
+DEFAULT_MAX_MEMORY = 1 << 30  # 1 GiB
+
+# Bytes of the matrix processed at once
+BLOCK_SIZE = 1 << 26  # 64 MiB
+
+GAP = ord('-')
+
+
+def available():
+    """
+    True if NumPy is installed
+    """
+    return np is not None
+
+
+def _as_array(sequence):
+    return np.frombuffer(bytes(sequence), dtype=np.uint8)
+
+
+def _lookup(chars):
+    table = np.zeros(256, dtype=bool)
+    table[list(chars.encode('ascii'))] = True
+    return table
+
+
+class AlignmentMatrix(object):
+    """
+    Fixed-width sequences stored as a (rows, width) uint8 matrix, along with
+    their IDs and descriptions.
+    """
+
+    def __init__(self, max_memory=DEFAULT_MAX_MEMORY):
+        self.max_memory = max_memory
+        self.width = None
+        self.ids = []
+        self.descriptions = []
+        self._buffer = bytearray()
+        self._file = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, record):
+        sequence = bytes(record.seq)
+        if self.width is None:
+            self.width = len(sequence)
+        elif len(sequence) != self.width:
+            raise ValueError(("Unexpected sequence length {0}. Is this "
+                              "an alignment?").format(len(sequence)))
+        self.ids.append(record.id)
+        self.descriptions.append(record.description)
+        if self._file is not None:
+            self._file.write(sequence)
+        else:
+            self._buffer += sequence
+            if len(self._buffer) > self.max_memory:
+                self._spill()
+
+    def _spill(self):
+        self._file = tempfile.TemporaryFile()
+        self._file.write(self._buffer)
+        self._buffer = None
+
+    @property
+    def spilled(self):
+        return self._file is not None
+
+    def matrix(self):
+        """
+        The alignment as a (rows, width) uint8 array, memory-mapped if it has
+        been spilled to disk.
+        """
+        shape = (len(self), self.width or 0)
+        if self._file is not None:
+            self._file.flush()
+            return np.memmap(self._file, dtype=np.uint8, mode='r',
+                             shape=shape)
+        return np.frombuffer(self._buffer, dtype=np.uint8).reshape(shape)
+
+    def iter_blocks(self):
+        """
+        Yields (start, block) for blocks of consecutive rows
+        """
+        m = self.matrix()
+        rows = max(1, BLOCK_SIZE // max(1, self.width or 1))
+        for start in range(0, len(self), rows):
+            yield start, m[start:start + rows]
+
+    def column_counts(self, chars):
+        """
+        Number of occurrences of any of ``chars`` in each column
+        """
+        table = _lookup(chars)
+        counts = np.zeros(self.width or 0, dtype=np.int64)
+        for _, block in self.iter_blocks():
+            counts += table[block].sum(axis=0)
+        return counts
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._buffer = None
+
+    @classmethod
+    def from_records(cls, records, max_memory=DEFAULT_MAX_MEMORY):
+        result = cls(max_memory)
+        for record in records:
+            result.append(record)
+        return result
+
+
+def gap_proportion(sequences, gap_chars='-'):
+    """
+    Vectorized seqmagick2.transform.gap_proportion
+    """
+    aln = AlignmentMatrix.from_records(sequences)
+    try:
+        if not len(aln):
+            return []
+        counts = aln.column_counts(gap_chars)
+        return (counts / float(len(aln))).tolist()
+    finally:
+        aln.close()
+
+
+def squeeze(records, gap_threshold=1.0, max_memory=DEFAULT_MAX_MEMORY):
+    """
+    Vectorized seqmagick2.transform.squeeze
+    """
+    aln = AlignmentMatrix.from_records(records, max_memory)
+    try:
+        if not len(aln):
+            return
+        keep = aln.column_counts('-') / float(len(aln)) < gap_threshold
+        for start, block in aln.iter_blocks():
+            squeezed = block[:, keep]
+            for i, row in enumerate(squeezed, start):
+                yield SeqRecord(Seq(row.tobytes().decode('ascii')),
+                                id=aln.ids[i],
+                                description=aln.descriptions[i])
+    finally:
+        aln.close()
+
+
+def _slice_mask(length, slices):
+    mask = np.zeros(length, dtype=bool)
+    for s in slices:
+        mask[s] = True
+    return mask
+
+
+def drop_columns(records, slices):
+    """
+    Vectorized seqmagick2.transform.drop_columns
+    """
+    keep_by_length = {}
+    for record in records:
+        length = len(record)
+        keep = keep_by_length.get(length)
+        if keep is None:
+            keep = keep_by_length[length] = ~_slice_mask(length, slices)
+        record.seq = Seq(_as_array(record.seq)[keep].tobytes().decode('ascii'))
+        yield record
+
+
+def multi_mask_sequences(records, slices):
+    """
+    Vectorized seqmagick2.transform.multi_mask_sequences
+    """
+    mask_by_length = {}
+    for record in records:
+        length = len(record)
+        mask = mask_by_length.get(length)
+        if mask is None:
+            mask = mask_by_length[length] = _slice_mask(length, slices)
+        sequence = _as_array(record.seq).copy()
+        sequence[mask] = GAP
+        record.seq = Seq(sequence.tobytes().decode('ascii'))
+        yield record
@@ -0,0 +1,363 @@
+"""
+Reading and writing compressed files.
+
+gzip output is written as BGZF: independent blocks of at most 64 KiB,
+compressed in parallel on a thread pool and written in order. The result is
+a valid multi-member gzip stream, indexable by tabix and samtools.
+
+Inputs are decompressed off the main thread:
+
+* BGZF (blocked gzip, as written by bgzip) blocks are decompressed in
+  parallel on a thread pool - zlib releases the GIL - and returned in order.
+* Plain gzip, bzip2, xz and zstandard streams are decompressed by a reader
+  thread, pipelined with parsing in the main thread.
+
+zstandard requires the ``zstandard`` package, or Python 3.14's
+``compression.zstd``.
+"""
+import bz2
+import collections
+import concurrent.futures
+import gzip
+import io
+import lzma
+import os
+import queue
+import struct
+import threading
+import zlib
+
+try:
+    from compression import zstd
+except ImportError:
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+
+# Default zlib compression level for output
+DEFAULT_COMPRESS_LEVEL = 6
+
+# Threads used to compress or decompress BGZF blocks
+DEFAULT_THREADS = max(1, min(8, os.cpu_count() or 1))
+
+# Decompressed chunks passed from the reader thread at once, and the number
+# of chunks (or BGZF blocks per thread) read ahead
+CHUNK_SIZE = 1 << 20
+READ_AHEAD = 4
+
+_GZIP_MAGIC = b'\x1f\x8b'
+_BGZF_HEADER = struct.Struct('<4BI2BH')  # Magic, CM, FLG, MTIME, XFL, OS, XLEN
+_FEXTRA = 4
+
+# Uncompressed bytes per BGZF block, and the limit on compressed block size
+BGZF_BLOCK_SIZE = 0xff00
+_BGZF_MAX_BLOCK = 1 << 16
+
+# Empty block marking the end of a BGZF file
+BGZF_EOF = bytes.fromhex(
+    '1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+
+def _bgzf_block_size(extra):
+    """
+    BSIZE from the BC subfield of a gzip extra field, or None
+    """
+    offset = 0
+    while offset + 4 <= len(extra):
+        si1, si2, length = struct.unpack_from('<BBH', extra, offset)
+        if (si1, si2, length) == (66, 67, 2):
+            return struct.unpack_from('<H', extra, offset + 4)[0] + 1
+        offset += 4 + length
+    return None
+
+
+def is_bgzf(path):
+    """
+    True if ``path`` starts with a BGZF block
+    """
+    with open(path, 'rb') as fp:
+        header = fp.read(_BGZF_HEADER.size)
+        if len(header) < _BGZF_HEADER.size:
+            return False
+        fields = _BGZF_HEADER.unpack(header)
+        if header[:2] != _GZIP_MAGIC or not fields[3] & _FEXTRA:
+            return False
+        return _bgzf_block_size(fp.read(fields[-1])) is not None
+
+
+def _decompress_block(block):
+    data, crc, size = block
+    result = zlib.decompress(data, -15)
+    if len(result) != size or zlib.crc32(result) != crc:
+        raise ValueError("Corrupt BGZF block")
+    return result
+
+
+class BgzfReader(io.RawIOBase):
+    """
+    Decompresses BGZF blocks in parallel, in order
+    """
+
+    def __init__(self, path, threads=DEFAULT_THREADS):
+        self.name = path
+        self._file = open(path, 'rb')
+        self._executor = concurrent.futures.ThreadPoolExecutor(threads)
+        self._pending = collections.deque()
+        self._read_ahead = threads * READ_AHEAD
+        self._block = b''
+        self._offset = 0
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def _read_block(self):
+        header = self._file.read(_BGZF_HEADER.size)
+        if not header:
+            return None
+        if len(header) < _BGZF_HEADER.size or header[:2] != _GZIP_MAGIC:
+            raise ValueError("Invalid BGZF block in {0}".format(self.name))
+        xlen = _BGZF_HEADER.unpack(header)[-1]
+        block_size = _bgzf_block_size(self._file.read(xlen))
+        if block_size is None:
+            raise ValueError("Not a BGZF file: {0}".format(self.name))
+        remaining = block_size - _BGZF_HEADER.size - xlen
+        body = self._file.read(remaining)
+        if len(body) != remaining:
+            raise ValueError("Truncated BGZF block in {0}".format(self.name))
+        crc, size = struct.unpack('<II', body[-8:])
+        return body[:-8], crc, size
+
+    def _fill(self):
+        while not self._eof and len(self._pending) < self._read_ahead:
+            block = self._read_block()
+            if block is None:
+                self._eof = True
+            else:
+                self._pending.append(
+                    self._executor.submit(_decompress_block, block))
+
+    def readinto(self, b):
+        while self._offset >= len(self._block):
+            self._fill()
+            if not self._pending:
+                return 0
+            self._block = self._pending.popleft().result()
+            self._offset = 0
+        n = min(len(b), len(self._block) - self._offset)
+        b[:n] = self._block[self._offset:self._offset + n]
+        self._offset += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            for future in self._pending:
+                future.cancel()
+            self._executor.shutdown(wait=True)
+            self._file.close()
+        super(BgzfReader, self).close()
+
+
+def _compress_block(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    body = compressor.compress(data) + compressor.flush()
+    block_size = len(body) + 26
+    if block_size > _BGZF_MAX_BLOCK:
+        # Incompressible: store
+        return _compress_block(data, 0)
+    header = _BGZF_HEADER.pack(0x1f, 0x8b, 8, _FEXTRA, 0, 0, 255, 6)
+    return (header + struct.pack('<BBHH', 66, 67, 2, block_size - 1) + body +
+            struct.pack('<II', zlib.crc32(data), len(data)))
+
+
+class BgzfWriter(io.RawIOBase):
+    """
+    Compresses BGZF blocks in parallel, writing them in order
+    """
+
+    def __init__(self, path, level=None, threads=None):
+        self.name = path
+        self.level = DEFAULT_COMPRESS_LEVEL if level is None else level
+        threads = threads or DEFAULT_THREADS
+        self._file = open(path, 'wb')
+        self._executor = concurrent.futures.ThreadPoolExecutor(threads)
+        self._pending = collections.deque()
+        self._write_ahead = threads * READ_AHEAD
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def _submit(self, data):
+        self._pending.append(
+            self._executor.submit(_compress_block, data, self.level))
+        while len(self._pending) > self._write_ahead:
+            self._file.write(self._pending.popleft().result())
+
+    def write(self, b):
+        self._buffer += b
+        while len(self._buffer) >= BGZF_BLOCK_SIZE:
+            self._submit(bytes(self._buffer[:BGZF_BLOCK_SIZE]))
+            del self._buffer[:BGZF_BLOCK_SIZE]
+        return len(b)
+
+    def close(self):
+        if not self.closed:
+            try:
+                if self._buffer:
+                    self._submit(bytes(self._buffer))
+                    self._buffer = bytearray()
+                while self._pending:
+                    self._file.write(self._pending.popleft().result())
+                self._file.write(BGZF_EOF)
+            finally:
+                self._executor.shutdown(wait=True)
+                self._file.close()
+        super(BgzfWriter, self).close()
+
+
+class _Error(object):
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class PipelinedReader(io.RawIOBase):
+    """
+    Reads a binary file-like object in a background thread
+    """
+
+    def __init__(self, source, name=None):
+        self.name = name or getattr(source, 'name', None)
+        self._source = source
+        self._queue = queue.Queue(READ_AHEAD)
+        self._stop = threading.Event()
+        self._chunk = b''
+        self._offset = 0
+        self._done = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def readable(self):
+        return True
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                chunk = self._source.read(CHUNK_SIZE)
+                self._put(chunk)
+                if not chunk:
+                    return
+        except Exception as e:
+            self._put(_Error(e))
+
+    def readinto(self, b):
+        while self._offset >= len(self._chunk):
+            if self._done:
+                return 0
+            chunk = self._queue.get()
+            if isinstance(chunk, _Error):
+                self._done = True
+                raise chunk.exception
+            if not chunk:
+                self._done = True
+                return 0
+            self._chunk, self._offset = chunk, 0
+        n = min(len(b), len(self._chunk) - self._offset)
+        b[:n] = self._chunk[self._offset:self._offset + n]
+        self._offset += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+            self._source.close()
+        super(PipelinedReader, self).close()
+
+
+def _wrap(raw, mode):
+    if 'r' in mode:
+        handle = io.BufferedReader(raw, CHUNK_SIZE)
+    else:
+        handle = io.BufferedWriter(raw, CHUNK_SIZE)
+    if 'b' in mode:
+        return handle
+    return io.TextIOWrapper(handle)
+
+
+class _NamedTextIOWrapper(io.TextIOWrapper):
+    """
+    Text wrapper with a ``name``, for binary streams lacking one
+    """
+
+    def __init__(self, buffer, name):
+        super(_NamedTextIOWrapper, self).__init__(buffer)
+        self._name = name
+
+    @property
+    def name(self):
+        return self._name
+
+
+def _open_writer(opener, path, mode, **kwargs):
+    """
+    Open ``path`` for writing with ``opener``, in text mode unless 'b' is in
+    ``mode``, as with open()
+    """
+    handle = opener(path, mode.replace('t', '').replace('b', '') + 'b',
+                    **kwargs)
+    if 'b' in mode:
+        return handle
+    return _NamedTextIOWrapper(handle, path)
+
+
+def open_gzip(path, mode='rt', level=None, threads=None):
+    if 'r' not in mode:
+        return _wrap(BgzfWriter(path, level, threads), mode)
+    if is_bgzf(path):
+        return _wrap(BgzfReader(path, threads or DEFAULT_THREADS), mode)
+    return _wrap(PipelinedReader(gzip.open(path, 'rb'), path), mode)
+
+
+def open_bz2(path, mode='rt', level=None, threads=None):
+    if 'r' not in mode:
+        # bzip2 has no level 0: use its fastest
+        return _open_writer(bz2.open, path, mode,
+                            compresslevel=9 if level is None else max(level, 1))
+    return _wrap(PipelinedReader(bz2.open(path, 'rb'), path), mode)
+
+
+def open_xz(path, mode='rt', level=None, threads=None):
+    if 'r' not in mode:
+        return _open_writer(lzma.open, path, mode, preset=level)
+    return _wrap(PipelinedReader(lzma.open(path, 'rb'), path), mode)
+
+
+def require_zstd(path, mode='rt'):
+    """
+    Raises ValueError if no zstd module is available to open ``path``
+    """
+    if zstd is None:
+        raise ValueError("{0} {1} requires the zstandard package".format(
+            'Reading' if 'r' in mode else 'Writing', path))
+
+
+def open_zstd(path, mode='rt', level=None, threads=None):
+    require_zstd(path, mode)
+    if 'r' not in mode:
+        if level is None:
+            return _open_writer(zstd.open, path, mode)
+        if zstd.__name__ == 'zstandard':
+            return _open_writer(zstd.open, path, mode,
+                                cctx=zstd.ZstdCompressor(level=level))
+        return _open_writer(zstd.open, path, mode, level=level)
+    return _wrap(PipelinedReader(zstd.open(path, 'rb'), path), mode)
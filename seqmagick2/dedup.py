@@ -0,0 +1,234 @@
+"""
+Sequence deduplication in bounded memory.
+
+Sequences are identified by a 128-bit hash of their upper-cased bytes:
+xxHash3 if the optional ``xxhash`` package is installed, otherwise a
+truncated SHA-1. Hashes seen are held in memory up to a budget, then written
+as sorted runs of fixed-width entries which are searched by bisection through
+a memory map. Runs of similar size are merged, so that few are searched.
+
+Member IDs of each unique sequence are only kept when they are requested,
+and are likewise spilled to sorted temporary files.
+"""
+import bisect
+import hashlib
+import heapq
+import itertools
+import logging
+import mmap
+import struct
+import tempfile
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Memory used for hashes and member IDs before spilling: default to 1GB
+DEFAULT_MEMORY = 1 << 30
+
+# Approximate memory cost of an in-memory hash table entry, and of a member
+# ID on top of the length of the ID, in bytes
+_ENTRY_SIZE = 160
+_MEMBER_SIZE = 120
+
+DIGEST_SIZE = 16
+
+# Hash, then the number of the group of identical sequences
+_ENTRY = struct.Struct('>{0}sQ'.format(DIGEST_SIZE))
+
+
+def _xxh3_digest(data):
+    return xxhash.xxh3_128_digest(data)
+
+
+def _sha1_digest(data):
+    return hashlib.sha1(data).digest()[:DIGEST_SIZE]
+
+
+digest = _xxh3_digest if xxhash is not None else _sha1_digest
+
+
+class _Run(object):
+    """
+    Sorted, fixed-width hash table entries in a memory-mapped temporary file
+    """
+
+    def __init__(self, entries, level=0):
+        self.level = level
+        self._file = tempfile.TemporaryFile()
+        count = 0
+        for entry in entries:
+            self._file.write(entry)
+            count += 1
+        self._file.flush()
+        self._count = count
+        self._map = None
+        if count:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        # Hash only, for bisection
+        start = i * _ENTRY.size
+        return self._map[start:start + DIGEST_SIZE]
+
+    def __iter__(self):
+        size = _ENTRY.size
+        for start in range(0, self._count * size, size):
+            yield self._map[start:start + size]
+
+    def get(self, key):
+        """
+        Group number of hash ``key``, or None
+        """
+        i = bisect.bisect_left(self, key)
+        if i < self._count and self[i] == key:
+            return _ENTRY.unpack_from(self._map, i * _ENTRY.size)[1]
+        return None
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+
+class _MemberRun(object):
+    """
+    (group, ID) pairs sorted by group, in a temporary file
+    """
+
+    def __init__(self, members):
+        self._file = tempfile.TemporaryFile(mode='w+t', encoding='utf-8',
+                                            errors='surrogateescape')
+        for group, member in members:
+            self._file.write('{0}\t{1}\n'.format(group, member))
+
+    def __iter__(self):
+        self._file.seek(0)
+        for line in self._file:
+            group, member = line.rstrip('\n').split('\t', 1)
+            yield int(group), member
+
+    def close(self):
+        self._file.close()
+
+
+class SequenceTable(object):
+    """
+    Groups of identical sequences, by hash.
+
+    ``add`` returns True the first time a sequence is seen.
+    """
+
+    def __init__(self, track_members=False, memory=DEFAULT_MEMORY):
+        self.track_members = track_members
+        self.memory = memory
+        self._groups = {}
+        self._members = []
+        self._runs = []
+        self._member_runs = []
+        self._size = 0
+        self._group_count = 0
+
+    def __len__(self):
+        return self._group_count
+
+    def _lookup(self, key):
+        group = self._groups.get(key)
+        if group is None:
+            for run in self._runs:
+                group = run.get(key)
+                if group is not None:
+                    break
+        return group
+
+    def add(self, sequence, record_id=None):
+        key = digest(sequence)
+        group = self._lookup(key)
+        is_new = group is None
+        if is_new:
+            group = self._groups[key] = self._group_count
+            self._group_count += 1
+            self._size += _ENTRY_SIZE
+        if self.track_members:
+            self._members.append((group, record_id))
+            self._size += _MEMBER_SIZE + len(record_id)
+        if self._size >= self.memory:
+            self._spill()
+        return is_new
+
+    def _spill(self):
+        if self._groups:
+            entries = (_ENTRY.pack(key, group)
+                       for key, group in sorted(self._groups.items()))
+            self._runs.append(_Run(entries))
+            self._groups = {}
+            self._compact()
+        if self._members:
+            # Stable: members of a group stay in input order
+            self._members.sort(key=lambda m: m[0])
+            self._member_runs.append(_MemberRun(self._members))
+            self._members = []
+        self._size = 0
+
+    def _compact(self):
+        """
+        Merge runs of equal level, keeping O(log n) runs
+        """
+        runs = self._runs
+        while len(runs) > 1 and runs[-1].level == runs[-2].level:
+            second, first = runs.pop(), runs.pop()
+            logging.debug("Merging hash runs of %d and %d entries",
+                          len(first), len(second))
+            runs.append(_Run(heapq.merge(first, second), first.level + 1))
+            first.close()
+            second.close()
+
+    def groups(self):
+        """
+        Yields the list of member IDs of each group, in order of first
+        occurrence
+        """
+        if not self.track_members:
+            raise ValueError("Member IDs were not tracked")
+        self._members.sort(key=lambda m: m[0])
+        # Runs hold earlier input than the in-memory members; heapq.merge
+        # favours earlier iterables on ties, preserving input order.
+        members = heapq.merge(*(self._member_runs + [self._members]),
+                              key=lambda m: m[0])
+        for _, group in itertools.groupby(members, key=lambda m: m[0]):
+            yield [member for _, member in group]
+
+    def close(self):
+        for run in self._runs + self._member_runs:
+            run.close()
+        self._runs, self._member_runs = [], []
+        self._groups, self._members = {}, []
+
+
+def deduplicate(records, sequence_bytes, out_file=None,
+                memory=DEFAULT_MEMORY):
+    """
+    Yield the first record with each sequence, compared case-insensitively.
+
+    ``sequence_bytes`` gives the sequence of a record as bytes. If
+    ``out_file`` is given, the IDs of each group of identical sequences are
+    written to it, space-separated, one group per line.
+    """
+    table = SequenceTable(track_members=out_file is not None, memory=memory)
+    try:
+        for record in records:
+            if table.add(sequence_bytes(record).upper(), record.id):
+                yield record
+
+        if out_file is not None:
+            with out_file:
+                for members in table.groups():
+                    out_file.write('%s\n' % (' '.join(members),))
+    finally:
+        table.close()
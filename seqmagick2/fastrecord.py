@@ -0,0 +1,391 @@
+"""
+Lightweight FASTA / FASTQ records, bypassing SeqRecord construction.
+
+Used by ``convert`` / ``mogrify`` when both input and output are FASTA or FASTQ
+and every requested transform has an implementation in ``TRANSFORMS``.
+"""
+import functools
+import re
+
+from Bio.Seq import Seq
+
+from seqmagick2 import dedup, transform
+
+# Formats handled natively
+FORMATS = ('fasta', 'fastq')
+
+# Text encoding for headers: round-trips arbitrary bytes
+_ENCODING = 'utf-8'
+_ERRORS = 'surrogateescape'
+
+_GAP_BYTES = transform.GAP_CHARS.encode('ascii')
+_WHITESPACE = b' \t\r\n'
+
+
+class FastRecord(object):
+    """
+    Minimal sequence record.
+
+    ``id`` and ``description`` are text, ``seq`` and ``qual`` are bytes.
+    ``qual`` holds the raw Sanger-encoded quality string, or None.
+    """
+    __slots__ = ('id', 'description', 'seq', 'qual')
+
+    def __init__(self, id, description, seq, qual=None):
+        self.id = id
+        self.description = description
+        self.seq = seq
+        self.qual = qual
+
+    def __len__(self):
+        return len(self.seq)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            raise TypeError("FastRecord only supports slicing")
+        qual = self.qual[index] if self.qual is not None else None
+        return FastRecord(self.id, self.description, self.seq[index], qual)
+
+    def __repr__(self):
+        return 'FastRecord(id={0!r}, description={1!r}, seq={2!r})'.format(
+            self.id, self.description, self.seq)
+
+
+def _from_title(title, seq, qual=None):
+    title = title.decode(_ENCODING, _ERRORS)
+    try:
+        first_word = title.split(None, 1)[0]
+    except IndexError:
+        first_word = ''
+    return FastRecord(first_word, title, seq, qual)
+
+
+def _binary_lines(handle):
+    """
+    Iterate over lines of ``handle`` as bytes, bypassing text decoding where
+    the handle wraps a binary buffer.
+    """
+    buf = getattr(handle, 'buffer', None)
+    if buf is not None:
+        return buf
+    return (line.encode(_ENCODING, _ERRORS) for line in handle)
+
+
+def parse_fasta(handle):
+    """
+    Parse FASTA records from ``handle``. As with Bio.SeqIO, any text before
+    the first record, even blank lines, is an error. Whitespace is removed
+    from sequences.
+    """
+    title = None
+    chunks = []
+    for line in _binary_lines(handle):
+        if line[:1] == b'>':
+            if title is not None:
+                yield _from_title(
+                    title, b''.join(chunks).translate(None, _WHITESPACE))
+            title = line[1:].rstrip()
+            chunks = []
+        elif title is not None:
+            chunks.append(line)
+        else:
+            raise ValueError("This FASTA file contains comments at the "
+                             "beginning of the file, which are not allowed "
+                             "by the 'fasta' parser.")
+    if title is not None:
+        yield _from_title(title, b''.join(chunks).translate(None, _WHITESPACE))
+
+
+def parse_fastq(handle):
+    """
+    Parse FASTQ records from ``handle``. Multi-line records are supported;
+    validation mirrors Bio.SeqIO.QualityIO.FastqGeneralIterator.
+    """
+    lines = iter(_binary_lines(handle))
+    line = next(lines, b'')
+    if not line:
+        return
+
+    while True:
+        if line[:1] != b'@':
+            raise ValueError(
+                "Records in Fastq files should start with '@' character")
+        title = line[1:].rstrip()
+        seq_parts = []
+        for line in lines:
+            if line[:1] == b'+':
+                break
+            seq_parts.append(line.rstrip())
+        else:
+            if seq_parts:
+                raise ValueError("End of file without quality information.")
+            raise ValueError("Unexpected end of file")
+        second_title = line[1:].rstrip()
+        if second_title and second_title != title:
+            raise ValueError("Sequence and quality captions differ.")
+        seq = b''.join(seq_parts)
+        if b' ' in seq or b'\t' in seq:
+            raise ValueError("Whitespace is not allowed in the sequence.")
+        seq_len = len(seq)
+
+        line = None
+        qual_parts = []
+        qual_len = 0
+        for line in lines:
+            if line[:1] == b'@' and qual_len >= seq_len:
+                break
+            part = line.rstrip()
+            qual_parts.append(part)
+            qual_len += len(part)
+        else:
+            if line is None:
+                raise ValueError("Unexpected end of file")
+            line = None
+
+        if seq_len != qual_len:
+            raise ValueError(
+                "Lengths of sequence and quality values differs for %s "
+                "(%i and %i)." % (title.decode(_ENCODING, _ERRORS), seq_len,
+                                  qual_len))
+
+        yield _from_title(title, seq, b''.join(qual_parts))
+
+        if line is None:
+            break
+
+
+_PARSERS = {'fasta': parse_fasta, 'fastq': parse_fastq}
+
+
+def parse(handle, file_type):
+    """
+    Parse ``handle`` of ``file_type`` ('fasta' or 'fastq') into FastRecords
+    """
+    return _PARSERS[file_type](handle)
+
+
+def _title(record):
+    record_id = record.id.replace('\n', ' ').replace('\r', ' ')
+    description = record.description.replace('\n', ' ').replace('\r', ' ')
+    if description and description.split(None, 1)[0] == record_id:
+        title = description
+    elif description:
+        title = '{0} {1}'.format(record_id, description)
+    else:
+        title = record_id
+    return title.encode(_ENCODING, _ERRORS)
+
+
+def _format_fasta(record, wrap):
+    seq = record.seq
+    parts = [b'>', _title(record), b'\n']
+    if wrap:
+        for i in range(0, len(seq), wrap):
+            parts.append(seq[i:i + wrap])
+            parts.append(b'\n')
+    else:
+        parts.append(seq)
+        parts.append(b'\n')
+    return b''.join(parts)
+
+
+def _format_fastq(record, wrap=None):
+    if record.qual is None:
+        raise ValueError("No suitable quality scores found in "
+                         "letter_annotations of SeqRecord (id={0}).".format(
+                             record.id))
+    return b''.join((b'@', _title(record), b'\n', record.seq, b'\n+\n',
+                     record.qual, b'\n'))
+
+
+_FORMATTERS = {'fasta': _format_fasta, 'fastq': _format_fastq}
+
+
+def write(records, handle, file_type, wrap=60):
+    """
+    Write ``records`` to ``handle`` in ``file_type`` format, returning the
+    number of records written. Output matches Bio.SeqIO.write.
+    """
+    formatter = _FORMATTERS[file_type]
+    buf = getattr(handle, 'buffer', None)
+    if buf is not None:
+        handle.flush()
+        out = buf.write
+    else:
+        out = lambda b: handle.write(b.decode(_ENCODING, _ERRORS))
+
+    count = 0
+    for record in records:
+        out(formatter(record, wrap))
+        count += 1
+    return count
+
+
+# Transforms with byte-level implementations. Keep semantics (including
+# whether qualities are retained) identical to seqmagick2.transform.
+def dashes_cleanup(records, prune_chars='.:?~'):
+    table = bytes.maketrans(prune_chars.encode('ascii'),
+                            b'-' * len(prune_chars))
+    for record in records:
+        record.seq = record.seq.translate(table)
+        yield record
+
+
+def deduplicate_sequences(records, out_file):
+    return dedup.deduplicate(records, lambda record: record.seq, out_file)
+
+
+def first_name_capture(records):
+    whitespace = re.compile(r'\s+')
+    for record in records:
+        if whitespace.search(record.description):
+            yield FastRecord(record.id, '', record.seq)
+        else:
+            yield record
+
+
+def lower_sequences(records):
+    for record in records:
+        record.seq = record.seq.lower()
+        yield record
+
+
+def upper_sequences(records):
+    for record in records:
+        record.seq = record.seq.upper()
+        yield record
+
+
+def min_ungap_length_discard(records, min_length):
+    for record in records:
+        if len(record.seq.translate(None, _GAP_BYTES)) >= min_length:
+            yield record
+
+
+def multi_cut_sequences(records, slices):
+    if len(slices) == 1:
+        s = slices[0]
+        for record in records:
+            yield record[s]
+    else:
+        for record in records:
+            pieces = [record[s] for s in slices]
+            qual = None
+            if record.qual is not None:
+                qual = b''.join(p.qual for p in pieces)
+            yield FastRecord(record.id, record.description,
+                             b''.join(p.seq for p in pieces), qual)
+
+
+def prune_empty(records):
+    for record in records:
+        if record.seq.strip(b'-'):
+            yield record
+
+
+def reverse_sequences(records):
+    for record in records:
+        record.seq = record.seq[::-1]
+        if record.qual is not None:
+            record.qual = record.qual[::-1]
+        yield record
+
+
+def reverse_complement_sequences(records):
+    for record in records:
+        record.seq = bytes(Seq(record.seq).reverse_complement())
+        if record.qual is not None:
+            record.qual = record.qual[::-1]
+        yield record
+
+
+def seq_include(records, filter_regex):
+    regex = re.compile(filter_regex.encode(_ENCODING))
+    for record in records:
+        if regex.search(record.seq):
+            yield record
+
+
+def seq_exclude(records, filter_regex):
+    regex = re.compile(filter_regex.encode(_ENCODING))
+    for record in records:
+        if not regex.search(record.seq):
+            yield record
+
+
+def strip_range(records):
+    cut_regex = re.compile(r"(?P<id>.*)\/(?P<start>\d+)\-(?P<stop>\d+)")
+    for record in records:
+        name = record.id
+        match = cut_regex.match(record.id)
+        if match:
+            start = int(match.group('start'))
+            stop = int(match.group('stop'))
+            if start > 0 and start <= stop:
+                name = match.group('id')
+        yield FastRecord(name, '', record.seq)
+
+
+def ungap_sequences(records):
+    for record in records:
+        yield FastRecord(record.id, record.description,
+                         record.seq.translate(None, _GAP_BYTES))
+
+
+# Map from seqmagick2.transform function to an equivalent accepting
+# FastRecords. Functions which only touch ``id``, ``description`` or
+# ``len(record)`` are used as-is.
+TRANSFORMS = {
+    transform.dashes_cleanup: dashes_cleanup,
+    transform.deduplicate_taxa: transform.deduplicate_taxa,
+    transform.exclude_from_file: transform.exclude_from_file,
+    transform.first_name_capture: first_name_capture,
+    transform.first_name_delimiter: transform.first_name_delimiter,
+    transform.head: transform.head,
+    transform.include_from_file: transform.include_from_file,
+    transform.lower_sequences: lower_sequences,
+    transform.max_length_discard: transform.max_length_discard,
+    transform.min_length_discard: transform.min_length_discard,
+    transform.min_ungap_length_discard: min_ungap_length_discard,
+    transform.multi_cut_sequences: multi_cut_sequences,
+    transform.name_append_suffix: transform.name_append_suffix,
+    transform.name_exclude: transform.name_exclude,
+    transform.name_include: transform.name_include,
+    transform.name_insert_prefix: transform.name_insert_prefix,
+    transform.name_replace: transform.name_replace,
+    transform.prune_empty: prune_empty,
+    transform.reverse_complement_sequences: reverse_complement_sequences,
+    transform.reverse_sequences: reverse_sequences,
+    transform.sample: transform.sample,
+    transform.seq_exclude: seq_exclude,
+    transform.seq_include: seq_include,
+    transform.strip_range: strip_range,
+    transform.tail: transform.tail,
+    transform.ungap_sequences: ungap_sequences,
+    transform.upper_sequences: upper_sequences,
+}
+
+
+def convert_transforms(transforms):
+    """
+    Map a list of ``functools.partial`` transforms to their FastRecord
+    equivalents. Returns None if any transform is unsupported.
+    """
+    result = []
+    for f in transforms or []:
+        fast = TRANSFORMS.get(getattr(f, 'func', None))
+        if fast is None:
+            return None
+        result.append(functools.partial(fast, *f.args, **f.keywords))
+    return result
+
+
+def supports(source_type, destination_type):
+    """
+    Whether a ``source_type`` -> ``destination_type`` conversion can be
+    performed using FastRecords
+    """
+    if source_type not in FORMATS or destination_type not in FORMATS:
+        return False
+    # FASTA has no qualities to write
+    return not (source_type == 'fasta' and destination_type == 'fastq')
@@ -2,11 +2,11 @@
 Mappings from file extensions to biopython types
 """
 
-# import bz2
-import gzip
 import os.path
 import sys
 
+from seqmagick2 import compression
+
 # Define mappings in a dictionary with extension : BioPython_file_type.
 EXTENSION_TO_TYPE = {'.aln': 'clustal',
                      '.afa': 'fasta',
@@ -32,12 +32,25 @@ EXTENSION_TO_TYPE = {'.aln': 'clustal',
                      '.sto': 'stockholm',}
 
 COMPRESS_EXT = {
-    '.gz': gzip.open,
-    # '.bz2': bz2.BZ2File,
-    # '.bz': bz2.BZ2File,
+    '.gz': compression.open_gzip,
+    '.bgz': compression.open_gzip,
+    '.bz2': compression.open_bz2,
+    '.bz': compression.open_bz2,
+    '.xz': compression.open_xz,
+    '.zst': compression.open_zstd,
 }
 
 
+def compressed_opener(file_name):
+    """
+    Function from COMPRESS_EXT opening ``file_name`` according to its
+    extension, or None if it is not compressed.
+
+    Look up is case insensitive.
+    """
+    return COMPRESS_EXT.get(os.path.splitext(file_name)[1].lower())
+
+
 class UnknownExtensionError(ValueError):
     pass
 
@@ -63,7 +76,7 @@ def from_filename(file_name):
     Look up the BioPython file type corresponding to an input file name.
     """
     base, extension = os.path.splitext(file_name)
-    if extension in COMPRESS_EXT:
+    if compressed_opener(file_name) is not None:
         # Compressed file
         extension = os.path.splitext(base)[1]
     return from_extension(extension)
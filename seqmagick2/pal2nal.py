@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 
 import argparse
+import functools
+import io
+import itertools
 import os
 import re
 import shutil
@@ -8,6 +11,13 @@ import subprocess
 import sys
 import tempfile
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from seqmagick2 import fileformat
+
 CODON_TABLES = {
     1: {
         "B": "((U|T|C|Y|A)(U|T)G)",
@@ -454,6 +464,12 @@ CODON_TABLES = {
 }
 
 STOP_RE = re.compile(r"(((U|T)A(A|G|R))|((T|U)GA))", re.I)
+NON_ALPHA_RE = re.compile(r"[^A-Za-z]")
+WHITESPACE_RE = re.compile(r"\s+")
+RESIDUES = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZ*")
+AMINO_ACIDS = frozenset("ACDEFGHIKLMNPQRSTVWY_*XU")
+START_RE = re.compile(r"((A|C|G|R)TG)", re.I)
+WORD_RE = re.compile(r"\w")
 
 
 def _normalize_newlines(text):
@@ -464,30 +480,64 @@ def _split_fixed(seq, width):
     return [seq[i:i + width] for i in range(0, len(seq), width)]
 
 
+def _open_text(path):
+    # Text handle on path, decompressed according to its extension
+    opener = fileformat.compressed_opener(path)
+    if opener is None:
+        return open(path, "r", encoding="utf-8", errors="replace")
+    return io.TextIOWrapper(opener(path, "rb"), encoding="utf-8", errors="replace")
+
+
+def _iter_lines(handle):
+    # Lines of a universal newlines text handle, without line endings, as
+    # str.split("\n") would give them: a final newline is followed by "".
+    line = ""
+    for line in handle:
+        yield line[:-1] if line.endswith("\n") else line
+    if not line or line.endswith("\n"):
+        yield ""
+
+
 def _read_nuc_sequences(nuc_paths):
     nuc_ids = []
     id_to_seq = {}
+
+    def add(seq_id, parts):
+        # Lines are joined a record at a time; repeated IDs are concatenated
+        if seq_id is not None:
+            id_to_seq[seq_id] += "".join(parts)
+
     for path in nuc_paths:
-        with open(path, "r", encoding="utf-8", errors="replace") as handle:
-            data = _normalize_newlines(handle.read())
-        current_id = None
-        for line in data.split("\n"):
-            if line.startswith("#") or not line.strip():
-                continue
-            if line.startswith(">"):
-                current_id = line[1:].split()[0]
-                nuc_ids.append(current_id)
-                if current_id not in id_to_seq:
-                    id_to_seq[current_id] = ""
-            else:
-                clean = re.sub(r"[^A-Za-z]", "", line)
-                if current_id is not None:
-                    id_to_seq[current_id] += clean
+        with _open_text(path) as handle:
+            current_id = None
+            parts = []
+            for line in handle:
+                if line.startswith("#") or not line.strip():
+                    continue
+                if line.startswith(">"):
+                    add(current_id, parts)
+                    current_id = line[1:].split()[0]
+                    parts = []
+                    nuc_ids.append(current_id)
+                    id_to_seq.setdefault(current_id, "")
+                elif current_id is not None:
+                    parts.append(NON_ALPHA_RE.sub("", line))
+            add(current_id, parts)
     return nuc_ids, id_to_seq
 
 
-def _detect_alignment_type(lines):
+# Alignment types recognised from the file name alone - see fileformat
+FILEFORMAT_TYPES = {
+    "phylip": "phylip",
+    "phylip-relaxed": "phylip-relaxed",
+    "stockholm": "stockholm",
+}
+
+
+def _detect_alignment_type(lines, aln_path=None):
     for line in lines:
+        if line.startswith("# STOCKHOLM"):
+            return "stockholm"
         if line.startswith("#") or not line.strip():
             continue
         if line.startswith("CLUSTAL"):
@@ -496,85 +546,170 @@ def _detect_alignment_type(lines):
             return "fasta"
         if line.startswith("Gblocks"):
             return "gblocks"
-        return "clustal"
+        break
+    if aln_path is not None:
+        try:
+            return FILEFORMAT_TYPES.get(fileformat.from_filename(aln_path), "clustal")
+        except ValueError:
+            pass
     return "clustal"
 
 
-def _read_alignment(aln_path):
-    with open(aln_path, "r", encoding="utf-8", errors="replace") as handle:
-        data = _normalize_newlines(handle.read())
-    lines = data.split("\n")
-    aln_type = _detect_alignment_type(lines)
-
+def _read_clustal(lines):
     aaid = []
-    id2aaaln = {}
-    aaidcnt = {}
-    gblockseq = ""
-
-    if aln_type == "clustal":
-        getblock = False
-        tmplen = 0
-        idspc = 0
-        subalnlen = 0
-        for line in lines:
-            if line.startswith("CLUSTAL") or line.startswith("#"):
-                continue
-            if line and not line[0].isspace():
-                parts = line.rstrip().split()
-                if len(parts) >= 2:
-                    seq_id, seq_part = parts[0], parts[1]
-                    aaidcnt[seq_id] = aaidcnt.get(seq_id, 0) + 1
-                    if aaidcnt[seq_id] == 1:
-                        aaid.append(seq_id)
-                    seq_part = seq_part.upper()
-                    id2aaaln[seq_id] = id2aaaln.get(seq_id, "") + seq_part
-                    tmplen = len(line.rstrip())
-                    idspc = len(re.match(r"^\S+\s+", line).group(0))
-                    subalnlen = len(seq_part)
-                    getblock = True
-                else:
-                    getblock = False
-            elif getblock:
-                padded = line + (" " * max(0, tmplen - len(line)))
-                gblockseq += padded[idspc:idspc + subalnlen]
-                getblock = False
-    elif aln_type == "fasta":
-        current_id = None
-        for line in lines:
-            if line.startswith(">"):
-                current_id = line[1:].split()[0]
-                aaid.append(current_id)
-                id2aaaln[current_id] = ""
-            else:
-                if current_id is None:
-                    continue
-                seq_part = re.sub(r"\s+", "", line).upper()
-                id2aaaln[current_id] += seq_part
-    elif aln_type == "gblocks":
-        getaln = False
-        for line in lines:
-            if re.match(r"^\s+=", line):
-                getaln = True
-                continue
-            if line.startswith("Parameters"):
-                getaln = False
-                continue
-            if not getaln:
-                continue
-            parts = line.split()
-            if not parts:
-                continue
-            if line.startswith("Gblocks"):
-                if len(parts) > 1:
-                    gblockseq += parts[1]
-            elif line and not line[0].isspace():
+    id2parts = {}
+    gblockparts = []
+    getblock = False
+    tmplen = 0
+    idspc = 0
+    subalnlen = 0
+    for line in lines:
+        if line.startswith("CLUSTAL") or line.startswith("#"):
+            continue
+        if line and not line[0].isspace():
+            parts = line.rstrip().split()
+            if len(parts) >= 2:
                 seq_id, seq_part = parts[0], parts[1]
-                aaidcnt[seq_id] = aaidcnt.get(seq_id, 0) + 1
-                if aaidcnt[seq_id] == 1:
+                if seq_id not in id2parts:
                     aaid.append(seq_id)
+                    id2parts[seq_id] = []
                 seq_part = seq_part.upper()
-                id2aaaln[seq_id] = id2aaaln.get(seq_id, "") + seq_part
+                id2parts[seq_id].append(seq_part)
+                tmplen = len(line.rstrip())
+                idspc = len(re.match(r"^\S+\s+", line).group(0))
+                subalnlen = len(seq_part)
+                getblock = True
+            else:
+                getblock = False
+        elif getblock:
+            padded = line + (" " * max(0, tmplen - len(line)))
+            gblockparts.append(padded[idspc:idspc + subalnlen])
+            getblock = False
+    return aaid, id2parts, gblockparts
 
+
+def _read_fasta_alignment(lines):
+    aaid = []
+    id2parts = {}
+    current_id = None
+    for line in lines:
+        if line.startswith(">"):
+            current_id = line[1:].split()[0]
+            aaid.append(current_id)
+            id2parts[current_id] = []
+        elif current_id is not None:
+            id2parts[current_id].append(WHITESPACE_RE.sub("", line).upper())
+    return aaid, id2parts, []
+
+
+def _read_gblocks(lines):
+    aaid = []
+    id2parts = {}
+    gblockparts = []
+    getaln = False
+    for line in lines:
+        if re.match(r"^\s+=", line):
+            getaln = True
+            continue
+        if line.startswith("Parameters"):
+            getaln = False
+            continue
+        if not getaln:
+            continue
+        parts = line.split()
+        if not parts:
+            continue
+        if line.startswith("Gblocks"):
+            if len(parts) > 1:
+                gblockparts.append(parts[1])
+        elif line and not line[0].isspace():
+            seq_id, seq_part = parts[0], parts[1]
+            if seq_id not in id2parts:
+                aaid.append(seq_id)
+                id2parts[seq_id] = []
+            id2parts[seq_id].append(seq_part.upper())
+    return aaid, id2parts, gblockparts
+
+
+def _read_phylip(lines, relaxed=False):
+    # Interleaved PHYLIP, of which sequential PHYLIP with one line per
+    # sequence is a special case. Names are the first 10 characters, or the
+    # first word if relaxed.
+    lines = (line for line in lines if line.strip())
+    header = next(lines, None)
+    if header is None:
+        return [], {}, []
+    try:
+        ntax = int(header.split()[0])
+        int(header.split()[1])
+    except (IndexError, ValueError):
+        raise ValueError("Invalid PHYLIP header: " + header.strip())
+
+    aaid = []
+    id2parts = {}
+    for i, line in enumerate(lines):
+        if i < ntax:
+            if relaxed:
+                fields = line.split(None, 1)
+                seq_id, seq_part = fields[0], fields[1] if len(fields) > 1 else ""
+            else:
+                seq_id, seq_part = line[:10].strip(), line[10:]
+            aaid.append(seq_id)
+            id2parts[seq_id] = []
+        else:
+            seq_id, seq_part = aaid[i % ntax], line
+        id2parts[seq_id].append(WHITESPACE_RE.sub("", seq_part).upper())
+    if len(aaid) < ntax:
+        raise ValueError(f"PHYLIP header gives {ntax} sequences, found {len(aaid)}")
+    return aaid, id2parts, []
+
+
+def _read_stockholm(lines):
+    # The first alignment of a Stockholm file. Annotation lines are skipped,
+    # and "." gaps in insert columns become "-".
+    aaid = []
+    id2parts = {}
+    for line in lines:
+        if line.startswith("//"):
+            break
+        if line.startswith("#") or not line.strip():
+            continue
+        parts = line.split()
+        if len(parts) < 2:
+            continue
+        seq_id, seq_part = parts[0], parts[1]
+        if seq_id not in id2parts:
+            aaid.append(seq_id)
+            id2parts[seq_id] = []
+        id2parts[seq_id].append(seq_part.upper().replace(".", "-"))
+    return aaid, id2parts, []
+
+
+ALIGNMENT_READERS = {
+    "clustal": _read_clustal,
+    "fasta": _read_fasta_alignment,
+    "gblocks": _read_gblocks,
+    "phylip": _read_phylip,
+    "phylip-relaxed": functools.partial(_read_phylip, relaxed=True),
+    "stockholm": _read_stockholm,
+}
+
+
+def _read_alignment(aln_path):
+    with _open_text(aln_path) as handle:
+        lines = _iter_lines(handle)
+        # Only the lines needed to tell the type are held
+        head = []
+        for line in lines:
+            head.append(line)
+            if line.strip() and not line.startswith("#"):
+                break
+        aln_type = _detect_alignment_type(head, aln_path)
+        aaid, id2parts, gblockparts = ALIGNMENT_READERS[aln_type](
+            itertools.chain(head, lines))
+
+    id2aaaln = {seq_id: "".join(parts) for seq_id, parts in id2parts.items()}
+    gblockseq = "".join(gblockparts)
     aaseq = [id2aaaln[seq_id] for seq_id in aaid]
     return aaid, aaseq, id2aaaln, gblockseq
 
@@ -588,35 +723,91 @@ def _apply_frameshift(aaseq):
     return out
 
 
+class CodonMatcher(object):
+    """
+    The codon patterns of one codon table, compiled once.
+
+    Every pattern matches exactly three nucleotides, so a codon pattern
+    built from a protein matches where each of its codons matches in turn.
+    Each codon seen is checked against its amino acid's pattern once and
+    remembered in that amino acid's codon set.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = patterns
+        self.regexes = {aa: re.compile(pattern, re.I)
+                        for aa, pattern in patterns.items()}
+        self.codons = {aa: {} for aa in patterns}
+
+    def matches(self, aa, codon):
+        codons = self.codons[aa]
+        found = codons.get(codon)
+        if found is None:
+            found = codons[codon] = self.regexes[aa].search(codon) is not None
+        return found
+
+    def find(self, tokens, nuc):
+        """
+        Leftmost position where tokens - (amino acid, width) pairs, with an
+        amino acid of None matching any nucleotides - match nuc, or -1.
+        """
+        length = sum(width for _, width in tokens)
+        for start in range(len(nuc) - length + 1):
+            pos = start
+            for aa, width in tokens:
+                if aa is None:
+                    if "\n" in nuc[pos:pos + width]:
+                        break
+                elif not self.matches(aa, nuc[pos:pos + width]):
+                    break
+                pos += width
+            else:
+                return start
+        return -1
+
+
+_CODON_MATCHERS = {}
+
+
+def _codon_matcher(codontable):
+    matcher = _CODON_MATCHERS.get(codontable)
+    if matcher is None:
+        p2c = CODON_TABLES.get(codontable)
+        if not p2c:
+            raise ValueError("invalid codontable")
+        matcher = _CODON_MATCHERS[codontable] = CodonMatcher(p2c)
+    return matcher
+
+
 def _pn2codon(pep, nuc, codontable):
-    p2c = CODON_TABLES.get(codontable)
-    if not p2c:
-        raise ValueError("invalid codontable")
+    matcher = _codon_matcher(codontable)
+    p2c = matcher.patterns
 
     retval = {"message": []}
     peplen = len(pep)
-    qcodon = ""
+    tokens = []
+    started = False
 
     for i in range(peplen):
         peppos = i + 1
         tmpaa = pep[i]
-        if re.match(r"[ACDEFGHIKLMNPQRSTVWY_\*XU]", tmpaa):
-            if not re.search(r"\w", qcodon) and tmpaa == "M":
-                qcodon += p2c["B"]
-            else:
-                qcodon += p2c[tmpaa]
+        if tmpaa in AMINO_ACIDS:
+            if not started and tmpaa == "M":
+                tmpaa = "B"
+            tokens.append((tmpaa, 3))
+            started = started or WORD_RE.search(p2c[tmpaa]) is not None
         elif tmpaa.isdigit():
-            qcodon += "." * int(tmpaa)
+            tokens.append((None, int(tmpaa)))
         elif tmpaa in "-.":
             pass
         else:
             retval["message"].append(
                 f"pepAlnPos {peppos}: {tmpaa} unknown AA type. Taken as 'X'")
-            qcodon += p2c["X"]
+            tokens.append(("X", 3))
 
-    match = re.search(qcodon, nuc, re.I)
-    if match:
-        retval["codonseq"] = match.group(0)
+    start = matcher.find(tokens, nuc)
+    if start >= 0:
+        retval["codonseq"] = nuc[start:start + sum(width for _, width in tokens)]
         retval["result"] = 1
         return retval
 
@@ -653,8 +844,8 @@ def _pn2codon(pep, nuc, codontable):
         for j in range(anclen):
             peppos = i * 10 + j + 1
             tmpaa = anc[j]
-            if re.match(r"[ACDEFGHIKLMNPQRSTVWY_\*XU]", tmpaa):
-                if i == 0 and not re.search(r"\w", qcodon) and tmpaa == "M":
+            if tmpaa in AMINO_ACIDS:
+                if i == 0 and not WORD_RE.search(qcodon) and tmpaa == "M":
                     qcodon += "((A|C|G|R)TG)"
                 else:
                     qcodon += p2c[tmpaa]
@@ -689,10 +880,10 @@ def _pn2codon(pep, nuc, codontable):
             tmpcodon = codon[codonpos:codonpos + 3]
             codonpos += 3
             if tmpnaa == 1 and tmpaa == "M":
-                if not re.search(r"((A|C|G|R)TG)", tmpcodon, re.I):
+                if not START_RE.search(tmpcodon):
                     retval["message"].append(
                         f"pepAlnPos {peppos}: {tmpaa} does not correspond to {tmpcodon}")
-            elif not re.search(p2c[tmpaa], tmpcodon, re.I):
+            elif not matcher.matches(tmpaa, tmpcodon):
                 retval["message"].append(
                     f"pepAlnPos {peppos}: {tmpaa} does not correspond to {tmpcodon}")
         elif tmpaa.isdigit():
@@ -723,7 +914,160 @@ def _print_error(message, out_handle, err_handle, html):
         err_handle.write(message)
 
 
-def run(aln_path, nuc_paths, out_handle, err_handle, options):
+def _cell_width(tmpaa):
+    if not tmpaa.isdigit():
+        return 3
+    return (int((int(tmpaa) - 1) / 3) + 1) * 3
+
+
+def _codon_alignment(aaid, aaseq, codonseq, aaidpos2mismatch, gblockseq, errorpos, options):
+    # Column widths and kept columns are fixed for the whole alignment, so
+    # each row is built on its own, from a list of pieces joined once.
+    aln_len = len(aaseq[0]) if aaseq else 0
+    hasblock = bool(gblockseq) and "#" in gblockseq
+
+    widths = [3] * aln_len
+    width_of = {}
+    for seq in aaseq:
+        for i in range(aln_len):
+            tmpaa = seq[i]
+            width = width_of.get(tmpaa)
+            if width is None:
+                width = width_of[tmpaa] = _cell_width(tmpaa)
+            if widths[i] < width:
+                widths[i] = width
+
+    putcodon = [True] * aln_len
+    for i in range(aln_len):
+        if hasblock and options.blockonly and i < len(gblockseq) and gblockseq[i] != "#":
+            putcodon[i] = False
+        if options.nomismatch and errorpos.get(i):
+            putcodon[i] = False
+
+    mismatches = {}
+    for key in aaidpos2mismatch:
+        seq_id, _, pos = key.rpartition(" ")
+        if pos.isdigit():
+            mismatches.setdefault(seq_id, set()).add(int(pos) - 1)
+
+    codonaln = []
+    coloraln = []
+    for k, seq in enumerate(aaseq):
+        codon = codonseq[k]
+        rowmismatch = mismatches.get(aaid[k], ())
+        tmppos = 0
+        codonparts = []
+        colorparts = []
+        for i in range(aln_len):
+            tmpaa = seq[i]
+            tmpmax = widths[i]
+            put = putcodon[i]
+            if tmpaa.isdigit():
+                nnuc = int(tmpaa)
+            elif tmpaa == "-":
+                nnuc = 0
+            elif tmpaa in RESIDUES:
+                nnuc = 3
+            else:
+                continue
+            if put:
+                if nnuc:
+                    codonparts.append(codon[tmppos:tmppos + nnuc])
+                codonparts.append("-" * (tmpmax - nnuc))
+                colorparts.append(("R" if i in rowmismatch else "-") * max(tmpmax, nnuc))
+            tmppos += nnuc
+        codonaln.append("".join(codonparts))
+        coloraln.append("".join(colorparts))
+
+    maskseq = ""
+    if not options.blockonly:
+        maskseq = "".join(
+            ("#" if hasblock and i < len(gblockseq) and gblockseq[i] == "#" else " ") * widths[i]
+            for i in range(aln_len) if putcodon[i])
+
+    return codonaln, coloraln, maskseq
+
+
+def _codon_column_filter(codonaln, coloraln, maskseq):
+    # -nogap with NumPy: the rows as a (rows, codons, 3) byte matrix, with
+    # gap and stop codon masks computed per codon column. Returns None where
+    # the rows do not form such a matrix, for the pure Python filter.
+    nrows = len(codonaln)
+    alilen = len(codonaln[0])
+    if alilen % 3 or any(len(row) != alilen for row in codonaln + coloraln):
+        return None
+    rows = codonaln + coloraln
+    if len(maskseq) == alilen:
+        rows = rows + [maskseq]
+    elif maskseq:
+        return None
+    try:
+        data = "".join(rows).encode("ascii")
+    except UnicodeEncodeError:
+        return None
+    matrix = np.frombuffer(data, dtype=np.uint8).reshape(len(rows), alilen // 3, 3)
+
+    upper = np.arange(256, dtype=np.uint8)
+    upper[ord("a"):ord("z") + 1] -= 32
+    codons = upper[matrix[:nrows]]
+    first, second, third = codons[..., 0], codons[..., 1], codons[..., 2]
+    is_t = (first == ord("T")) | (first == ord("U"))
+    stop = is_t & (((second == ord("A")) &
+                    ((third == ord("A")) | (third == ord("G")) | (third == ord("R")))) |
+                   ((second == ord("G")) & (third == ord("A"))))
+    gap = (matrix[:nrows] == ord("-")).any(axis=2)
+    keep = ~(gap | stop).any(axis=0)
+
+    kept = [row.tobytes().decode("ascii")
+            for row in matrix[:, keep, :].reshape(len(rows), -1)]
+    nogapmaskseq = kept[2 * nrows] if len(rows) > 2 * nrows else ""
+    return kept[:nrows], kept[nrows:2 * nrows], nogapmaskseq
+
+
+def _remove_gap_columns(codonaln, coloraln, maskseq):
+    if np is not None and codonaln:
+        filtered = _codon_column_filter(codonaln, coloraln, maskseq)
+        if filtered is not None:
+            return filtered
+
+    alilen = len(codonaln[0]) if codonaln else 0
+    keep = []
+    for tmppos in range(0, alilen, 3):
+        for row in codonaln:
+            tmpcodon = row[tmppos:tmppos + 3]
+            if "-" in tmpcodon or STOP_RE.search(tmpcodon):
+                break
+        else:
+            keep.append(tmppos)
+
+    nogapaln = ["".join([row[p:p + 3] for p in keep]) for row in codonaln]
+    nogapcoloraln = ["".join([row[p:p + 3] for p in keep]) for row in coloraln]
+    nogapmaskseq = "".join([maskseq[p:p + 3] for p in keep])
+    return nogapaln, nogapcoloraln, nogapmaskseq
+
+
+def _pn2codon_batch(batch):
+    return [_pn2codon(pep, nuc, codontable) for pep, nuc, codontable in batch]
+
+
+def _codon_sequences(peps, nucs, codontable, threads=1):
+    # _pn2codon results for each protein and its nucleotide sequence, in
+    # order; in a process pool if threads > 1.
+    if threads <= 1 or len(peps) < 2:
+        for pep, nuc in zip(peps, nucs):
+            yield _pn2codon(pep, nuc, codontable)
+        return
+
+    from seqmagick2 import parallel
+    batch_size = max(1, -(-len(peps) // (threads * 4)))
+    pairs = ((pep, nuc, codontable) for pep, nuc in zip(peps, nucs))
+    for _, results in parallel.imap_batches(pairs, _pn2codon_batch, threads,
+                                            batch_size=batch_size):
+        for result in results:
+            yield result
+
+
+def run(aln_path, nuc_paths, out_handle, err_handle, options, threads=1):
     if options.html:
         out_handle.write("<pre>\n")
 
@@ -748,23 +1092,25 @@ def run(aln_path, nuc_paths, out_handle, err_handle, options):
             err_handle.write(f"   nuc '{' '.join(nuc_ids)}'\n")
         raise SystemExit(1)
 
-    common_ids = [nid for nid in nuc_ids if nid in set(aaid)]
+    aaidset = set(aaid)
+    common_ids = [nid for nid in nuc_ids if nid in aaidset]
     idcorrespondence = "sameID" if len(common_ids) == len(aaid) else "ordered"
+    if idcorrespondence == "sameID":
+        nucids = list(aaid)
+    elif idcorrespondence == "ordered":
+        nucids = nuc_ids
+    else:
+        _print_error("\nERROR in ID correspondence.\n\n", out_handle, err_handle, options.html)
+        raise SystemExit(1)
 
     codonseq = []
     aaidpos2mismatch = {}
     outmessage = []
 
-    for i, aaid_item in enumerate(aaid):
-        if idcorrespondence == "sameID":
-            tmpnucid = aaid_item
-        elif idcorrespondence == "ordered":
-            tmpnucid = nuc_ids[i]
-        else:
-            _print_error("\nERROR in ID correspondence.\n\n", out_handle, err_handle, options.html)
-            raise SystemExit(1)
-
-        codonout = _pn2codon(aaseq[i], id2nucseq.get(tmpnucid, ""), options.codontable)
+    codonouts = _codon_sequences(
+        aaseq, [id2nucseq.get(nucid, "") for nucid in nucids], options.codontable, threads)
+    for i, (aaid_item, codonout) in enumerate(zip(aaid, codonouts)):
+        tmpnucid = nucids[i]
         for message in codonout.get("message", []):
             outmessage.append(f"WARNING: {aaid_item} {message}")
             parts = message.split()
@@ -899,92 +1245,11 @@ def run(aln_path, nuc_paths, out_handle, err_handle, options):
             except ValueError:
                 continue
 
-    tmppos = [0] * len(aaid)
-    codonaln = ["" for _ in aaid]
-    coloraln = ["" for _ in aaid]
-    maskseq = ""
-
-    aln_len = len(aaseq[0]) if aaseq else 0
-    for i in range(aln_len):
-        tmpmax = 0
-        apos = i + 1
-
-        putcodon = 1
-        if gblockseq and "#" in gblockseq and i < len(gblockseq):
-            if gblockseq[i] != "#" and options.blockonly:
-                putcodon = 0
-        if options.nomismatch and errorpos.get(i):
-            putcodon = 0
-
-        for seq in aaseq:
-            tmpaa = seq[i]
-            if not tmpaa.isdigit():
-                tmplen = 3
-            else:
-                tmplen = (int((int(tmpaa) - 1) / 3) + 1) * 3
-            if tmpmax < tmplen:
-                tmpmax = tmplen
-
-        for k, seq in enumerate(aaseq):
-            tmpaa = seq[i]
-            mismatch = aaidpos2mismatch.get(f"{aaid[k]} {apos}")
-            if not tmpaa.isdigit():
-                if tmpaa == "-":
-                    if putcodon:
-                        codonaln[k] += "-" * tmpmax
-                        coloraln[k] += ("R" * tmpmax) if mismatch else ("-" * tmpmax)
-                elif re.match(r"[A-Z\*]", tmpaa):
-                    if putcodon:
-                        codonaln[k] += codonseq[k][tmppos[k]:tmppos[k] + 3]
-                        coloraln[k] += "RRR" if mismatch else "---"
-                    tmppos[k] += 3
-                    if putcodon:
-                        pad = tmpmax - 3
-                        if pad > 0:
-                            codonaln[k] += "-" * pad
-                            coloraln[k] += ("R" * pad) if mismatch else ("-" * pad)
-            else:
-                if putcodon:
-                    codonaln[k] += codonseq[k][tmppos[k]:tmppos[k] + int(tmpaa)]
-                    coloraln[k] += ("R" * int(tmpaa)) if mismatch else ("-" * int(tmpaa))
-                tmppos[k] += int(tmpaa)
-                if putcodon:
-                    pad = tmpmax - int(tmpaa)
-                    if pad > 0:
-                        codonaln[k] += "-" * pad
-                        coloraln[k] += ("R" * pad) if mismatch else ("-" * pad)
-
-        if not options.blockonly and putcodon:
-            if gblockseq and "#" in gblockseq and i < len(gblockseq) and gblockseq[i] == "#":
-                maskseq += "#" * tmpmax
-            else:
-                maskseq += " " * tmpmax
+    codonaln, coloraln, maskseq = _codon_alignment(
+        aaid, aaseq, codonseq, aaidpos2mismatch, gblockseq, errorpos, options)
 
     if options.nogap:
-        alilen = len(codonaln[0]) if codonaln else 0
-        tmppos = 0
-        nogapaln = ["" for _ in codonaln]
-        nogapcoloraln = ["" for _ in codonaln]
-        nogapmaskseq = ""
-        while tmppos < alilen:
-            outok = 1
-            for row in codonaln:
-                tmpcodon = row[tmppos:tmppos + 3]
-                if "-" in tmpcodon:
-                    outok = 0
-                if STOP_RE.search(tmpcodon):
-                    outok = 0
-            if outok:
-                for i in range(len(codonaln)):
-                    tmpcodon = codonaln[i][tmppos:tmppos + 3]
-                    nogapaln[i] += tmpcodon
-                    tmpcolor = coloraln[i][tmppos:tmppos + 3]
-                    nogapcoloraln[i] += tmpcolor
-                nogapmaskseq += maskseq[tmppos:tmppos + 3]
-            tmppos += 3
-        codonaln = nogapaln
-        coloraln = nogapcoloraln
-        maskseq = nogapmaskseq
+        codonaln, coloraln, maskseq = _remove_gap_columns(codonaln, coloraln, maskseq)
 
     maxn = max([len(x) for x in aaid] + [10])
     alilen = len(codonaln[0]) if codonaln else 0
@@ -1015,6 +1280,7 @@ def run(aln_path, nuc_paths, out_handle, err_handle, options):
         withn = any(re.search(r"\d", seq) for seq in aaseq)
         if withn:
             alnlen = len(aaseq[0]) if aaseq else 0
+            outaaparts = [[] for _ in aaseq]
             for i in range(alnlen):
                 maxaan = 0
                 for seq in aaseq:
@@ -1026,12 +1292,8 @@ def run(aln_path, nuc_paths, out_handle, err_handle, options):
                 else:
                     tmplen = 1
                 for j, seq in enumerate(aaseq):
-                    if len(outaa) <= j:
-                        outaa.append("")
-                    pushaa = "-" * tmplen
-                    tmpaa = seq[i]
-                    pushaa = tmpaa + pushaa[1:]
-                    outaa[j] += pushaa
+                    outaaparts[j].append(seq[i] + "-" * (tmplen - 1))
+            outaa = ["".join(parts) for parts in outaaparts]
         else:
             outaa = list(aaseq)
 
@@ -1127,13 +1389,15 @@ def build_parser():
                         help="Codon table number")
     parser.add_argument("-html", action="store_true", help="HTML output")
     parser.add_argument("-nostderr", action="store_true", help="No STDERR messages")
+    parser.add_argument("-threads", type=int, default=1,
+                        help="Number of processes used to match codons")
     return parser
 
 
 def main(argv=None):
     parser = build_parser()
     args = parser.parse_args(argv)
-    run(args.pep_aln, args.nuc_fasta, sys.stdout, sys.stderr, args)
+    run(args.pep_aln, args.nuc_fasta, sys.stdout, sys.stderr, args, args.threads)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,168 @@
+"""
+Apply per-record transforms to batches of records in a process pool
+"""
+import collections
+import functools
+import itertools
+import logging
+import multiprocessing
+
+from seqmagick2 import transform
+
+# Number of records sent to a worker at once
+DEFAULT_BATCH_SIZE = 2000
+
+# Batches in flight per worker, bounding memory use
+_BATCHES_PER_WORKER = 2
+
+# Transforms which treat each record independently, and so may be applied
+# to batches in worker processes.
+STATELESS = frozenset([
+    transform.dashes_cleanup,
+    transform.drop_columns,
+    transform.exclude_from_file,
+    transform.first_name_capture,
+    transform.first_name_delimiter,
+    transform.include_from_file,
+    transform.lower_sequences,
+    transform.max_length_discard,
+    transform.min_length_discard,
+    transform.min_ungap_length_discard,
+    transform.multi_cut_sequences,
+    transform.multi_mask_sequences,
+    transform.name_append_suffix,
+    transform.name_exclude,
+    transform.name_include,
+    transform.name_insert_prefix,
+    transform.name_replace,
+    transform.prune_empty,
+    transform.rename_sequences,
+    transform.reverse_complement_sequences,
+    transform.reverse_sequences,
+    transform.seq_exclude,
+    transform.seq_include,
+    transform.strip_range,
+    transform.transcribe,
+    transform.translate,
+    transform.ungap_sequences,
+    transform.upper_sequences,
+])
+
+
+def stateless_prefix_length(transforms, stateless=STATELESS):
+    """
+    Number of leading ``functools.partial`` transforms which are stateless
+    """
+    n = 0
+    for f in transforms or []:
+        if getattr(f, 'func', None) not in stateless:
+            break
+        n += 1
+    return n
+
+
+def _materialize(value):
+    """
+    Replace an open handle with the list of its lines, so it may be sent to
+    worker processes
+    """
+    if not hasattr(value, 'read'):
+        return value
+    try:
+        value.seek(0)
+    except Exception:
+        pass
+    return list(value)
+
+
+def materialize_handles(transforms):
+    """
+    Copy of ``transforms`` with any handle arguments read into memory
+    """
+    return [functools.partial(f.func, *[_materialize(a) for a in f.args],
+                              **{k: _materialize(v)
+                                 for k, v in f.keywords.items()})
+            for f in transforms]
+
+
+def batches(records, batch_size):
+    """
+    Lists of up to ``batch_size`` of ``records``
+    """
+    records = iter(records)
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _quiet_worker():
+    # Each batch repeats the same work; don't repeat its log messages
+    root = logging.getLogger()
+    if root.level < logging.WARNING:
+        root.setLevel(logging.WARNING)
+
+
+def _init_worker(initializer, initargs):
+    _quiet_worker()
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def imap_batches(records, function, threads, initializer=None, initargs=(),
+                 batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Apply ``function`` to lists of ``records`` in ``threads`` worker
+    processes, yielding ``(batch, result)`` pairs in input order.
+
+    ``initializer(*initargs)`` is called once in each worker.
+    """
+    pool = multiprocessing.Pool(threads, _init_worker,
+                                (initializer, initargs))
+    try:
+        pending = collections.deque()
+        for batch in batches(records, batch_size):
+            pending.append((batch, pool.apply_async(function, (batch,))))
+            if len(pending) >= threads * _BATCHES_PER_WORKER:
+                batch, result = pending.popleft()
+                yield batch, result.get()
+        while pending:
+            batch, result = pending.popleft()
+            yield batch, result.get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+_worker_transforms = None
+
+
+def _set_transforms(transforms):
+    global _worker_transforms
+    _worker_transforms = transforms
+
+
+def _apply_transforms(batch):
+    records = iter(batch)
+    for function in _worker_transforms:
+        records = function(records)
+    return list(records)
+
+
+def imap_transforms(records, transforms, threads,
+                    batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Apply ``transforms`` to ``records`` in ``threads`` worker processes,
+    yielding results in input order.
+
+    Transforms must be stateless - see STATELESS.
+    """
+    transforms = materialize_handles(transforms)
+    logging.info("Applying %d transforms using %d processes",
+                 len(transforms), threads)
+    for _, result in imap_batches(records, _apply_transforms, threads,
+                                  _set_transforms, (transforms,), batch_size):
+        for record in result:
+            yield record
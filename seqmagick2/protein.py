@@ -0,0 +1,120 @@
+"""
+Protein isoelectric point and GRAVY from amino acid composition.
+
+Values match Bio.SeqUtils.ProtParam.ProteinAnalysis for the canonical amino
+acids of a sequence, but are calculated from a count of each byte value in the
+sequence, without building a ProteinAnalysis per sequence:
+
+* The isoelectric point depends only on the counts of charged residues and
+  the terminal residues. It is found by the same bisection as
+  Bio.SeqUtils.IsoelectricPoint, and cached in an LRU cache keyed by that
+  composition, so that identical sequences - and any with the same charged
+  residues and termini - are not bisected again.
+* GRAVY is a dot product of the composition with the Kyte-Doolittle scale.
+"""
+import functools
+import math
+
+from Bio.SeqUtils import IsoelectricPoint, ProtParamData
+
+CANONICAL = 'ACDEFGHIKLMNPQRSTVWY'
+
+# Isoelectric points cached
+CACHE_SIZE = 1 << 16
+
+_NON_CANONICAL = bytes(b for b in range(256) if chr(b) not in CANONICAL)
+_CHARGED = IsoelectricPoint.charged_aas
+_KYTE_DOOLITTLE = [(ord(aa), ProtParamData.kd[aa]) for aa in CANONICAL]
+
+
+def _charge(pH, positive, negative):
+    positive_charge = 0.0
+    for count, pK in positive:
+        partial_charge = 1.0 / (10 ** (pH - pK) + 1.0)
+        positive_charge += count * partial_charge
+
+    negative_charge = 0.0
+    for count, pK in negative:
+        partial_charge = 1.0 / (10 ** (pK - pH) + 1.0)
+        negative_charge += count * partial_charge
+
+    return positive_charge - negative_charge
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def isoelectric_point(charged, nterm, cterm):
+    """
+    Isoelectric point of a protein with ``charged`` residues - counts of
+    each of Bio.SeqUtils.IsoelectricPoint.charged_aas - and N- and
+    C-terminal residues ``nterm`` and ``cterm``, or None where the terminal
+    residue has no pK of its own
+    """
+    content = dict(zip(_CHARGED, (float(c) for c in charged)))
+    content['Nterm'] = content['Cterm'] = 1.0
+    positive_pKs = dict(IsoelectricPoint.positive_pKs)
+    negative_pKs = dict(IsoelectricPoint.negative_pKs)
+    if nterm in IsoelectricPoint.pKnterminal:
+        positive_pKs['Nterm'] = IsoelectricPoint.pKnterminal[nterm]
+    if cterm in IsoelectricPoint.pKcterminal:
+        negative_pKs['Cterm'] = IsoelectricPoint.pKcterminal[cterm]
+    positive = [(content[aa], pK) for aa, pK in positive_pKs.items()]
+    negative = [(content[aa], pK) for aa, pK in negative_pKs.items()]
+
+    # As IsoelectricPoint.pi
+    pH, low, high = 7.775, 4.05, 12
+    while high - low > 0.0001:
+        if _charge(pH, positive, negative) > 0.0:
+            low = pH
+        else:
+            high = pH
+        pH = (low + high) / 2
+    return pH
+
+
+def _order_sensitive(value, places=2):
+    """
+    True if ``value`` rounded to ``places`` could depend on summation order:
+    near a rounding boundary, or rounding to zero, where the sign shows
+    """
+    scaled = abs(value) * 10 ** places
+    return (scaled < 0.5 + 1e-6 or
+            abs(scaled - math.floor(scaled) - 0.5) < 1e-6)
+
+
+def gravy(histogram, length, seq=None):
+    """
+    Kyte-Doolittle GRAVY of a sequence of ``length`` canonical amino acids
+    with byte counts ``histogram``.
+
+    Summed in a different order, the result may differ from ProtParam's in
+    the last place. Where that could change the value rounded to two
+    decimals (including the sign of zero), it is summed in sequence order
+    from ``seq``, if given.
+    """
+    total = sum(histogram[b] * value for b, value in _KYTE_DOOLITTLE)
+    result = total / length
+    if seq is not None and _order_sensitive(result):
+        canonical = seq.translate(None, _NON_CANONICAL).decode('ascii')
+        result = sum(ProtParamData.kd[aa] for aa in canonical) / length
+    return result
+
+
+def properties(seq, histogram):
+    """
+    Isoelectric point and GRAVY of the canonical amino acids of ``seq``,
+    upper-case bytes with byte counts ``histogram``; (None, None) if it has
+    none.
+    """
+    length = sum(histogram[ord(aa)] for aa in CANONICAL)
+    if not length:
+        return None, None
+    # Termini without their own pK don't affect the isoelectric point
+    nterm = chr(seq.lstrip(_NON_CANONICAL)[0])
+    if nterm not in IsoelectricPoint.pKnterminal:
+        nterm = None
+    cterm = chr(seq.rstrip(_NON_CANONICAL)[-1])
+    if cterm not in IsoelectricPoint.pKcterminal:
+        cterm = None
+    charged = tuple(histogram[ord(aa)] for aa in _CHARGED)
+    return (isoelectric_point(charged, nterm, cterm),
+            gravy(histogram, length, seq))
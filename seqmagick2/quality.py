@@ -0,0 +1,173 @@
+"""
+Phred quality kernels for ``quality-filter``.
+
+Sanger-encoded FASTQ quality strings are decoded directly to ``uint8`` arrays
+of Phred scores. Mean scores, sliding-window truncation points and ambiguous
+base counts are computed with NumPy, for a single read or for a batch of
+reads at once. Without NumPy, equivalent pure Python implementations are used.
+
+Results match the list-based calculations in
+seqmagick2.subcommands.quality_filter exactly: sums are taken as integers and
+divided once, as floats.
+"""
+import collections
+import itertools
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Sanger FASTQ quality encoding
+PHRED_OFFSET = 33
+
+
+def decode(qual, offset=PHRED_OFFSET):
+    """
+    Phred scores of a quality string, as a ``uint8`` array (a list without
+    NumPy)
+    """
+    if isinstance(qual, str):
+        qual = qual.encode('ascii')
+    if np is None:
+        return [q - offset for q in qual]
+    return np.frombuffer(qual, dtype=np.uint8) - np.uint8(offset)
+
+
+def scores(record):
+    """
+    Phred scores of a FastRecord or SeqRecord, or None if it has none
+    """
+    qual = getattr(record, 'qual', None)
+    if qual is not None:
+        return decode(qual)
+    letter_annotations = getattr(record, 'letter_annotations', None)
+    if letter_annotations and 'phred_quality' in letter_annotations:
+        return letter_annotations['phred_quality']
+    return None
+
+
+def _total(scores):
+    if np is not None and isinstance(scores, np.ndarray):
+        return int(scores.sum(dtype=np.int64))
+    return sum(scores)
+
+
+def mean(scores):
+    """
+    Mean of ``scores``
+    """
+    return _total(scores) / float(len(scores))
+
+
+def _moving_window_clip(scores, window_size, min_mean):
+    it = iter(scores)
+    d = collections.deque(itertools.islice(it, window_size - 1))
+    d.appendleft(0)
+    s = sum(d)
+    clip_right = 0
+    for i, elem in enumerate(it):
+        s += elem - d.popleft()
+        d.append(elem)
+        if s / float(window_size) < min_mean:
+            break
+        clip_right = i + window_size
+    return clip_right
+
+
+def window_clip(scores, window_size, min_mean):
+    """
+    End of the last of the leading windows of ``window_size`` scores with a
+    mean of at least ``min_mean``; 0 if the first window fails.
+
+    ``scores`` should be longer than ``window_size``.
+    """
+    if np is None:
+        return _moving_window_clip(scores, window_size, min_mean)
+    cumulative = np.zeros(len(scores) + 1, dtype=np.int64)
+    np.cumsum(scores, dtype=np.int64, out=cumulative[1:])
+    means = (cumulative[window_size:] - cumulative[:-window_size]) / float(
+        window_size)
+    failed = means < min_mean
+    first = int(failed.argmax()) if failed.any() else len(means)
+    return first - 1 + window_size if first else 0
+
+
+def ambiguous_count(seq):
+    """
+    Number of 'N' or 'n' bases in ``seq``, as bytes
+    """
+    return seq.count(b'N') + seq.count(b'n')
+
+
+def _segments(chunks):
+    """
+    Concatenate byte strings, returning the joined bytes as a ``uint8`` array
+    with the start and end offset of each
+    """
+    lengths = np.fromiter((len(c) for c in chunks), dtype=np.int64,
+                             count=len(chunks))
+    ends = np.cumsum(lengths)
+    data = np.frombuffer(b''.join(chunks), dtype=np.uint8)
+    return data, ends - lengths, ends
+
+
+def _cumulative(values):
+    result = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(values, dtype=np.int64, out=result[1:])
+    return result
+
+
+def batch_means(quals, offset=PHRED_OFFSET):
+    """
+    Mean Phred score of each of a list of quality strings
+    """
+    if np is None:
+        return [mean(decode(q, offset)) for q in quals]
+    data, starts, ends = _segments(quals)
+    lengths = ends - starts
+    if not lengths.all():
+        raise ZeroDivisionError("Empty quality string")
+    cumulative = _cumulative(data)
+    totals = cumulative[ends] - cumulative[starts] - offset * lengths
+    return (totals / lengths.astype(float)).tolist()
+
+
+def batch_window_clips(quals, window_size, min_mean, offset=PHRED_OFFSET):
+    """
+    window_clip for each of a list of quality strings, each longer than
+    ``window_size``
+    """
+    if np is None:
+        return [window_clip(decode(q, offset), window_size, min_mean)
+                for q in quals]
+    if not quals:
+        return []
+    data, starts, ends = _segments(quals)
+    counts = ends - starts - window_size + 1
+    if (counts < 2).any():
+        raise ValueError("Quality strings must be longer than the window")
+    cumulative = _cumulative(data)
+    # Start of every window, and its position within its read
+    window_ends = np.cumsum(counts)
+    local = np.arange(window_ends[-1]) - np.repeat(window_ends - counts,
+                                                         counts)
+    positions = local + np.repeat(starts, counts)
+    sums = (cumulative[positions + window_size] - cumulative[positions] -
+            offset * window_size)
+    failed = sums / float(window_size) < min_mean
+    first = np.minimum.reduceat(
+        np.where(failed, local, np.repeat(counts, counts)),
+        window_ends - counts)
+    return np.where(first > 0, first - 1 + window_size, 0).tolist()
+
+
+def batch_ambiguous_counts(seqs):
+    """
+    Number of 'N' or 'n' bases in each of a list of sequences, as bytes
+    """
+    if np is None:
+        return [ambiguous_count(s) for s in seqs]
+    data, starts, ends = _segments(seqs)
+    cumulative = _cumulative((data | 0x20) == ord('n'))
+    return (cumulative[ends] - cumulative[starts]).tolist()
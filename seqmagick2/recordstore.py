@@ -0,0 +1,248 @@
+"""
+Compact on-disk store for records which must be read more than once.
+
+Each record is written as a fixed header of field lengths followed by the raw
+field bytes: id, name, description, sequence and, optionally, qualities.
+Records are held in memory up to ``buffer_size`` bytes, then spilled to a
+temporary file which is memory-mapped for replay. Any number of passes may be
+made over the stored records, including several at once.
+
+SeqRecords carrying anything other than id, name, description, sequence and
+Phred qualities (features, annotations, other per-letter annotations) are
+stored pickled, so nothing is lost.
+"""
+import mmap
+import pickle
+import struct
+import tempfile
+
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+# Bytes held in memory before spilling to disk: default to 256MB
+DEFAULT_BUFFER_SIZE = 268435456  # 256 * 2**20
+
+# Record kinds
+SEQRECORD = 0
+FASTRECORD = 1
+PICKLED = 2
+
+# Flags, combined with the record kind
+_KIND_MASK = 0x03
+_HAS_QUAL = 0x04
+_NAME_IS_ID = 0x08
+
+# kind | flags, then lengths of id, name, description, sequence, qualities
+_HEADER = struct.Struct('<BIIIII')
+
+_ENCODING = 'utf-8'
+_ERRORS = 'surrogateescape'
+
+_PHRED = 'phred_quality'
+
+
+def _encode(text):
+    return text.encode(_ENCODING, _ERRORS)
+
+
+def _decode(data):
+    return str(data, _ENCODING, _ERRORS)
+
+
+def _simple_seqrecord(record):
+    """
+    True if ``record`` is fully described by id, name, description, sequence
+    and Phred qualities
+    """
+    return (type(record) is SeqRecord and type(record.seq) is Seq and
+            not record.features and not record.annotations and
+            not record.dbxrefs and
+            isinstance(record.id, str) and isinstance(record.name, str) and
+            isinstance(record.description, str) and
+            set(record.letter_annotations) <= {_PHRED})
+
+
+class RecordStore(object):
+    """
+    Append-then-replay store of SeqRecords or FastRecords.
+
+    Iterating over the store (or calling it) yields copies of the records in
+    the order they were added.
+    """
+
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE):
+        from seqmagick2 import fastrecord
+        self._fast_type = fastrecord.FastRecord
+        self.buffer_size = buffer_size
+        self._buffer = bytearray()
+        self._file = None
+        self._map = None
+        self._count = 0
+        self._frozen = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def spilled(self):
+        return self._file is not None
+
+    @property
+    def size(self):
+        """
+        Bytes used by the stored records
+        """
+        if self._file is not None:
+            return self._file.tell() if self._map is None else len(self._map)
+        return len(self._buffer)
+
+    def _encode_record(self, record):
+        if type(record) is self._fast_type:
+            kind = FASTRECORD | _NAME_IS_ID
+            record_id, name = _encode(record.id), b''
+            description, seq = _encode(record.description), record.seq
+            qual = record.qual
+        elif _simple_seqrecord(record):
+            qual = record.letter_annotations.get(_PHRED)
+            if qual is not None:
+                try:
+                    qual = bytes(qual)
+                except (TypeError, ValueError):
+                    # Outside 0-255, e.g. Solexa scores
+                    return self._encode_pickled(record)
+            try:
+                seq = bytes(record.seq)
+            except Exception:
+                # Undefined sequence contents
+                return self._encode_pickled(record)
+            kind = SEQRECORD
+            record_id = _encode(record.id)
+            if record.name == record.id:
+                kind |= _NAME_IS_ID
+                name = b''
+            else:
+                name = _encode(record.name)
+            description = _encode(record.description)
+        else:
+            return self._encode_pickled(record)
+
+        if qual is not None:
+            kind |= _HAS_QUAL
+        else:
+            qual = b''
+        return (_HEADER.pack(kind, len(record_id), len(name), len(description),
+                             len(seq), len(qual)) +
+                record_id + name + description + seq + qual)
+
+    def _encode_pickled(self, record):
+        data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        return _HEADER.pack(PICKLED, 0, 0, 0, len(data), 0) + data
+
+    def append(self, record):
+        if self._frozen:
+            raise ValueError("Records cannot be added after replay")
+        data = self._encode_record(record)
+        if self._file is not None:
+            self._file.write(data)
+        else:
+            self._buffer += data
+            if len(self._buffer) > self.buffer_size:
+                self._spill()
+        self._count += 1
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def _spill(self):
+        self._file = tempfile.TemporaryFile()
+        self._file.write(self._buffer)
+        self._buffer = bytearray()
+
+    def _view(self):
+        self._frozen = True
+        if self._file is None:
+            return memoryview(self._buffer)
+        if self._map is None:
+            self._file.flush()
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        return memoryview(self._map)
+
+    def _iter_raw(self):
+        """
+        Yields (kind, fields) for each stored record, fields as memoryviews
+        """
+        view = self._view()
+        unpack_from = _HEADER.unpack_from
+        header_size = _HEADER.size
+        offset, end = 0, len(view)
+        try:
+            while offset < end:
+                header = unpack_from(view, offset)
+                offset += header_size
+                fields = []
+                for length in header[1:]:
+                    fields.append(view[offset:offset + length])
+                    offset += length
+                yield header[0], fields
+        finally:
+            view.release()
+
+    def _build(self, kind, fields):
+        record_id, name, description, seq, qual = fields
+        base = kind & _KIND_MASK
+        if base == PICKLED:
+            return pickle.loads(seq)
+        record_id = _decode(record_id)
+        description = _decode(description)
+        qual = bytes(qual) if kind & _HAS_QUAL else None
+        if base == FASTRECORD:
+            return self._fast_type(record_id, description, bytes(seq), qual)
+        name = record_id if kind & _NAME_IS_ID else _decode(name)
+        letter_annotations = {_PHRED: list(qual)} if qual is not None else None
+        return SeqRecord(Seq(bytes(seq)), id=record_id, name=name,
+                         description=description,
+                         letter_annotations=letter_annotations)
+
+    def __iter__(self):
+        for kind, fields in self._iter_raw():
+            yield self._build(kind, fields)
+
+    def __call__(self):
+        return iter(self)
+
+    def find(self, record_id):
+        """
+        First stored record with ID ``record_id``, decoding only IDs where
+        possible. Raises KeyError if there is none.
+        """
+        encoded = _encode(record_id)
+        for kind, fields in self._iter_raw():
+            if kind & _KIND_MASK == PICKLED:
+                record = self._build(kind, fields)
+                if record.id == record_id:
+                    return record
+            elif fields[0] == encoded:
+                return self._build(kind, fields)
+        raise KeyError(record_id)
+
+    def close(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # A replay is still in progress; released with the file
+                pass
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._buffer = bytearray()
+        self._count = 0
@@ -0,0 +1,189 @@
+"""
+On-disk cache of per-file results, for ``info``.
+
+Results are stored in an SQLite database, one entry per kind of result and
+file, and are returned only while the file's size and modification time -
+and, optionally, a hash of its contents - are unchanged, and for the same
+version of seqmagick2. Once the stored results exceed a size limit, the
+least recently used entries are evicted.
+
+Values must be JSON-serializable; tuples are returned as lists.
+"""
+import hashlib
+import json
+import logging
+import os
+import os.path
+import sqlite3
+import time
+import zlib
+
+from seqmagick2 import __version__
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Database file within the cache directory
+FILENAME = 'info.sqlite3'
+
+# Environment variable naming a default cache directory
+ENVIRONMENT_VARIABLE = 'SEQMAGICK2_CACHE_DIR'
+
+# Bytes of (compressed) results kept: default to 256MB
+DEFAULT_MAX_SIZE = 1 << 28
+
+_READ_SIZE = 1 << 20
+
+# Writes committed at once
+_COMMIT_INTERVAL = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    file_type TEXT NOT NULL,
+    version TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    value BLOB NOT NULL,
+    used REAL NOT NULL,
+    PRIMARY KEY (kind, path, file_type)
+)
+"""
+
+
+def content_digest(path):
+    """
+    Hex digest of the contents of ``path``: xxHash3 if the ``xxhash``
+    package is installed, otherwise SHA-1
+    """
+    digest = xxhash.xxh3_128() if xxhash is not None else hashlib.sha1()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(_READ_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache(object):
+    """
+    Results keyed by kind, file path and file type.
+
+    Files are identified by absolute path, size and modification time, plus
+    a hash of their contents if ``hash_contents`` is true. Standard input is
+    never cached.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE,
+                 hash_contents=False):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.path = os.path.join(directory, FILENAME)
+        self.max_size = max_size
+        self.hash_contents = hash_contents
+        self.hits = self.misses = 0
+        self._identities = {}
+        self._writes = 0
+        self._connection = sqlite3.connect(self.path, timeout=60)
+        with self._connection:
+            self._connection.execute(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _identity(self, source_file):
+        """
+        (absolute path, size, mtime, digest) of ``source_file``, or None if
+        it can't be cached
+        """
+        if source_file == '-':
+            return None
+        path = os.path.abspath(source_file)
+        if path not in self._identities:
+            try:
+                status = os.stat(path)
+            except OSError:
+                return None
+            digest = content_digest(path) if self.hash_contents else ''
+            self._identities[path] = (path, status.st_size,
+                                      status.st_mtime_ns, digest)
+        return self._identities[path]
+
+    def get(self, kind, source_file, file_type=None):
+        """
+        The stored ``kind`` result for ``source_file`` read as ``file_type``,
+        or None if there is none for the file as it is now
+        """
+        identity = self._identity(source_file)
+        if identity is None:
+            return None
+        path, size, mtime, digest = identity
+        row = self._connection.execute(
+            'SELECT version, size, mtime, digest, value FROM results '
+            'WHERE kind = ? AND path = ? AND file_type = ?',
+            (kind, path, file_type or '')).fetchone()
+        if row is None or tuple(row[:4]) != (__version__, size, mtime,
+                                             digest):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._connection.execute(
+            'UPDATE results SET used = ? '
+            'WHERE kind = ? AND path = ? AND file_type = ?',
+            (time.time(), kind, path, file_type or ''))
+        return json.loads(zlib.decompress(row[4]).decode('utf-8'))
+
+    def put(self, kind, source_file, file_type, value):
+        """
+        Store ``value`` as the ``kind`` result for ``source_file`` read as
+        ``file_type``
+        """
+        identity = self._identity(source_file)
+        if identity is None:
+            return
+        path, size, mtime, digest = identity
+        blob = zlib.compress(json.dumps(value).encode('utf-8'))
+        if len(blob) > self.max_size:
+            return
+        self._connection.execute(
+            'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (kind, path, file_type or '', __version__, size, mtime, digest,
+             sqlite3.Binary(blob), time.time()))
+        self._writes += 1
+        if self._writes % _COMMIT_INTERVAL == 0:
+            self._connection.commit()
+
+    def evict(self):
+        """
+        Remove least recently used entries until the total size of stored
+        results is within ``max_size``
+        """
+        connection = self._connection
+        total, = connection.execute(
+            'SELECT COALESCE(SUM(LENGTH(value)), 0) FROM results').fetchone()
+        if total <= self.max_size:
+            return
+        evicted = []
+        for rowid, size in connection.execute(
+                'SELECT rowid, LENGTH(value) FROM results ORDER BY used'):
+            if total <= self.max_size:
+                break
+            evicted.append((rowid,))
+            total -= size
+        connection.executemany('DELETE FROM results WHERE rowid = ?',
+                               evicted)
+        logging.info("Evicted %d cached results", len(evicted))
+
+    def close(self):
+        if self._connection is not None:
+            with self._connection:
+                self.evict()
+            self._connection.close()
+            self._connection = None
+            logging.info("Result cache: %d hits, %d misses", self.hits,
+                         self.misses)
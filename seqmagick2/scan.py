@@ -0,0 +1,285 @@
+"""
+Byte-level scanning of FASTA / FASTQ files for sequence lengths.
+
+Records are never constructed: files are read in large binary chunks, split
+at line ends, and records are located by their header (and, for FASTQ,
+separator) lines. Uncompressed files are memory-mapped; compressed files are
+read through the streaming decompressors in seqmagick2.compression.
+
+Lengths match those of records parsed by Bio.SeqIO. FASTQ is scanned as four
+lines per record; files the scanner cannot vouch for - multi-line FASTQ,
+malformed records, old Mac line ends - raise Unsupported, so that the caller
+can parse them with Bio.SeqIO instead, which also reports any errors.
+"""
+import itertools
+import mmap
+import os
+import stat
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from seqmagick2 import fileformat
+
+FORMATS = ('fasta', 'fastq')
+
+# Bytes per chunk, extended to the next line end
+CHUNK_SIZE = 1 << 22
+
+_WHITESPACE = b' \t\r\n'
+
+# Characters allowed in Sanger FASTQ quality strings, '!' to '~'
+_QUALITY_CHARS = bytes(range(33, 127))
+
+
+class Unsupported(ValueError):
+    """
+    The file must be parsed to be summarized
+    """
+
+
+def _check_line_ends(chunk):
+    # Universal newlines treat a lone '\r' as a line end
+    if b'\r' in chunk and chunk.count(b'\r') != chunk.count(b'\r\n'):
+        raise Unsupported("Line ends other than '\\n' or '\\r\\n'")
+
+
+def _mapped_chunks(fp, chunk_size):
+    status = os.fstat(fp.fileno())
+    if not stat.S_ISREG(status.st_mode):
+        # Pipes and devices can't be mapped
+        for chunk in _read_chunks(fp, chunk_size):
+            yield chunk
+        return
+    size = status.st_size
+    if not size:
+        return
+    with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        start = 0
+        while start < size:
+            end = data.find(b'\n', start + chunk_size)
+            end = size if end < 0 else end + 1
+            yield data[start:end]
+            start = end
+
+
+def _read_chunks(fp, chunk_size):
+    while True:
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            return
+        if not chunk.endswith(b'\n'):
+            chunk += fp.readline()
+        yield chunk
+
+
+def chunks(path, chunk_size=CHUNK_SIZE, use_mmap=True):
+    """
+    Yields the contents of ``path`` as bytes, in chunks of whole lines.
+
+    Uncompressed files are memory-mapped if ``use_mmap`` is true.
+    """
+    opener = fileformat.compressed_opener(path)
+    if opener is not None:
+        with opener(path, 'rb') as fp:
+            for chunk in _read_chunks(fp, chunk_size):
+                yield chunk
+    else:
+        with open(path, 'rb') as fp:
+            read = _mapped_chunks if use_mmap else _read_chunks
+            for chunk in read(fp, chunk_size):
+                yield chunk
+
+
+def _fasta_chunk(chunk):
+    """
+    Non-whitespace bytes before the first header line of ``chunk``, and the
+    sequence lengths of the records starting in it
+    """
+    size = len(chunk)
+    if chunk[:1] == b'>':
+        header = 0
+    else:
+        header = chunk.find(b'\n>') + 1 or size
+    leading = len(chunk[:header].translate(None, _WHITESPACE))
+    lengths = []
+    while header < size:
+        start = chunk.find(b'\n', header)
+        if start < 0:
+            lengths.append(0)
+            break
+        end = chunk.find(b'\n>', start)
+        end = size if end < 0 else end + 1
+        lengths.append(len(chunk[start:end].translate(None, _WHITESPACE)))
+        header = end
+    return leading, lengths
+
+
+def _np_fasta_chunk(chunk):
+    """
+    As _fasta_chunk, locating line ends and whitespace with NumPy
+    """
+    data = np.frombuffer(chunk, dtype=np.uint8)
+    size = len(data)
+    newlines = np.flatnonzero(data == 0x0a)
+    line_starts = np.concatenate(([0], newlines[newlines < size - 1] + 1))
+    headers = line_starts[data[line_starts] == 0x3e]
+    # Sequence lines run from the end of each header line to the next header
+    starts = np.append(newlines, size - 1)[
+        np.searchsorted(newlines, headers)] + 1
+    ends = np.append(headers[1:], size)
+    whitespace = np.flatnonzero((data == 0x0a) | (data == 0x0d) |
+                                (data == 0x20) | (data == 0x09))
+    if len(headers):
+        starts = np.concatenate(([0], starts))
+        ends = np.concatenate(([headers[0]], ends))
+    else:
+        starts, ends = np.array([0]), np.array([size])
+    lengths = ends - starts - (np.searchsorted(whitespace, ends) -
+                               np.searchsorted(whitespace, starts))
+    return int(lengths[0]), lengths[1:].tolist()
+
+
+def fasta_lengths(chunks):
+    """
+    Yields a list of the sequence lengths of the records in each chunk of a
+    FASTA file. Whitespace is not counted.
+    """
+    scan_chunk = _fasta_chunk if np is None else _np_fasta_chunk
+    length = None
+    for chunk in chunks:
+        _check_line_ends(chunk)
+        if length is None and chunk[:1] != b'>':
+            raise Unsupported("Text before the first record")
+        leading, lengths = scan_chunk(chunk)
+        if not lengths:
+            length += leading
+            continue
+        # The last record may continue in the next chunk
+        completed = lengths[:-1]
+        if length is not None:
+            completed.insert(0, length + leading)
+        length = lengths[-1]
+        yield completed
+    if length is not None:
+        yield [length]
+
+
+def _fastq_records(lines):
+    """
+    Sequence lengths of complete four-line FASTQ records
+    """
+    headers = lines[0::4]
+    sequences = list(map(bytes.rstrip, lines[1::4]))
+    separators = lines[2::4]
+    qualities = list(map(bytes.rstrip, lines[3::4]))
+    lengths = list(map(len, sequences))
+
+    if not all(map(bytes.startswith, headers, itertools.repeat(b'@'))):
+        raise Unsupported("Records should start with '@'")
+    if not all(map(bytes.startswith, separators, itertools.repeat(b'+'))):
+        raise Unsupported("Multi-line record")
+    if any(map(bytes.startswith, sequences, itertools.repeat(b'+'))):
+        raise Unsupported("Empty sequence line")
+    for header, separator in zip(headers, separators):
+        title = separator[1:].rstrip()
+        if title and title != header[1:].rstrip():
+            raise Unsupported("Sequence and quality captions differ")
+    if lengths != list(map(len, qualities)):
+        raise Unsupported("Multi-line record")
+    sequence = b''.join(sequences)
+    if b' ' in sequence or b'\t' in sequence:
+        raise Unsupported("Whitespace in sequence")
+    if b''.join(qualities).translate(None, _QUALITY_CHARS):
+        raise Unsupported("Invalid quality characters")
+    return lengths
+
+
+def _np_fastq_records(block):
+    """
+    As _fastq_records, for a block of records, with NumPy. Returns None,
+    leaving the block to _fastq_records, if it holds anything unusual:
+    unprintable characters outside header lines, separator titles or
+    malformed records.
+    """
+    data = np.frombuffer(block, dtype=np.uint8)
+    newlines = np.flatnonzero(data == 0x0a)
+    starts = np.concatenate(([0], newlines[:-1] + 1))
+    ends = newlines - (data[newlines - 1] == 0x0d)  # Lone '\r's are rejected
+    line_lengths = ends - starts
+    # Outside '!' to '~', other than line ends
+    unprintable = data - np.uint8(0x21) > 0x5d
+    unprintable[newlines] = False
+    unprintable[ends] = False
+    unprintable = np.flatnonzero(unprintable)
+    lines = np.searchsorted(starts, unprintable, side='right') - 1
+    lengths = line_lengths[1::4]
+    if ((lines % 4).any() or
+            (data[starts[0::4]] != 0x40).any() or
+            (data[starts[1::4]] == 0x2b).any() or
+            (data[starts[2::4]] != 0x2b).any() or
+            (line_lengths[2::4] != 1).any() or
+            (lengths != line_lengths[3::4]).any()):
+        return None
+    return lengths.tolist()
+
+
+def _fastq_block(block):
+    """
+    Sequence lengths of the four-line FASTQ records in ``block``
+    """
+    if not block:
+        return []
+    if np is not None:
+        lengths = _np_fastq_records(block)
+        if lengths is not None:
+            return lengths
+    lines = block.split(b'\n')
+    lines.pop()
+    return _fastq_records(lines)
+
+
+def _records_end(block):
+    """
+    Offset just past the last complete four-line record in ``block``
+    """
+    extra = block.count(b'\n') % 4
+    end = len(block)
+    for _ in range(extra + 1):
+        end = block.rfind(b'\n', 0, end)
+    return end + 1
+
+
+def fastq_lengths(chunks):
+    """
+    Yields a list of the sequence lengths of the records in each chunk of a
+    FASTQ file with four lines per record.
+    """
+    rest = b''
+    for chunk in chunks:
+        _check_line_ends(chunk)
+        block = rest + chunk
+        end = _records_end(block)
+        yield _fastq_block(block[:end])
+        rest = block[end:]
+    if rest:
+        if not rest.endswith(b'\n'):
+            rest += b'\n'
+        if rest.count(b'\n') != 4:
+            raise Unsupported("Incomplete record")
+        yield _fastq_block(rest)
+
+
+_SCANNERS = {'fasta': fasta_lengths, 'fastq': fastq_lengths}
+
+
+def sequence_lengths(path, file_type, chunk_size=CHUNK_SIZE, use_mmap=True):
+    """
+    Yields lists of the sequence lengths of records in ``path``, a
+    ``file_type`` ('fasta' or 'fastq') file, in order.
+
+    Raises Unsupported if the file should be parsed instead.
+    """
+    return _SCANNERS[file_type](chunks(path, chunk_size, use_mmap))
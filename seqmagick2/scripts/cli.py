@@ -103,6 +103,17 @@ def main(argv=sys.argv[1:]):
     return action(arguments)
 
 
+def _selected_command(argv):
+    """
+    The subcommand named in argv: the first argument which is not an option.
+    Top-level options take no values.
+    """
+    for arg in argv:
+        if not arg.startswith('-'):
+            return arg
+    return None
+
+
 def parse_arguments(argv):
     """
     Extract command-line arguments for different actions.
@@ -144,17 +155,20 @@ def parse_arguments(argv):
 
     parser_help.add_argument('action')
 
-    # Add actions
+    # Add actions. Only the selected subcommand's module is imported.
+    selected = _selected_command(argv)
     actions = {}
-    for name, mod in subcommands.itermodules():
+    for name, description in subcommands.itercommands():
         subparser = subparsers.add_parser(
             name,
-            help=mod.__doc__,
-            description=mod.__doc__,
+            help=description,
+            description=description,
             formatter_class=partial(_ColoredHelpFormatter,
                                     use_color=use_color_help))
-        mod.build_parser(subparser)
-        actions[name] = mod.action
+        if name == selected:
+            mod = subcommands.load(name)
+            mod.build_parser(subparser)
+            actions[name] = mod.action
 
     arguments = parser.parse_args(argv)
     arguments.argv = argv
@@ -0,0 +1,348 @@
+"""
+Persistent sidecar indexes for random access to FASTA / FASTQ files.
+
+Indexes use the samtools faidx layout, one tab-separated line per record:
+
+    NAME  LENGTH  OFFSET  LINEBASES  LINEWIDTH  [QUALOFFSET]
+
+where LENGTH is the sequence length, OFFSET the byte offset of the first base,
+LINEBASES / LINEWIDTH the bases and bytes per full sequence line, and
+QUALOFFSET (FASTQ only) the byte offset of the first quality character.
+FASTA indexes are written to ``<file>.fai``, FASTQ to ``<file>.fqi``.
+
+As with samtools, every sequence line but the last of a record must have the
+same length.
+"""
+import collections
+import logging
+import os
+import os.path
+
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from seqmagick2 import fileformat
+
+EXTENSIONS = {'fasta': '.fai', 'fastq': '.fqi'}
+
+_ENCODING = 'utf-8'
+_ERRORS = 'surrogateescape'
+
+_WHITESPACE = b' \t\r\n'
+
+# Sanger FASTQ quality encoding
+_PHRED_OFFSET = 33
+
+# Bytes read before a record in search of its header line, then read at once
+# when searching further back for long headers
+_HEADER_GUESS = 256
+_CHUNK_SIZE = 4096
+
+
+class IndexEntry(collections.namedtuple(
+        'IndexEntry', ['name', 'length', 'offset', 'line_bases', 'line_width',
+                       'qual_offset'])):
+    """
+    Location of a single record. ``qual_offset`` is None for FASTA.
+    """
+    __slots__ = ()
+
+    def sequence_bytes(self):
+        """
+        Bytes occupied by the sequence (or quality) lines, including line ends
+        """
+        if not self.line_bases:
+            return 0
+        full, rest = divmod(self.length, self.line_bases)
+        size = full * self.line_width
+        if rest:
+            size += rest + self.line_width - self.line_bases
+        return size
+
+    def end(self):
+        """
+        Byte offset just past the record
+        """
+        start = self.offset if self.qual_offset is None else self.qual_offset
+        return start + self.sequence_bytes()
+
+    def format(self):
+        fields = list(self[:5])
+        if self.qual_offset is not None:
+            fields.append(self.qual_offset)
+        return '\t'.join(str(f) for f in fields) + '\n'
+
+
+def index_path(path, file_type):
+    """
+    Path to the sidecar index for ``path``
+    """
+    try:
+        return path + EXTENSIONS[file_type]
+    except KeyError:
+        raise ValueError("Cannot index {0} files".format(file_type))
+
+
+class _LineLayout(object):
+    """
+    Tracks the line layout of a block of sequence or quality lines
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.length = 0
+        self.line_bases = None
+        self.line_width = None
+        self.short = False
+
+    def add(self, line):
+        bases = len(line.rstrip(b'\r\n'))
+        if not bases:
+            self.short = True
+            return
+        if self.short:
+            raise ValueError("Different line length in sequence {0!r}".format(
+                self.name))
+        if self.line_bases is None:
+            self.line_bases, self.line_width = bases, len(line)
+        elif bases != self.line_bases or len(line) != self.line_width:
+            if bases > self.line_bases:
+                raise ValueError(
+                    "Different line length in sequence {0!r}".format(
+                        self.name))
+            self.short = True
+        self.length += bases
+
+    def layout(self):
+        return self.line_bases or 0, self.line_width or 0
+
+
+def _name(title):
+    words = title.split(None, 1)
+    return words[0].decode(_ENCODING, _ERRORS) if words else ''
+
+
+def _scan_fasta(handle):
+    offset = 0
+    entry = None
+    for line in handle:
+        if line.startswith(b'>'):
+            if entry is not None:
+                yield entry
+            offset += len(line)
+            entry = (offset, _LineLayout(_name(line[1:])))
+            continue
+        offset += len(line)
+        if entry is not None:
+            entry[1].add(line)
+    if entry is not None:
+        yield entry
+
+
+def _build_fasta(handle):
+    for offset, layout in _scan_fasta(handle):
+        yield IndexEntry(layout.name, layout.length, offset,
+                         *layout.layout(), qual_offset=None)
+
+
+def _build_fastq(handle):
+    offset = 0
+    lines = iter(handle)
+    for line in lines:
+        offset += len(line)
+        if not line.strip():
+            continue
+        if not line.startswith(b'@'):
+            raise ValueError("Records in FASTQ files should start with '@'")
+        seq = _LineLayout(_name(line[1:]))
+        seq_offset = offset
+        for line in lines:
+            offset += len(line)
+            if line.startswith(b'+'):
+                break
+            seq.add(line)
+        else:
+            raise ValueError("End of file without quality information.")
+        qual = _LineLayout(seq.name)
+        qual_offset = offset
+        while qual.length < seq.length:
+            line = next(lines, None)
+            if line is None:
+                break
+            offset += len(line)
+            qual.add(line)
+        if qual.length != seq.length:
+            raise ValueError(
+                "Lengths of sequence and quality values differs for "
+                "{0!r}".format(seq.name))
+        yield IndexEntry(seq.name, seq.length, seq_offset, *seq.layout(),
+                         qual_offset=qual_offset)
+
+
+_BUILDERS = {'fasta': _build_fasta, 'fastq': _build_fastq}
+
+
+def _parse_line(line):
+    fields = line.rstrip('\r\n').split('\t')
+    if len(fields) == 5:
+        fields.append(None)
+    elif len(fields) != 6:
+        raise ValueError("Invalid index line: {0!r}".format(line))
+    else:
+        fields[5] = int(fields[5])
+    return IndexEntry(fields[0], int(fields[1]), int(fields[2]),
+                      int(fields[3]), int(fields[4]), fields[5])
+
+
+class SequenceIndex(object):
+    """
+    Random access to the records of an indexed FASTA or FASTQ file
+    """
+
+    def __init__(self, path, file_type, entries):
+        self.path = path
+        self.file_type = file_type
+        self.entries = list(entries)
+        self._by_name = None
+        self._handle = None
+
+    @classmethod
+    def build(cls, path, file_type):
+        """
+        Index ``path`` by reading it once
+        """
+        try:
+            builder = _BUILDERS[file_type]
+        except KeyError:
+            raise ValueError("Cannot index {0} files".format(file_type))
+        with open(path, 'rb') as handle:
+            return cls(path, file_type, builder(handle))
+
+    @classmethod
+    def load(cls, path, file_type, sidecar=None):
+        """
+        Read the sidecar index for ``path``
+        """
+        sidecar = sidecar or index_path(path, file_type)
+        with open(sidecar, encoding=_ENCODING, errors=_ERRORS) as handle:
+            return cls(path, file_type,
+                       (_parse_line(line) for line in handle if line.strip()))
+
+    def write(self, handle):
+        for entry in self.entries:
+            handle.write(entry.format())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __contains__(self, name):
+        return name in self._names()
+
+    def _names(self):
+        if self._by_name is None:
+            self._by_name = {}
+            for entry in self.entries:
+                # First occurrence wins, as in samtools
+                self._by_name.setdefault(entry.name, entry)
+        return self._by_name
+
+    def _read(self, entry):
+        """
+        (start offset, bytes) of the record at ``entry``, header included
+        """
+        if self._handle is None:
+            self._handle = open(self.path, 'rb')
+        handle = self._handle
+        # Read the record along with some preceding bytes, expected to
+        # contain the start of its header line
+        start = max(entry.offset - _HEADER_GUESS, 0)
+        handle.seek(start)
+        data = handle.read(entry.end() - start)
+        position = data.rfind(b'\n', 0, entry.offset - start - 1)
+        while position < 0 and start > 0:
+            # Long header: keep reading backwards
+            previous = max(start - _CHUNK_SIZE, 0)
+            handle.seek(previous)
+            data = handle.read(start - previous) + data
+            start = previous
+            position = data.rfind(b'\n', 0, entry.offset - start - 1)
+        return start + position + 1, data[position + 1:]
+
+    def raw(self, entry):
+        """
+        Bytes of the record at ``entry``, header included
+        """
+        return self._read(entry)[1]
+
+    def fetch(self, entry):
+        """
+        Parse the record at ``entry`` into a SeqRecord, as SeqIO.parse would
+        """
+        start, data = self._read(entry)
+        title = data[1:entry.offset - start].rstrip().decode(_ENCODING,
+                                                             _ERRORS)
+        record_id = title.split(None, 1)[0] if title.strip() else ''
+        seq_start = entry.offset - start
+        seq = data[seq_start:seq_start + entry.sequence_bytes()]
+        letter_annotations = None
+        if entry.qual_offset is not None:
+            qual = data[entry.qual_offset - start:].translate(None, _WHITESPACE)
+            letter_annotations = {'phred_quality': [q - _PHRED_OFFSET
+                                                    for q in qual]}
+        return SeqRecord(
+            Seq(seq.translate(None, _WHITESPACE).decode('ascii')),
+            id=record_id, name=record_id, description=title,
+            letter_annotations=letter_annotations)
+
+    def __getitem__(self, name):
+        return self.fetch(self._names()[name])
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+
+def _source_path(source_file):
+    """
+    Path of an uncompressed, regular source file, or None
+    """
+    path = source_file if isinstance(source_file, str) else getattr(
+        source_file, 'name', None)
+    if not isinstance(path, str) or path in ('-', '<stdin>', '<fdopen>'):
+        return None
+    if fileformat.compressed_opener(path) is not None:
+        return None
+    if not os.path.isfile(path):
+        return None
+    return path
+
+
+def open_fresh(source_file, file_type):
+    """
+    The sidecar index of ``source_file`` if one exists and is at least as
+    recent as the file itself, otherwise None.
+    """
+    if file_type not in EXTENSIONS:
+        return None
+    path = _source_path(source_file)
+    if path is None:
+        return None
+    sidecar = index_path(path, file_type)
+    try:
+        if os.path.getmtime(sidecar) < os.path.getmtime(path):
+            logging.info("Ignoring out of date index %s", sidecar)
+            return None
+    except OSError:
+        return None
+    logging.info("Using index %s", sidecar)
+    return SequenceIndex.load(path, file_type, sidecar)
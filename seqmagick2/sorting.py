@@ -0,0 +1,87 @@
+"""
+External merge sort of sequence records.
+
+Records are collected in memory up to a budget, sorted, and written as a run
+to a seqmagick2.recordstore.RecordStore temporary file. Runs are then merged,
+reading each sequentially. Sorts are stable: records with equal keys keep
+their input order.
+"""
+import heapq
+import logging
+
+from seqmagick2 import recordstore
+
+# Memory used for records before spilling a sorted run: default to 1GB
+DEFAULT_SORT_MEMORY = 1 << 30
+
+# Maximum number of runs merged at once
+MAX_MERGE_RUNS = 64
+
+# Approximate fixed memory cost of a SeqRecord, in bytes
+_RECORD_OVERHEAD = 1024
+
+
+def record_size(record):
+    """
+    Rough in-memory size of a SeqRecord or FastRecord, in bytes
+    """
+    size = _RECORD_OVERHEAD + len(record) + len(record.description)
+    letter_annotations = getattr(record, 'letter_annotations', None)
+    if letter_annotations:
+        # List of small ints: one pointer each
+        size += 8 * len(record) * len(letter_annotations)
+    elif getattr(record, 'qual', None) is not None:
+        size += len(record.qual)
+    return size
+
+
+def _write_run(records):
+    run = recordstore.RecordStore(0)
+    run.extend(records)
+    return run
+
+
+def _merge(runs, key, reverse):
+    return heapq.merge(*[run() for run in runs], key=key, reverse=reverse)
+
+
+def sort_records(records, key, reverse=False, memory=DEFAULT_SORT_MEMORY):
+    """
+    Sort ``records`` by ``key``, using at most about ``memory`` bytes for
+    records held in memory.
+    """
+    runs = []
+    try:
+        batch, batch_size = [], 0
+        for record in records:
+            batch.append(record)
+            batch_size += record_size(record)
+            if batch_size >= memory:
+                batch.sort(key=key, reverse=reverse)
+                runs.append(_write_run(batch))
+                batch, batch_size = [], 0
+        batch.sort(key=key, reverse=reverse)
+
+        if not runs:
+            yield from batch
+            return
+        if batch:
+            runs.append(_write_run(batch))
+        del batch
+        logging.info("Merging %d sorted runs", len(runs))
+
+        # Merge groups of runs until few enough remain to open at once. Groups
+        # are consecutive, so ties still resolve in input order.
+        while len(runs) > MAX_MERGE_RUNS:
+            merged = []
+            for i in range(0, len(runs), MAX_MERGE_RUNS):
+                group = runs[i:i + MAX_MERGE_RUNS]
+                merged.append(_write_run(_merge(group, key, reverse)))
+                for run in group:
+                    run.close()
+            runs = merged
+
+        yield from _merge(runs, key, reverse)
+    finally:
+        for run in runs:
+            run.close()
@@ -1,5 +1,62 @@
+import importlib
+
 commands = 'convert', 'info', 'mogrify', 'quality_filter', \
-        'extract_ids', 'backtrans_align', 'split', 'msa_view'
+        'extract_ids', 'backtrans_align', 'split', 'msa_view', 'index'
+
+# Subcommand help, matching each module's docstring. Kept here so that the
+# command line parser can be built without importing every subcommand module.
+descriptions = {
+    'convert': """
+Convert between sequence formats / 序列格式转换
+""",
+    'info': """
+Info action / 信息统计
+""",
+    'mogrify': """
+Modify sequence file(s) in place. / 原地修改序列文件
+""",
+    'quality_filter': """
+Filter reads based on quality scores / 按质量分数过滤序列
+""",
+    'extract_ids': """
+Extract the sequence IDs from a file / 从文件中提取序列 ID
+""",
+    'backtrans_align': """
+Given a protein alignment and unaligned nucleotides, align the nucleotides
+using the protein alignment. / 用蛋白比对结果指导核酸对齐
+
+Protein and nucleotide sequence files must contain the same number of
+sequences, in the same order, with the same IDs. / 蛋白与核酸序列数量、顺序、ID 必须一致
+""",
+    'split': """
+Split a FASTA file into per-record files / 按序列拆分 FASTA
+""",
+    'msa_view': """
+Use termal to view the MSA sequence in terminal. / 使用 termal软件在终端查看多序列对齐文件。
+""",
+    'index': """
+Build a sidecar index (.fai / .fqi) for random access to a FASTA or FASTQ
+file / 为 FASTA / FASTQ 文件建立索引
+""",
+}
+
+
+def itercommands():
+    """
+    Yields (name, description) for each subcommand, without importing it
+    """
+    for command in commands:
+        yield command.replace('_', '-'), descriptions[command]
+
+
+def load(name, root=__name__):
+    """
+    Import the module implementing subcommand ``name``
+    """
+    command = name.replace('-', '_')
+    if command not in commands:
+        raise KeyError(name)
+    return importlib.import_module('%s.%s' % (root, command))
 
 
 def itermodules(root=__name__):
@@ -7,12 +7,33 @@ sequences, in the same order, with the same IDs. / 蛋白与核酸序列数量
 """
 
 import argparse
+import collections
+import csv
+import io
+import logging
+import os
+import os.path
+import re
 import sys
 
-from seqmagick2 import pal2nal
+from seqmagick2 import pal2nal, parallel
 
 from . import common
 
+# Output file extension for each output format, in batch mode
+EXTENSIONS = {'clustal': 'aln', 'paml': 'paml', 'fasta': 'fasta',
+              'codon': 'codon'}
+
+# Arguments passed through to pal2nal.run
+PAL2NAL_OPTIONS = ('outform', 'blockonly', 'nogap', 'nomismatch',
+                   'codontable', 'html', 'nostderr')
+
+Family = collections.namedtuple(
+    'Family', ['name', 'protein_align', 'nucl_align', 'out_file'])
+
+FamilyResult = collections.namedtuple(
+    'FamilyResult', ['family', 'ok', 'messages'])
+
 
 def build_parser(parser):
     parser.epilog = (
@@ -21,6 +42,7 @@ def build_parser(parser):
         "  seqmagick2 backtrans-align protein.aln nuc1.fasta nuc2.fasta -output clustal\n"
         "  seqmagick2 backtrans-align protein.aln nuc.fasta -output paml -codontable 2\n"
         "  seqmagick2 backtrans-align protein.aln nuc.fasta -nogap -nomismatch\n"
+        "  seqmagick2 backtrans-align --manifest families.tsv --out-dir codon --threads 8\n"
         "\n"
         "Codon tables / 密码子表:\n"
         "  1  Universal code / 通用密码子表\n"
@@ -43,14 +65,15 @@ def build_parser(parser):
         " 23  Thraustochytrium mitochondrial / Thraustochytrium 线粒体\n"
     )
     parser.add_argument(
-        'protein_align', type=common.FileType('r'),
-        help='Protein Alignment / 蛋白比对文件')
+        'protein_align', nargs='?', type=common.FileType('r'),
+        help='Protein Alignment: CLUSTAL, FASTA, Gblocks, PHYLIP or '
+             'Stockholm / 蛋白比对文件')
     parser.add_argument(
-        'nucl_align', nargs='+', type=common.FileType('r'),
+        'nucl_align', nargs='*', type=common.FileType('r'),
         help='Nucleotide FASTA file(s) / 核酸序列文件（可多个）')
     parser.add_argument(
         '-o', '--out-file', type=common.FileType('w'),
-        default=sys.stdout, metavar='destination_file',
+        metavar='destination_file',
         help='Output destination. Default: STDOUT / 输出位置')
     parser.add_argument(
         '-output', dest='outform',
@@ -76,17 +99,205 @@ def build_parser(parser):
     parser.add_argument(
         '-nostderr', action='store_true',
         help='No STDERR messages / 不输出 STDERR 提示')
+    parser.add_argument(
+        '--threads', metavar='N', type=int, default=1,
+        help="""Number of processes: gene families are processed in parallel
+        with --manifest, otherwise sequences. Output is identical to a single
+        process. [default: %(default)s] / 进程数""")
+
+    batch_group = parser.add_argument_group('Batch mode / 批处理模式')
+    batch_group.add_argument(
+        '--manifest', type=common.FileType('r'), metavar='FILE',
+        help="""Back-translate every gene family listed in FILE instead of
+        protein_align and nucl_align. FILE is tab-delimited, one family per
+        line: protein alignment, nucleotide FASTA file and, optionally, the
+        output file. Blank lines and lines starting with '#' are ignored.
+        / 批量处理清单（制表符分隔：蛋白比对、核酸序列、可选输出文件）""")
+    batch_group.add_argument(
+        '--out-dir', metavar='DIR', default='.',
+        help="""Directory for outputs not named in the manifest, which are
+        named after the protein alignment, e.g. DIR/family1.aln
+        [default: current directory] / 批处理输出目录""")
+    batch_group.add_argument(
+        '--summary', type=common.FileType('w'), metavar='FILE',
+        help="""Write the status of each family, tab-delimited, to FILE
+        / 输出每个基因家族处理状态的汇总表""")
+
+    # For usage errors found in action
+    parser.set_defaults(parser=parser)
 
     return parser
 
 
+def read_manifest(fp, out_dir, outform):
+    """
+    Parse a batch manifest into a list of Family.
+
+    Each line holds the protein alignment, the nucleotide file and,
+    optionally, the output file, separated by tabs. Output files default to
+    ``out_dir``, named after the protein alignment.
+    """
+    families = []
+    outputs = {}
+    for line_number, line in enumerate(fp, start=1):
+        if not line.strip() or line.startswith('#'):
+            continue
+        fields = [f.strip() for f in line.rstrip('\r\n').split('\t')]
+        if len(fields) not in (2, 3) or not all(fields):
+            raise ValueError("{0}, line {1}: expected protein alignment, "
+                             "nucleotide file and optional output file".format(
+                                 fp.name, line_number))
+        protein_align, nucl_align = fields[:2]
+        name = os.path.splitext(os.path.basename(protein_align))[0]
+        if len(fields) == 3:
+            out_file = fields[2]
+        else:
+            out_file = os.path.join(out_dir,
+                                    '{0}.{1}'.format(name, EXTENSIONS[outform]))
+        out_path = os.path.abspath(out_file)
+        if out_path in outputs:
+            raise ValueError("{0}, line {1}: output {2} is also written by "
+                             "line {3}".format(fp.name, line_number, out_file,
+                                               outputs[out_path]))
+        if out_path in (os.path.abspath(protein_align),
+                        os.path.abspath(nucl_align)):
+            raise ValueError("{0}, line {1}: output {2} would overwrite an "
+                             "input".format(fp.name, line_number, out_file))
+        outputs[out_path] = line_number
+        families.append(Family(name, protein_align, nucl_align, out_file))
+    return families
+
+
+def backtrans_family(family, options):
+    """
+    Back-translate one gene family, writing its output file.
+
+    Errors are returned, rather than raised, in a FamilyResult along with
+    any messages pal2nal printed.
+    """
+    out, err = io.StringIO(), io.StringIO()
+    try:
+        pal2nal.run(family.protein_align, [family.nucl_align], out, err,
+                    options)
+        with common.atomic_write(family.out_file) as handle:
+            handle.write(out.getvalue())
+    except SystemExit:
+        # pal2nal has written the error; with -html, to the output
+        messages = err.getvalue() if not options.html else out.getvalue()
+        return FamilyResult(family, False, messages)
+    except Exception as e:
+        messages = err.getvalue() + "ERROR: {0}\n".format(e)
+        return FamilyResult(family, False, messages)
+    return FamilyResult(family, True, err.getvalue())
+
+
+_worker_options = None
+
+
+def _set_options(options):
+    global _worker_options
+    _worker_options = options
+
+
+def _backtrans_families(families):
+    return [backtrans_family(family, _worker_options) for family in families]
+
+
+def imap_families(families, options, threads=1):
+    """
+    Back-translate ``families`` in ``threads`` worker processes, yielding a
+    FamilyResult for each in input order.
+    """
+    if threads <= 1:
+        for family in families:
+            yield backtrans_family(family, options)
+        return
+    logging.info("Back-translating %d families using %d processes",
+                 len(families), threads)
+    batches = parallel.imap_batches(families, _backtrans_families, threads,
+                                    _set_options, (options,), batch_size=1)
+    for _, results in batches:
+        for result in results:
+            yield result
+
+
+def _error_summary(messages):
+    """
+    One line summary of pal2nal's error output: the first error, and the
+    sequence it concerns, if given
+    """
+    lines = [re.sub(r'<[^>]*>', '', line).strip(' #-')
+             for line in messages.splitlines()]
+    lines = [line for line in lines if line]
+    for i, line in enumerate(lines):
+        if line.startswith('ERROR'):
+            if i + 1 < len(lines) and lines[i + 1].startswith('>'):
+                line = '{0} ({1})'.format(line, lines[i + 1][1:])
+            return line
+    return lines[0] if lines else ''
+
+
+def batch_action(arguments, options):
+    with arguments.manifest:
+        try:
+            families = read_manifest(arguments.manifest, arguments.out_dir,
+                                     options.outform)
+        except ValueError as e:
+            arguments.parser.error(str(e))
+    os.makedirs(arguments.out_dir, exist_ok=True)
+
+    failed = 0
+    writer = None
+    if arguments.summary:
+        writer = csv.writer(arguments.summary, delimiter='\t',
+                            lineterminator='\n')
+        writer.writerow(('family', 'protein_align', 'nucl_align', 'out_file',
+                         'status', 'message'))
+    try:
+        for result in imap_families(families, options, arguments.threads):
+            family = result.family
+            sys.stderr.write(result.messages)
+            if not result.ok:
+                failed += 1
+                logging.error("%s: back-translation failed", family.name)
+            if writer is not None:
+                writer.writerow(family[:3] + (
+                    family.out_file if result.ok else '',
+                    'ok' if result.ok else 'error',
+                    '' if result.ok else _error_summary(result.messages)))
+    finally:
+        if arguments.summary:
+            arguments.summary.close()
+
+    sys.stderr.write("# {0} of {1} gene families back-translated\n".format(
+        len(families) - failed, len(families)))
+    if failed:
+        raise SystemExit(1)
+
+
 def action(arguments):
     common.exit_on_sigpipe()
 
+    options = argparse.Namespace(**{k: getattr(arguments, k)
+                                    for k in PAL2NAL_OPTIONS})
+    if arguments.manifest:
+        if arguments.protein_align or arguments.nucl_align:
+            arguments.parser.error("--manifest cannot be combined with "
+                                   "protein_align and nucl_align")
+        if arguments.out_file:
+            arguments.parser.error("-o/--out-file cannot be combined with "
+                                   "--manifest; use --out-dir or the "
+                                   "manifest's output column")
+        return batch_action(arguments, options)
+    if not arguments.protein_align or not arguments.nucl_align:
+        arguments.parser.error("protein_align and nucl_align are required "
+                               "without --manifest")
+
     protein_path = arguments.protein_align.name
     nuc_paths = [n.name for n in arguments.nucl_align]
     try:
-        pal2nal.run(protein_path, nuc_paths, arguments.out_file, sys.stderr, arguments)
+        pal2nal.run(protein_path, nuc_paths, arguments.out_file or sys.stdout,
+                    sys.stderr, options, arguments.threads)
     finally:
         if hasattr(arguments.protein_align, 'close'):
             arguments.protein_align.close()
@@ -13,7 +13,7 @@ import sys
 import tempfile
 import time
 
-from seqmagick2 import fileformat
+from seqmagick2 import compression, fileformat
 
 def get_umask():
     """
@@ -53,24 +53,29 @@ def atomic_write(path, mode='wt', permissions=None, file_factory=None, **kwargs)
     if path == '-':
         yield sys.stdout
     else:
+        # Fail before creating the temporary file if the factory can tell
+        # that it cannot open path
+        check = getattr(file_factory, 'check', None)
+        if check is not None:
+            check(path)
         base_dir = os.path.dirname(path)
         kwargs['suffix'] = os.path.basename(path)
         tf = tempfile.NamedTemporaryFile(
             dir=base_dir, mode=mode, delete=False, **kwargs)
-
-        # If a file_factory is given, close, and re-open a handle using the
-        # file_factory
-        if file_factory is not None:
-            tf.close()
-            tf = file_factory(tf.name)
+        name = tf.name
         try:
+            # If a file_factory is given, close, and re-open a handle using
+            # the file_factory
+            if file_factory is not None:
+                tf.close()
+                tf = file_factory(name)
             with tf:
                 yield tf
             # Move
             os.rename(tf.name, path)
             os.chmod(path, permissions)
         except:
-            os.remove(tf.name)
+            os.remove(name)
             raise
 
 def sequence_slices(string):
@@ -194,6 +199,27 @@ def positive_value(target_type):
 
     return inner
 
+_SIZE_SUFFIXES = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30,
+                  'T': 1 << 40}
+
+
+def memory_size(string):
+    """
+    Parses a size in bytes, with an optional K, M, G or T suffix
+    (powers of 1024)
+    """
+    value = string.strip().upper()
+    if value.endswith('B'):
+        value = value[:-1]
+    suffix = value[-1:] if value[-1:] in _SIZE_SUFFIXES else ''
+    try:
+        size = float(value[:len(value) - len(suffix)])
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid size: " + string)
+    if size <= 0:
+        raise argparse.ArgumentTypeError("Invalid size: " + string)
+    return int(size * _SIZE_SUFFIXES[suffix])
+
 def _exit_on_signal(sig, status=None, message=None):
     def exit(sig, frame):
         if message:
@@ -218,15 +244,32 @@ def exit_on_sigpipe(status=None):
 
 class FileType(object):
     """
-    Near clone of argparse.FileType, supporting gzip and bzip
+    Near clone of argparse.FileType, supporting compressed files - see
+    seqmagick2.compression
     """
-    def __init__(self, mode='rt'):
+    def __init__(self, mode='rt', compress_level=None, compress_threads=None):
         self.mode = mode
+        self.compress_level = compress_level
+        self.compress_threads = compress_threads
         self.ext_map = fileformat.COMPRESS_EXT.copy()
 
+    def check(self, file_path):
+        """
+        Raises ValueError if a package needed to open ``file_path`` is
+        missing
+        """
+        ext = os.path.splitext(file_path)[1].lower()
+        if self.ext_map.get(ext) is compression.open_zstd:
+            compression.require_zstd(file_path, self.mode)
+
     def _get_handle(self, file_path):
+        self.check(file_path)
         ext = os.path.splitext(file_path)[1].lower()
-        return self.ext_map.get(ext, open)(file_path, self.mode)
+        if ext not in self.ext_map:
+            return open(file_path, self.mode)
+        return self.ext_map[ext](file_path, self.mode,
+                                 level=self.compress_level,
+                                 threads=self.compress_threads)
 
     def __call__(self, string):
         if string == '-':
@@ -240,6 +283,29 @@ class FileType(object):
             return self._get_handle(string)
 
 
+def add_compression_options(parser):
+    """
+    Add --compress-level and --compress-threads, for FileType outputs
+    """
+    group = parser.add_argument_group("Compression / 压缩")
+    group.add_argument('--compress-level', metavar='LEVEL', type=int,
+        choices=range(10), help="""Compression level (0-9) for compressed
+        output files [default: 6 for .gz, library default otherwise]
+        / 压缩级别""")
+    group.add_argument('--compress-threads', metavar='N',
+        type=positive_value(int), help="""Threads used to compress .gz
+        output, written as BGZF [default: number of CPUs, at most 8]
+        / 压缩线程数""")
+
+
+def output_file_type(arguments, mode='wt'):
+    """
+    FileType for outputs, using the options from add_compression_options
+    """
+    return FileType(mode, compress_level=arguments.compress_level,
+                    compress_threads=arguments.compress_threads)
+
+
 def maybe_profile_iterable(name, iterable, log_every=100000):
     """
     Optionally profile iterable throughput when SEQMAGICK2_PROFILE is set.
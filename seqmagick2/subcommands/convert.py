@@ -10,7 +10,7 @@ import random
 
 from Bio import SeqIO
 from Bio.SeqIO import FastaIO
-from seqmagick2 import transform
+from seqmagick2 import fastrecord, parallel, seqindex, sorting, transform
 from seqmagick2.fileformat import from_handle
 
 from . import common
@@ -46,6 +46,15 @@ class RenameDelimiterAction(argparse.Action):
         setattr(namespace, self.dest, values)
 
 
+def rename_transform(records, mapping_handle, state):
+    """
+    Apply --rename, using the --rename-delimiter in effect once all arguments
+    are parsed.
+    """
+    return transform.rename_sequences(
+        records, mapping_handle, state['delimiter'])
+
+
 class RenameAction(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
         handle = values
@@ -55,12 +64,9 @@ class RenameAction(argparse.Action):
                 getattr(namespace, 'rename_delimiter', '\\t'))}
             setattr(namespace, 'rename_state', state)
 
-        def rename_transform(records, mapping_handle=handle, state=state):
-            return transform.rename_sequences(
-                records, mapping_handle, state['delimiter'])
-
         items = copy.copy(getattr(namespace, 'transforms', None)) or []
-        items.append(rename_transform)
+        items.append(functools.partial(rename_transform,
+                                       mapping_handle=handle, state=state))
         setattr(namespace, 'transforms', items)
         setattr(namespace, self.dest, handle)
 
@@ -79,6 +85,17 @@ def add_options(parser):
         help='Perform sorting by length or name, ascending or descending. '
         'ASCII sorting is performed for names / 按长度或名称排序')
 
+    file_mods.add_argument('--sort-memory', dest='sort_memory',
+        metavar='SIZE', type=common.memory_size,
+        default=sorting.DEFAULT_SORT_MEMORY,
+        help='Memory used to hold records while sorting, e.g. 500M or 4G. '
+        'Larger inputs are sorted in runs spilled to temporary files. '
+        '[1G] / 排序时使用的内存上限，超出部分写入临时文件')
+
+    file_mods.add_argument('--threads', default=1, type=int, metavar='N',
+        help='Number of processes used to apply per-record transforms. '
+        'Output order is preserved. [%(default)s] / 进程数')
+
     parser.epilog = """Filters using regular expressions are case-sensitive
     by default. Append "(?i)" to a pattern to make it case-insensitive.
     / 正则过滤默认区分大小写，可在模式后加 (?i) 忽略大小写。"""
@@ -284,6 +301,8 @@ def add_options(parser):
     parser.add_argument('--alphabet', choices=ALPHABETS,
             help="""Input alphabet. Required for writing NEXUS. / 指定字母表（写 NEXUS 必需）""")
 
+    common.add_compression_options(parser)
+
     return parser
 
 
@@ -307,6 +326,83 @@ def append_annotation_iterator(records_iterator, alphabet):
         yield record
 
 
+def apply_transforms(records, transforms, arguments):
+    """
+    Chain ``transforms`` onto ``records``. With --threads, the leading
+    stateless transforms (see seqmagick2.parallel) are applied to batches of
+    records in worker processes; the parent process applies the rest.
+
+    ``transforms`` corresponds one-to-one with ``arguments.transforms``.
+    """
+    threads = getattr(arguments, 'threads', 1) or 1
+    n = 0
+    if threads > 1:
+        n = parallel.stateless_prefix_length(
+            arguments.transforms, parallel.STATELESS | {rename_transform})
+    if n:
+        records = parallel.imap_transforms(records, transforms[:n], threads)
+    for function in transforms[n:]:
+        records = function(records)
+    return records
+
+
+def _fast_transforms(arguments, source_file_type, destination_file_type):
+    """
+    Returns the transforms to apply to FastRecords, or None if the
+    conversion requires SeqRecords.
+    """
+    if not fastrecord.supports(source_file_type, destination_file_type):
+        return None
+    if (arguments.sort or arguments.cut_relative or arguments.apply_function
+            or arguments.name_standard):
+        return None
+    return fastrecord.convert_transforms(arguments.transforms)
+
+
+def fast_transform_file(source_file, destination_file, arguments,
+                        source_file_type, destination_file_type, transforms):
+    """
+    Equivalent of transform_file for FASTA / FASTQ, operating on raw bytes.
+    """
+    logging.info("Using fast %s -> %s record path",
+                 source_file_type, destination_file_type)
+    records = fastrecord.parse(source_file, source_file_type)
+
+    if transforms and arguments.sample_seed is not None:
+        random.seed(arguments.sample_seed)
+    records = apply_transforms(records, transforms, arguments)
+
+    if (arguments.deduplicate_sequences or
+            arguments.deduplicate_sequences is None):
+        records = fastrecord.deduplicate_sequences(
+            records, arguments.deduplicate_sequences)
+
+    records = common.maybe_profile_iterable('convert.write', records)
+
+    wrap = 60
+    if arguments.line_wrap is not None and destination_file_type == 'fasta':
+        wrap = arguments.line_wrap
+    logging.info("Applying transformations, writing to %s", destination_file)
+    fastrecord.write(records, destination_file, destination_file_type,
+                     wrap=wrap)
+
+
+def _indexed_reference(source_file, source_file_type, arguments):
+    """
+    The --relative-to record, read from the sidecar index of the source file
+    if it has an up to date one.
+    """
+    index = seqindex.open_fresh(source_file, source_file_type)
+    if index is None:
+        return None
+    with index:
+        try:
+            return index[arguments.cut_relative]
+        except KeyError:
+            raise ValueError("Record with id {0} not found.".format(
+                arguments.cut_relative))
+
+
 def transform_file(source_file, destination_file, arguments):
     # Get just the file name, useful for naming the temporary file.
     source_file_type = (arguments.input_format or from_handle(source_file))
@@ -314,6 +410,13 @@ def transform_file(source_file, destination_file, arguments):
     destination_file_type = (arguments.output_format or
             from_handle(destination_file))
 
+    fast_transforms = _fast_transforms(arguments, source_file_type,
+                                       destination_file_type)
+    if fast_transforms is not None:
+        return fast_transform_file(source_file, destination_file, arguments,
+                                   source_file_type, destination_file_type,
+                                   fast_transforms)
+
     # Get an iterator.
     sorters = {'length': transform.sort_length,
                'name': transform.sort_name,}
@@ -323,7 +426,8 @@ def transform_file(source_file, destination_file, arguments):
         key, direction = arguments.sort.split('-')
         records = sorters[key](source_file=source_file,
                 source_file_type=source_file_type,
-                direction=directions[direction])
+                direction=directions[direction],
+                memory=arguments.sort_memory)
     else:
         # Unsorted iterator.
         records = SeqIO.parse(source_file, source_file_type)
@@ -355,12 +459,18 @@ def transform_file(source_file, destination_file, arguments):
                     continue
                 i = arguments.transforms.index(f)
                 arguments.transforms.pop(i)
+                # Records reach the first transform unchanged, so the
+                # reference may come straight from the source file's index
+                reference = None
+                if i == 0:
+                    reference = _indexed_reference(
+                        source_file, source_file_type, arguments)
                 arguments.transforms.insert(i,
                         functools.partial(n,
-                            record_id=arguments.cut_relative, **f.keywords))
+                            record_id=arguments.cut_relative,
+                            reference=reference, **f.keywords))
 
-        for function in arguments.transforms:
-            records = function(records)
+        records = apply_transforms(records, arguments.transforms, arguments)
 
     if (arguments.deduplicate_sequences or
             arguments.deduplicate_sequences is None):
@@ -381,7 +491,7 @@ def transform_file(source_file, destination_file, arguments):
     map_context = contextlib.nullcontext()
     if arguments.name_standard:
         map_context = common.atomic_write(
-            map_path, file_factory=common.FileType('wt'))
+            map_path, file_factory=common.output_file_type(arguments))
 
     with map_context as map_handle:
         if arguments.name_standard:
@@ -447,5 +557,6 @@ def module_function(string):
 def action(arguments):
     with arguments.source_file as src, \
             common.atomic_write(
-                arguments.dest_file, file_factory=common.FileType('wt')) as dest:
+                arguments.dest_file,
+                file_factory=common.output_file_type(arguments)) as dest:
         transform_file(src, dest, arguments)
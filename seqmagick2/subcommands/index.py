@@ -0,0 +1,40 @@
+"""
+Build a sidecar index (.fai / .fqi) for random access to a FASTA or FASTQ
+file / 为 FASTA / FASTQ 文件建立索引
+"""
+import logging
+
+from seqmagick2 import fileformat, seqindex
+
+from . import common
+
+
+def build_parser(parser):
+    parser.add_argument(
+        'sequence_file',
+        help="Uncompressed FASTA or FASTQ file / 未压缩的 FASTA 或 FASTQ 文件")
+    parser.add_argument(
+        '--input-format',
+        help="Input format, overriding the file extension / 输入文件格式")
+    parser.add_argument(
+        '-o', '--output-file',
+        help="""Index path [default: sequence_file with .fai (FASTA) or .fqi
+        (FASTQ) appended] / 索引文件路径""")
+
+
+def action(arguments):
+    source_format = (arguments.input_format or
+                     fileformat.from_filename(arguments.sequence_file))
+    if source_format not in seqindex.EXTENSIONS:
+        raise ValueError("Cannot index {0} files; only {1} are supported".format(
+            source_format, ', '.join(sorted(seqindex.EXTENSIONS))))
+    if fileformat.compressed_opener(arguments.sequence_file) is not None:
+        raise ValueError("Compressed files cannot be indexed")
+
+    output_path = (arguments.output_file or
+                   seqindex.index_path(arguments.sequence_file, source_format))
+    index = seqindex.SequenceIndex.build(arguments.sequence_file,
+                                         source_format)
+    with common.atomic_write(output_path) as handle:
+        index.write(handle)
+    logging.info("Indexed %d records to %s", len(index), output_path)
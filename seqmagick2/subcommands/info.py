@@ -5,15 +5,21 @@ Info action / 信息统计
 import collections
 import csv
 import itertools
+import logging
 import multiprocessing
+import os
 import sys
 
 from functools import partial
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 from Bio import SeqIO
-from Bio.SeqUtils import ProtParam
 
-from seqmagick2 import fileformat
+from seqmagick2 import fileformat, parallel, protein, resultcache, scan
 
 from . import common
 
@@ -33,11 +39,30 @@ def build_parser(parser):
         the console. / 输出格式：tab、csv 或对齐文本表格。默认：写文件为 tab，输出到终端为对齐""")
     parser.add_argument('--threads', default=1,
             type=int,
-            help="""Number of threads (CPUs). [%(default)s] / 线程数""")
+            help="""Number of worker processes (CPUs), for file summaries
+            and for --more. [%(default)s] / 工作进程数，用于文件汇总及 --more""")
     parser.add_argument('-more', '--more', dest='more', action='store_true',
             help="Output per-sequence details (length, GC%%, N count, gaps, "
                  "base counts, and protein properties when detected). / 输出每条序列详情")
 
+    cache_group = parser.add_argument_group('Cache / 缓存')
+    cache_group.add_argument('--cache-dir', metavar='DIR',
+            default=os.environ.get(resultcache.ENVIRONMENT_VARIABLE),
+            help="""Cache results in DIR, rescanning only new or changed
+            files. Default: $%s if set, otherwise no cache
+            / 结果缓存目录，仅重新统计新增或修改的文件""" %
+            resultcache.ENVIRONMENT_VARIABLE)
+    cache_group.add_argument('--cache-size', metavar='MB', type=int,
+            default=resultcache.DEFAULT_MAX_SIZE >> 20,
+            help="""Maximum size of cached results; least recently used
+            results are evicted beyond it. [%(default)s] / 缓存大小上限（MB）""")
+    cache_group.add_argument('--cache-hash', action='store_true',
+            help="""Identify files by a hash of their contents as well as
+            their size and modification time / 同时按文件内容哈希识别文件""")
+    cache_group.add_argument('--no-cache', action='store_true',
+            help="""Neither read nor write the cache, even if
+            $%s is set / 不使用缓存""" % resultcache.ENVIRONMENT_VARIABLE)
+
 class SeqInfoWriter(object):
     """
     Base writer for sequence files
@@ -206,6 +231,9 @@ _DNA_CHARS = set('ACGTRYSWKMBDHVN')
 _RNA_CHARS = set('ACGURYSWKMBDHVN')
 _PROTEIN_CHARS = set('ACDEFGHIKLMNPQRSTVWYBJZXUO*')
 _PROTEIN_CANONICAL = set('ACDEFGHIKLMNPQRSTVWY')
+_GAP_CHARS = frozenset('-.')
+
+_ORD = {c: ord(c) for c in 'ACGTUN-.'}
 
 def _format_optional_float(value):
     if value is None:
@@ -221,9 +249,13 @@ def _strip_protein_fields(row):
     return row[:-2]
 
 def _detect_seq_type(seq):
-    letters = set(seq)
-    letters.discard('-')
-    letters.discard('.')
+    return _letters_seq_type(set(seq))
+
+def _letters_seq_type(letters):
+    """
+    Sequence type from the set of letters in a sequence
+    """
+    letters = letters - _GAP_CHARS
     if not letters:
         return 'UNKNOWN'
 
@@ -244,11 +276,54 @@ def _detect_seq_type(seq):
 
     return 'UNKNOWN'
 
+def _histogram(seq):
+    """
+    Count of each byte value in ``seq``, as a list of 256
+    """
+    if np is not None:
+        return np.bincount(np.frombuffer(seq, dtype=np.uint8),
+                           minlength=256).tolist()
+    histogram = [0] * 256
+    for value, count in collections.Counter(seq).items():
+        histogram[value] = count
+    return histogram
+
+def _parsed_lengths(source_file, file_type):
+    """
+    Yields the length of each record in ``source_file``, in a tuple, parsing
+    records with Bio.SeqIO
+    """
+    with common.FileType('rt')(source_file) as fp:
+        if not file_type:
+            file_type = fileformat.from_handle(fp)
+        for record in SeqIO.parse(fp, file_type):
+            yield (len(record),)
+
+
 def summarize_sequence_file(source_file, file_type=None):
     """
     Summarizes a sequence file, returning a tuple containing the name,
     whether the file is an alignment, minimum sequence length, maximum
     sequence length, average length, number of sequences.
+
+    FASTA and FASTQ files are scanned for sequence lengths without parsing
+    records where possible - see seqmagick2.scan.
+    """
+    if source_file != '-':
+        scan_type = file_type or fileformat.from_filename(source_file)
+        if scan_type in scan.FORMATS:
+            try:
+                return _summarize_lengths(
+                    source_file, scan.sequence_lengths(source_file, scan_type))
+            except scan.Unsupported as e:
+                logging.debug("Parsing %s: %s", source_file, e)
+    return _summarize_lengths(source_file,
+                              _parsed_lengths(source_file, file_type))
+
+
+def _summarize_lengths(source_file, chunks):
+    """
+    Summary row from lists of sequence lengths
     """
     is_alignment = True
     avg_length = None
@@ -256,13 +331,9 @@ def summarize_sequence_file(source_file, file_type=None):
     max_length = 0
     sequence_count = 0
 
-    # Get an iterator and analyze the data.
-    with common.FileType('rt')(source_file) as fp:
-        if not file_type:
-            file_type = fileformat.from_handle(fp)
-        for record in SeqIO.parse(fp, file_type):
+    for lengths in chunks:
+        for sequence_length in lengths:
             sequence_count += 1
-            sequence_length = len(record)
             if max_length != 0:
                 # If even one sequence is not the same length as the others,
                 # we don't consider this an alignment.
@@ -292,44 +363,155 @@ def summarize_sequence_file(source_file, file_type=None):
             max_length, avg_length, sequence_count)
 
 
+def sequence_details(source_file, record_id, seq):
+    """
+    Detail row for a sequence, given as bytes. Letters are counted in a
+    single pass over the sequence.
+    """
+    seq = seq.upper()
+    histogram = _histogram(seq)
+    length = len(seq)
+    gap_count = histogram[_ORD['-']] + histogram[_ORD['.']]
+    n_count = histogram[_ORD['N']]
+    seq_type = _letters_seq_type(
+        set(chr(value) for value, count in enumerate(histogram) if count))
+
+    if seq_type in ('DNA', 'RNA'):
+        a_count = histogram[_ORD['A']]
+        c_count = histogram[_ORD['C']]
+        g_count = histogram[_ORD['G']]
+        t_count = histogram[_ORD['T']]
+        u_count = histogram[_ORD['U']]
+    else:
+        a_count = c_count = g_count = t_count = u_count = None
+
+    non_gap = length - gap_count
+    if non_gap and seq_type in ('DNA', 'RNA'):
+        gc_pct = ((g_count + c_count) / float(non_gap)) * 100.0
+    else:
+        gc_pct = None
+
+    aa_pi = None
+    aa_gravy = None
+    if seq_type == 'PROTEIN':
+        aa_pi, aa_gravy = protein.properties(seq, histogram)
+
+    return (source_file, record_id, length, gc_pct, n_count, gap_count,
+            seq_type, a_count, c_count, g_count, t_count, u_count,
+            aa_pi, aa_gravy)
+
+
+def _sequences(source_files, file_type=None):
+    """
+    Yields ``(source_file, id, sequence bytes)`` for each record of each of
+    ``source_files``
+    """
+    for source_file in source_files:
+        with common.FileType('rt')(source_file) as fp:
+            source_type = file_type or fileformat.from_handle(fp)
+            for record in SeqIO.parse(fp, source_type):
+                yield source_file, record.id, bytes(record.seq)
+
+
 def iter_sequence_details(source_file, file_type=None):
-    with common.FileType('rt')(source_file) as fp:
-        if not file_type:
-            file_type = fileformat.from_handle(fp)
-        for record in SeqIO.parse(fp, file_type):
-            seq = str(record.seq).upper()
-            length = len(record)
-            gap_count = seq.count('-') + seq.count('.')
-            n_count = seq.count('N')
-            seq_type = _detect_seq_type(seq)
-
-            if seq_type in ('DNA', 'RNA'):
-                a_count = seq.count('A')
-                c_count = seq.count('C')
-                g_count = seq.count('G')
-                t_count = seq.count('T')
-                u_count = seq.count('U')
-            else:
-                a_count = c_count = g_count = t_count = u_count = None
+    for sequence in _sequences([source_file], file_type):
+        yield sequence_details(*sequence)
 
-            non_gap = length - gap_count
-            if non_gap and seq_type in ('DNA', 'RNA'):
-                gc_pct = ((g_count + c_count) / float(non_gap)) * 100.0
-            else:
-                gc_pct = None
 
-            aa_pi = None
-            aa_gravy = None
-            if seq_type == 'PROTEIN':
-                aa_seq = ''.join([aa for aa in seq if aa in _PROTEIN_CANONICAL])
-                if aa_seq:
-                    analysis = ProtParam.ProteinAnalysis(aa_seq)
-                    aa_pi = analysis.isoelectric_point()
-                    aa_gravy = analysis.gravy()
+def _details_batch(sequences):
+    return [sequence_details(*sequence) for sequence in sequences]
+
+
+def imap_sequence_details(source_files, file_type=None, threads=1,
+                          batch_size=parallel.DEFAULT_BATCH_SIZE):
+    """
+    Detail rows for each record of ``source_files``, in order, calculated
+    for batches of records in ``threads`` worker processes.
+    """
+    sequences = _sequences(source_files, file_type)
+    if threads <= 1:
+        for sequence in sequences:
+            yield sequence_details(*sequence)
+        return
+    for _, rows in parallel.imap_batches(sequences, _details_batch, threads,
+                                         batch_size=batch_size):
+        for row in rows:
+            yield row
+
+
+def _indexed_details_batch(sequences):
+    return [(sequence[0], sequence_details(*sequence[1:]))
+            for sequence in sequences]
+
+
+def _details_by_file(source_files, file_type=None, threads=1,
+                     batch_size=parallel.DEFAULT_BATCH_SIZE):
+    """
+    Yields the list of detail rows of each of ``source_files``, in order
+    """
+    sequences = ((i,) + sequence for i, source_file in enumerate(source_files)
+                 for sequence in _sequences([source_file], file_type))
+    if threads <= 1:
+        rows = ((sequence[0], sequence_details(*sequence[1:]))
+                for sequence in sequences)
+    else:
+        rows = (row for _, batch in parallel.imap_batches(
+                    sequences, _indexed_details_batch, threads,
+                    batch_size=batch_size)
+                for row in batch)
+    index, file_rows = 0, []
+    for i, row in rows:
+        while index < i:
+            yield file_rows
+            index, file_rows = index + 1, []
+        file_rows.append(row)
+    while index < len(source_files):
+        yield file_rows
+        index, file_rows = index + 1, []
+
+
+def _summaries(source_files, file_type=None, threads=1):
+    ssf = partial(summarize_sequence_file, file_type=file_type)
+
+    # if only one thread, do not use the multithreading so parent process
+    # can be terminated using ctrl+c
+    if threads > 1 and source_files:
+        pool = multiprocessing.Pool(processes=threads)
+        return pool.imap(ssf, source_files)
+    return (ssf(f) for f in source_files)
+
+
+def _cached(cache, kind, source_files, file_type, compute):
+    """
+    Yields the ``kind`` result for each of ``source_files``: from ``cache``
+    where it holds one for the file as it is now, otherwise from
+    ``compute(misses)``, which yields results for the other files, in
+    order. Computed results are stored.
+
+    Results are rows, or lists of rows, starting with the file name, which
+    is not stored.
+    """
+    def strip(result):
+        if kind == 'summary':
+            return result[1:]
+        return [row[1:] for row in result]
+
+    def restore(source_file, value):
+        if kind == 'summary':
+            return (source_file,) + tuple(value)
+        return [(source_file,) + tuple(row) for row in value]
+
+    cached = [cache.get(kind, f, file_type) for f in source_files]
+    computed = compute([f for f, value in zip(source_files, cached)
+                        if value is None])
+    for source_file, value in zip(source_files, cached):
+        if value is None:
+            result = next(computed)
+            cache.put(kind, source_file, file_type, strip(result))
+            yield result
+        else:
+            yield restore(source_file, value)
 
-            yield (source_file, record.id, length, gc_pct, n_count, gap_count,
-                   seq_type, a_count, c_count, g_count, t_count, u_count,
-                   aa_pi, aa_gravy)
 
 def action(arguments):
     """
@@ -350,11 +532,25 @@ def action(arguments):
         except AttributeError:
             output_format = 'tab'
 
+    cache = None
+    if arguments.cache_dir and not arguments.no_cache:
+        cache = resultcache.ResultCache(arguments.cache_dir,
+                                        arguments.cache_size << 20,
+                                        arguments.cache_hash)
+
+    source_files = arguments.source_files
+    file_type = arguments.input_format
     if arguments.more:
         writer_cls = _DETAIL_WRITERS[output_format]
-        rows = (row for f in arguments.source_files
-                for row in iter_sequence_details(
-                    f, file_type=arguments.input_format))
+        if cache is None:
+            rows = imap_sequence_details(source_files, file_type=file_type,
+                                         threads=arguments.threads)
+        else:
+            rows = (row for file_rows in _cached(
+                        cache, 'details', source_files, file_type,
+                        partial(_details_by_file, file_type=file_type,
+                                threads=arguments.threads))
+                    for row in file_rows)
         headers = _DETAIL_HEADERS_NUC
         try:
             first_row = next(rows)
@@ -372,20 +568,21 @@ def action(arguments):
                                         for row in rows))
     else:
         writer_cls = _WRITERS[output_format]
-        ssf = partial(summarize_sequence_file, file_type=arguments.input_format)
-
-        # if only one thread, do not use the multithreading so parent process
-        # can be terminated using ctrl+c
-        if arguments.threads > 1:
-            pool = multiprocessing.Pool(processes=arguments.threads)
-            rows = pool.imap(ssf, arguments.source_files)
+        compute = partial(_summaries, file_type=file_type,
+                          threads=arguments.threads)
+        if cache is None:
+            rows = compute(source_files)
         else:
-            rows = (ssf(f) for f in arguments.source_files)
+            rows = _cached(cache, 'summary', source_files, file_type, compute)
 
-    with handle:
-        if arguments.more:
-            writer = writer_cls(arguments.source_files, rows, handle,
-                                headers=headers)
-        else:
-            writer = writer_cls(arguments.source_files, rows, handle)
-        writer.write()
+    try:
+        with handle:
+            if arguments.more:
+                writer = writer_cls(source_files, rows, handle,
+                                    headers=headers)
+            else:
+                writer = writer_cls(source_files, rows, handle)
+            writer.write()
+    finally:
+        if cache is not None:
+            cache.close()
@@ -46,7 +46,8 @@ def action(arguments):
         arguments.map_file = map_path
         # Generate a temporary file
         with common.atomic_write(
-                input_file.name, file_factory=common.FileType('wt')) as tf:
+                input_file.name,
+                file_factory=common.output_file_type(arguments)) as tf:
             convert.transform_file(input_file, tf, arguments)
             if hasattr(input_file, 'close'):
                 input_file.close()
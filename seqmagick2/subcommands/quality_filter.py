@@ -3,6 +3,7 @@ Filter reads based on quality scores / 按质量分数过滤序列
 """
 
 import collections
+import copy
 import csv
 import itertools
 import logging
@@ -11,27 +12,127 @@ import sys
 import time
 
 from Bio import SeqIO
-import pygtrie as trie
 from Bio.SeqIO import QualityIO
 
-from seqmagick2 import fileformat, __version__
-from .common import typed_range, FileType, maybe_profile_iterable
+from seqmagick2 import fastrecord, fileformat, parallel, quality, __version__
+from .common import (typed_range, positive_value, FileType,
+                     maybe_profile_iterable, add_compression_options,
+                     output_file_type)
 
 
-def trie_match(string, trie):
-    def has_prefix(teststring, trie):
-        for key in trie.keys():
-            if key.startswith(teststring):
-                return True
-        return False
-    longest = None
-    for i in range(len(string)):
-        substr = string[:i + 1]
-        if not has_prefix(substr, trie):
-            break
-        if trie.has_key(substr):
-            longest = substr
-    return longest
+# Key holding the value at a node which ends a barcode
+_END = None
+
+
+class BarcodeTrie(object):
+    """
+    Map from barcode (and primer) sequences to sample IDs, as a trie of
+    nested dicts, one level per base.
+    """
+
+    def __init__(self, items=()):
+        self._root = {}
+        self._len = 0
+        for key, value in items:
+            self[key] = value
+
+    def __len__(self):
+        return self._len
+
+    def __setitem__(self, key, value):
+        node = self._root
+        for c in key:
+            node = node.setdefault(c, {})
+        if _END not in node:
+            self._len += 1
+        node[_END] = value
+
+    def _node(self, key):
+        node = self._root
+        for c in key:
+            node = node.get(c)
+            if node is None:
+                return None
+        return node
+
+    def __getitem__(self, key):
+        node = self._node(key)
+        if node is None or _END not in node:
+            raise KeyError(key)
+        return node[_END]
+
+    def __contains__(self, key):
+        node = self._node(key)
+        return node is not None and _END in node
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def items(self):
+        stack = [('', self._root)]
+        while stack:
+            prefix, node = stack.pop()
+            for c, child in node.items():
+                if c is _END:
+                    yield prefix, child
+                else:
+                    stack.append((prefix + c, child))
+
+    def keys(self):
+        return (key for key, _ in self.items())
+
+    def longest_prefix(self, string, mismatches=0):
+        """
+        Longest key which is a prefix of ``string``, allowing up to
+        ``mismatches`` substitutions, or None.
+
+        With mismatches, the key with the fewest mismatches is preferred
+        among keys of the same length; if several remain, there is no match.
+        """
+        if not mismatches:
+            node, longest = self._root, 0
+            for i, c in enumerate(string, 1):
+                node = node.get(c)
+                if node is None:
+                    break
+                if _END in node:
+                    longest = i
+            return string[:longest] if longest else None
+
+        best, best_rank, ambiguous = None, None, False
+        stack = [(self._root, 0, 0, '')]
+        while stack:
+            node, depth, used, prefix = stack.pop()
+            if depth and _END in node:
+                rank = (depth, -used)
+                if best_rank is None or rank > best_rank:
+                    best, best_rank, ambiguous = prefix, rank, False
+                elif rank == best_rank:
+                    ambiguous = True
+            if depth == len(string):
+                continue
+            base = string[depth]
+            for c, child in node.items():
+                if c is _END:
+                    continue
+                cost = used if c == base else used + 1
+                if cost <= mismatches:
+                    stack.append((child, depth + 1, cost, prefix + c))
+        return None if ambiguous else best
+
+
+def trie_match(string, trie, mismatches=0):
+    """
+    Longest key of ``trie`` which prefixes ``string``, with up to
+    ``mismatches`` substitutions
+    """
+    if isinstance(trie, BarcodeTrie):
+        return trie.longest_prefix(string, mismatches)
+    return BarcodeTrie((k, None) for k in trie.keys()).longest_prefix(
+        string, mismatches)
 
 
 # Default minimummean quality score
@@ -80,7 +181,6 @@ def build_parser(parser):
             used if input file is fasta. / fasta 输入时的质量分数文件""")
     parser.add_argument(
         'output_file',
-        type=FileType('w'),
         help="""Output file. Format determined from extension. / 输出文件，格式由扩展名决定""")
 
     output_group = parser.add_argument_group("Output / 输出")
@@ -124,6 +224,13 @@ def build_parser(parser):
         help="""Maximum length to keep before truncating
             [default: %(default)s]. This operation occurs before
             --max-ambiguous / 超过该长度先截断再进行其它过滤""")
+    parser.add_argument(
+        '--threads',
+        metavar='N',
+        type=int,
+        default=1,
+        help="""Number of processes used to filter reads. Output is
+            identical to a single process. [default: %(default)s] / 进程数""")
 
     window_group = parser.add_argument_group('Quality window options / 质量滑窗选项')
     window_group.add_argument(
@@ -192,6 +299,15 @@ def build_parser(parser):
         default=False,
         help="""Barcodes have a header row [default:
             %(default)s] / 条形码文件包含表头""")
+    barcode_group.add_argument(
+        '--barcode-mismatches',
+        metavar='K',
+        type=positive_value(int),
+        default=0,
+        help="""Allow up to K substitutions when matching barcode and primer
+            sequences; K must be less than the length of each barcode.
+            Reads matching two barcodes equally well are dropped.
+            [default: %(default)s] / 条形码与引物匹配允许的错配数""")
     barcode_group.add_argument(
         '--map-out',
         help="""Path to write
@@ -206,6 +322,33 @@ def build_parser(parser):
         default='QUOTE_MINIMAL',
         choices=[s for s in dir(csv) if s.startswith('QUOTE_')])
 
+    paired_group = parser.add_argument_group('Paired-end / 双端')
+    paired_input = paired_group.add_mutually_exclusive_group()
+    paired_input.add_argument(
+        '--mate-file',
+        metavar='R2',
+        type=FileType('r'),
+        help="""Second reads of pairs, in the same order as sequence_file.
+            Pairs are kept only if both mates pass. Requires
+            --mate-output. / 双端第二条读段文件""")
+    paired_input.add_argument(
+        '--interleaved',
+        action='store_true',
+        default=False,
+        help="""sequence_file holds pairs of reads, one mate after the
+            other. Pairs are written to output_file, interleaved. / 输入为交错双端读段""")
+    paired_group.add_argument(
+        '--mate-output',
+        metavar='R2_OUT',
+        help="""Output file for second reads of pairs passing filters / 双端第二条读段输出文件""")
+    paired_group.add_argument(
+        '--singletons',
+        metavar='FILE',
+        help="""Output file for reads passing filters whose mate failed.
+            Without it, such reads are dropped. / 配对读段未通过时，保留单端读段的输出文件""")
+
+    add_compression_options(parser)
+
 
 def mean(sequence):
     """
@@ -230,6 +373,32 @@ def moving_average(iterable, n):
         yield s / float(n)
 
 
+def _sequence_bytes(record):
+    seq = record.seq
+    return seq if isinstance(seq, bytes) else bytes(seq)
+
+
+def _sequence_str(record):
+    seq = record.seq
+    return seq.decode('ascii') if isinstance(seq, bytes) else str(seq)
+
+
+# Return codes of BaseFilter.check
+PASSED = 0
+FAILED = 1
+
+
+def _quality_strings(records):
+    """
+    Raw quality strings of ``records``, if all are FastRecords with
+    qualities; otherwise None
+    """
+    quals = [getattr(record, 'qual', None) for record in records]
+    if None in quals:
+        return None
+    return quals
+
+
 class FailedFilter(Exception):
     """
     A read failed filtering
@@ -245,11 +414,17 @@ class RecordEventListener(object):
 
     Event handlers take a single positional argument, the record, and optional
     additional keyword arguments.
+
+    A listener without handlers is false, so that callers may skip firing
+    events altogether.
     """
 
     def __init__(self):
         self.listeners = collections.defaultdict(set)
 
+    def __bool__(self):
+        return any(self.listeners.values())
+
     def __call__(self, event, record, **kwargs):
         """
         Trigger an event
@@ -258,8 +433,9 @@ class RecordEventListener(object):
         :param record: Record affected
         :param **kwargs: Optional additional arguments to pass to handlers
         """
-        if event in self.listeners:
-            for listener in self.listeners[event]:
+        handlers = self.listeners.get(event)
+        if handlers:
+            for listener in handlers:
                 listener(record, **kwargs)
 
     def register_handler(self, event, handler):
@@ -270,10 +446,19 @@ class RecordEventListener(object):
 
     def iterable_hook(self, name, iterable):
         """
-        Fire an event named ``name`` with each item in iterable
+        Fire an event named ``name`` with each item in iterable. If no
+        handlers are registered for ``name``, returns ``iterable`` unchanged.
         """
+        handlers = self.listeners.get(name)
+        if not handlers:
+            return iterable
+        return self._hook(handlers, iterable)
+
+    @staticmethod
+    def _hook(handlers, iterable):
         for record in iterable:
-            self(name, record)
+            for listener in handlers:
+                listener(record)
             yield record
 
 
@@ -286,6 +471,9 @@ class RecordReportHandler(object):
     HEADERS = ('sequence_name', 'in_length', 'in_mean_qual', 'sample',
                'out_length', 'out_mean_qual', 'fail_filter', 'fail_value')
 
+    # Rows held before writing them at once
+    BATCH_SIZE = 1000
+
     def __init__(self, fp, args, write_comments=True):
         if write_comments:
             fp.write('# Generated by `seqmagick2 quality-filter` version {0}\n'.
@@ -300,11 +488,13 @@ class RecordReportHandler(object):
             quoting=csv.QUOTE_NONNUMERIC)
         self.writer.writeheader()
         self.current_record = None
+        self.rows = []
 
         self.read = 0
         self.failed = 0
         self.start = time.time()
         self.last_report = 0.0
+        self.show_progress = sys.stdout.isatty()
 
     def register_with(self, listener):
         listener.register_handler('failed_filter', self._record_failed)
@@ -314,8 +504,18 @@ class RecordReportHandler(object):
 
     def _write(self):
         assert self.current_record
-        self.writer.writerow(self.current_record)
+        self.rows.append(self.current_record)
         self.current_record = None
+        if len(self.rows) >= self.BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        Write pending rows
+        """
+        if self.rows:
+            self.writer.writerows(self.rows)
+            self.rows = []
 
     def _record_failed(self, record, filter_name, value=None):
         self.current_record.update({
@@ -332,9 +532,9 @@ class RecordReportHandler(object):
             'sequence_name': record.id,
             'in_length': len(record)
         }
-        if 'phred_quality' in record.letter_annotations:
-            self.current_record['in_mean_qual'] = mean(
-                record.letter_annotations['phred_quality'])
+        scores = quality.scores(record)
+        if scores is not None:
+            self.current_record['in_mean_qual'] = quality.mean(scores)
         self.read += 1
 
     def _found_barcode(self, record, sample, barcode=None):
@@ -344,14 +544,14 @@ class RecordReportHandler(object):
 
     def _wrote_record(self, record):
         self.current_record['out_length'] = len(record)
-        if 'phred_quality' in record.letter_annotations:
-            self.current_record['out_mean_qual'] = mean(
-                record.letter_annotations['phred_quality'])
+        scores = quality.scores(record)
+        if scores is not None:
+            self.current_record['out_mean_qual'] = quality.mean(scores)
         self._write()
         self._report()
 
     def _report(self):
-        if not sys.stdout.isatty():
+        if not self.show_progress:
             return
         t = time.time()
         if t - self.last_report < 0.4 or not self.read:
@@ -364,6 +564,34 @@ class RecordReportHandler(object):
                    float(self.read - self.failed) / self.read * 100.0))
 
 
+class BarcodeMapHandler(object):
+    """
+    Writes (sequence_id, sample_id) rows to a CSV file for each barcode found
+
+    Listens for events: [found_barcode]
+    """
+
+    def __init__(self, fp, quoting=csv.QUOTE_MINIMAL):
+        self.writer = csv.writer(fp, quoting=quoting, lineterminator='\n')
+        self.rows = []
+
+    def register_with(self, listener):
+        listener.register_handler('found_barcode', self._found_barcode)
+
+    def _found_barcode(self, record, sample, barcode=None):
+        self.rows.append((record.id, sample))
+        if len(self.rows) >= RecordReportHandler.BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        Write pending rows
+        """
+        if self.rows:
+            self.writer.writerows(self.rows)
+            self.rows = []
+
+
 class BaseFilter(object):
     """
     Base class for filters
@@ -377,36 +605,44 @@ class BaseFilter(object):
         self.failed = 0
         self.listener = listener
 
+    def check(self, record):
+        """
+        Filter a record without raising. Returns ``(PASSED, record)`` with
+        the filtered record, or ``(FAILED, value)`` with an optional value.
+
+        Subclasses override either this or filter_record.
+        """
+        try:
+            return PASSED, self.filter_record(record)
+        except FailedFilter as e:
+            return FAILED, e.value
+
+    def check_batch(self, records):
+        """
+        ``check`` each of a list of records, returning a list of results.
+
+        Subclasses override this to score a whole batch at once; such filters
+        must not fire events from ``check``.
+        """
+        return [self.check(record) for record in records]
+
     def filter_record(self, record):
         """
         Filter a record. If the filter succeeds, returns a SeqRecord. If it
         fails, raises an instance of FailedFilter with an optional value.
         """
-        raise NotImplementedError("Override in subclass")
+        if type(self).check is BaseFilter.check:
+            raise NotImplementedError("Override in subclass")
+        code, result = self.check(record)
+        if code == FAILED:
+            raise FailedFilter(result)
+        return result
 
     def filter_records(self, records):
         """
         Apply the filter to records
         """
-        for record in records:
-            try:
-                filtered = self.filter_record(record)
-                assert (filtered)
-                # Quick tracking whether the sequence was modified
-                if filtered.seq == record.seq:
-                    self.passed_unchanged += 1
-                else:
-                    self.passed_changed += 1
-                yield filtered
-            except FailedFilter as e:
-                self.failed += 1
-                v = e.value
-                if self.listener:
-                    self.listener(
-                        'failed_filter',
-                        record,
-                        filter_name=self.name,
-                        value=v)
+        return FilterPlan([self]).filter_records(records)
 
     @property
     def passed(self):
@@ -426,6 +662,355 @@ class BaseFilter(object):
         return dict((f, getattr(self, f)) for f in self.report_fields)
 
 
+class FilterPlan(object):
+    """
+    Applies a chain of filters to each record in a single loop.
+
+    Filters are evaluated in order through their ``check`` return codes;
+    a record stops at the first filter it fails. A filter changed a record if
+    it changed its length: all filters keep or trim records.
+    """
+
+    def __init__(self, filters):
+        self.filters = list(filters)
+
+    def apply(self, record):
+        """
+        Filter a single record, returning the result or None if it failed
+        """
+        for f in self.filters:
+            code, result = f.check(record)
+            if code == FAILED:
+                f.failed += 1
+                if f.listener:
+                    f.listener(
+                        'failed_filter',
+                        record,
+                        filter_name=f.name,
+                        value=result)
+                return None
+            if result is record or len(result) == len(record):
+                f.passed_unchanged += 1
+            else:
+                f.passed_changed += 1
+            record = result
+        return record
+
+    def apply_batch(self, records, recorder=None):
+        """
+        Filter a list of records, returning the result for each, or None if
+        it failed. Each filter checks all remaining records at once, so that
+        filters with a ``check_batch`` kernel score them together.
+
+        Events are recorded in ``recorder`` by record index.
+        """
+        results = list(records)
+        remaining = list(range(len(results)))
+        for f in self.filters:
+            if not remaining:
+                break
+            current = [results[i] for i in remaining]
+            if recorder is None or (type(f).check_batch is not
+                                    BaseFilter.check_batch):
+                checks = f.check_batch(current)
+            else:
+                # Events fired from check are kept by record
+                checks = []
+                for i, record in zip(remaining, current):
+                    recorder.index = i
+                    checks.append(f.check(record))
+            passed = []
+            for i, record, (code, result) in zip(remaining, current, checks):
+                if code == FAILED:
+                    f.failed += 1
+                    if f.listener:
+                        if recorder is not None:
+                            recorder.index = i
+                        f.listener(
+                            'failed_filter',
+                            record,
+                            filter_name=f.name,
+                            value=result)
+                    results[i] = None
+                    continue
+                if result is record or len(result) == len(record):
+                    f.passed_unchanged += 1
+                else:
+                    f.passed_changed += 1
+                results[i] = result
+                passed.append(i)
+            remaining = passed
+        return results
+
+    def filter_records(self, records):
+        apply = self.apply
+        for record in records:
+            record = apply(record)
+            if record is not None:
+                yield record
+
+
+class MatePairFilter(BaseFilter):
+    """
+    Keeps pairs of reads only if both mates passed the other filters. Counts
+    pairs, rather than reads.
+    """
+    name = "Mate Pair"
+
+    def check(self, pair):
+        if pair[0] is None or pair[1] is None:
+            return FAILED, None
+        return PASSED, pair
+
+
+class _EventRecorder(object):
+    """
+    Records the events fired by filters on a batch of records, by the index
+    of the record set in ``index``, to replay in input order
+    """
+
+    def __init__(self):
+        self.index = 0
+        self.events = {}
+
+    def __call__(self, event, record, **kwargs):
+        self.events.setdefault(self.index, []).append((event, kwargs))
+
+    def pop(self):
+        """
+        Events recorded since the last call, by record index
+        """
+        events, self.events = self.events, {}
+        return events
+
+
+_worker_plan = None
+_worker_recorder = None
+
+
+def _init_filter_worker(filters):
+    global _worker_plan, _worker_recorder
+    _worker_recorder = _EventRecorder()
+    for f in filters:
+        f.listener = _worker_recorder
+    _worker_plan = FilterPlan(filters)
+
+
+def _filter_batch(batch):
+    """
+    Filter a batch of records. Returns the result for each record (None if
+    it failed), events by record index, and each filter's counts.
+    """
+    plan, recorder = _worker_plan, _worker_recorder
+    results = plan.apply_batch(batch, recorder)
+    events = recorder.pop()
+    counts = []
+    for f in plan.filters:
+        counts.append((f.passed_unchanged, f.passed_changed, f.failed))
+        f.passed_unchanged = f.passed_changed = f.failed = 0
+    return results, events, counts
+
+
+def _check_records(records, filters, threads=1,
+                   batch_size=parallel.DEFAULT_BATCH_SIZE, record_events=True):
+    """
+    Apply ``filters`` to ``records`` in batches, in ``threads`` worker
+    processes if more than one. Yields ``(record, result, events)`` in input order, with the
+    filtered record (None if it failed) and the events fired by the filters,
+    if ``record_events``.
+
+    Workers have their own copies of the filters; their counts are added to
+    ``filters``.
+    """
+    if threads <= 1:
+        recorder = _EventRecorder() if record_events else None
+        for f in filters:
+            f.listener = recorder
+        plan = FilterPlan(filters)
+        for batch in parallel.batches(records, batch_size):
+            results = plan.apply_batch(batch, recorder)
+            events = recorder.pop() if recorder is not None else {}
+            for i, (record, result) in enumerate(zip(batch, results)):
+                yield record, result, events.get(i, ())
+        return
+
+    worker_filters = []
+    for f in filters:
+        f = copy.copy(f)
+        f.listener = None
+        worker_filters.append(f)
+    logging.info("Filtering using %d processes", threads)
+    batches = parallel.imap_batches(records, _filter_batch, threads,
+                                    _init_filter_worker, (worker_filters,),
+                                    batch_size)
+    for batch, (results, events, counts) in batches:
+        for f, (unchanged, changed, failed) in zip(filters, counts):
+            f.passed_unchanged += unchanged
+            f.passed_changed += changed
+            f.failed += failed
+        for i, (record, result) in enumerate(zip(batch, results)):
+            yield record, result, events.get(i, ())
+
+
+def _replay(listener, record, events):
+    listener('read', record)
+    for event, kwargs in events:
+        listener(event, record, **kwargs)
+
+
+def imap_filters(records, filters, listener, threads,
+                 batch_size=parallel.DEFAULT_BATCH_SIZE):
+    """
+    Apply ``filters`` to batches of ``records``, in ``threads`` worker
+    processes if more than one, yielding the records which pass in input
+    order.
+
+    The 'read', filter and 'write' events are fired on ``listener`` for each
+    record in turn, as when filtering one record at a time. Filter events are
+    passed the input record.
+    """
+    checked = _check_records(records, filters, threads, batch_size,
+                             record_events=bool(listener))
+    if not listener:
+        for _, result, _ in checked:
+            if result is not None:
+                yield result
+        return
+    for record, result, events in checked:
+        _replay(listener, record, events)
+        if result is not None:
+            listener('write', result)
+            yield result
+
+
+def _mate_name(record_id):
+    # Drop the /1 or /2 suffix of older Illumina read names
+    if record_id[-2:] in ('/1', '/2'):
+        return record_id[:-2]
+    return record_id
+
+
+def read_pairs(records, mates=None):
+    """
+    Pairs of mates from ``records`` and ``mates`` in lockstep, or from
+    interleaved ``records`` if ``mates`` is None
+    """
+    records = iter(records)
+    if mates is None:
+        pairs = ((r, next(records, None)) for r in records)
+    else:
+        pairs = itertools.zip_longest(records, mates)
+    for first, second in pairs:
+        if first is None or second is None:
+            raise ValueError("Unpaired read: {0}".format(
+                (first or second).id))
+        if _mate_name(first.id) != _mate_name(second.id):
+            raise ValueError("Mates out of sync: {0}, {1}".format(
+                first.id, second.id))
+        yield first, second
+
+
+def filter_pairs(pairs, filters, pair_filter, listener, keep_singletons=False,
+                 threads=1, batch_size=parallel.DEFAULT_BATCH_SIZE):
+    """
+    Apply ``filters`` to both mates of ``pairs``, yielding the filtered
+    ``(first, second)`` pairs in which both mates passed. With
+    ``keep_singletons``, pairs in which one mate passed are also yielded,
+    with None in place of the other.
+
+    Events are fired on ``listener`` for each mate in turn, as for single
+    reads. A read whose mate failed, if not kept, fails ``pair_filter``.
+    """
+    fire = bool(listener)
+    mates = (mate for pair in pairs for mate in pair)
+    checked = _check_records(mates, filters, threads, batch_size,
+                             record_events=fire)
+    for first, second in zip(checked, checked):
+        pair = first[1], second[1]
+        code, _ = pair_filter.check(pair)
+        if code == PASSED:
+            pair_filter.passed_unchanged += 1
+        else:
+            pair_filter.failed += 1
+        keep = code == PASSED or keep_singletons
+        for record, result, events in (first, second) if fire else ():
+            _replay(listener, record, events)
+            if result is None:
+                continue
+            if keep:
+                listener('write', result)
+            else:
+                listener('failed_filter', record,
+                         filter_name=pair_filter.name, value=None)
+        if keep and (pair[0] is not None or pair[1] is not None):
+            yield pair
+
+
+def _record_writer(handle, file_type, native):
+    """
+    Function writing a list of records to ``handle`` in a single call
+    """
+    write = fastrecord.write if native else SeqIO.write
+
+    def write_records(records):
+        if records:
+            write(records, handle, file_type)
+    return write_records
+
+
+def _write_pairs(arguments, sequences, mates, filters, listener, native):
+    """
+    Filter and write pairs of reads, for --mate-file or --interleaved.
+    Returns the MatePairFilter.
+    """
+    handles = [arguments.output_file]
+    mate_output = singletons = None
+    if arguments.mate_output:
+        mate_output = output_file_type(arguments, 'w')(arguments.mate_output)
+        handles.append(mate_output)
+    if arguments.singletons:
+        singletons = output_file_type(arguments, 'w')(arguments.singletons)
+        handles.append(singletons)
+
+    write = _record_writer(arguments.output_file,
+                           fileformat.from_handle(arguments.output_file),
+                           native)
+    if mate_output is not None:
+        write_mate = _record_writer(
+            mate_output, fileformat.from_handle(mate_output), native)
+    if singletons is not None:
+        write_singleton = _record_writer(
+            singletons, fileformat.from_handle(singletons), native)
+
+    pair_filter = MatePairFilter()
+    try:
+        pairs = read_pairs(sequences, mates)
+        pairs = filter_pairs(pairs, filters, pair_filter, listener,
+                             keep_singletons=singletons is not None,
+                             threads=arguments.threads)
+        pairs = maybe_profile_iterable('quality_filter.write', pairs)
+        # Each output is written once per batch, rather than per record
+        for batch in parallel.batches(pairs, parallel.DEFAULT_BATCH_SIZE):
+            records, mate_records, singleton_records = [], [], []
+            if mate_output is None:
+                mate_records = records
+            for first, second in batch:
+                if first is None or second is None:
+                    singleton_records.append(first or second)
+                else:
+                    records.append(first)
+                    mate_records.append(second)
+            write(records)
+            if mate_output is not None:
+                write_mate(mate_records)
+            if singletons is not None:
+                write_singleton(singleton_records)
+    finally:
+        for handle in handles:
+            handle.close()
+    return pair_filter
+
+
 class QualityScoreFilter(BaseFilter):
     """
     Quality score filter - requires that the average base quality over the
@@ -437,17 +1022,24 @@ class QualityScoreFilter(BaseFilter):
         self.min_mean_score = min_mean_score
         self.name = "Quality Score [min_mean: {0}]".format(min_mean_score)
 
-    def filter_record(self, record):
+    def check(self, record):
         """
         Filter a single record
         """
-        quality_scores = record.letter_annotations['phred_quality']
-
-        mean_score = mean(quality_scores)
+        mean_score = quality.mean(quality.scores(record))
         if mean_score >= self.min_mean_score:
-            return record
+            return PASSED, record
         else:
-            raise FailedFilter(mean_score)
+            return FAILED, mean_score
+
+    def check_batch(self, records):
+        quals = _quality_strings(records)
+        if quals is None:
+            return super(QualityScoreFilter, self).check_batch(records)
+        return [(PASSED, record) if mean_score >= self.min_mean_score
+                else (FAILED, mean_score)
+                for record, mean_score in zip(records,
+                                              quality.batch_means(quals))]
 
 
 class WindowQualityScoreFilter(BaseFilter):
@@ -465,37 +1057,56 @@ class WindowQualityScoreFilter(BaseFilter):
                      "[min_mean-quality: {0}; window_size: {1}]").format(
                          min_mean_score, window_size)
 
-    def filter_record(self, record):
+    def check(self, record):
         """
         Filter a single record
         """
-        quality_scores = record.letter_annotations['phred_quality']
+        quality_scores = quality.scores(record)
 
         # Simple case - window covers whole sequence
         if len(record) <= self.window_size:
-            mean_score = mean(quality_scores)
+            mean_score = quality.mean(quality_scores)
             if mean_score >= self.min_mean_score:
-                return record
+                return PASSED, record
             else:
-                raise FailedFilter(mean_score)
+                return FAILED, mean_score
 
         # Find the right clipping point. Start clipping at the beginning of the
         # sequence, then extend the window to include regions with acceptable
         # mean quality scores.
-        clip_right = 0
-        for i, a in enumerate(
-                moving_average(quality_scores, self.window_size)):
-
-            if a >= self.min_mean_score:
-                clip_right = i + self.window_size
-            else:
-                break
+        clip_right = quality.window_clip(quality_scores, self.window_size,
+                                         self.min_mean_score)
 
         if clip_right:
-            return record[:clip_right]
+            return PASSED, record[:clip_right]
         else:
             # First window failed - record fails
-            raise FailedFilter()
+            return FAILED, None
+
+    def check_batch(self, records):
+        quals = _quality_strings(records)
+        if quals is None:
+            return super(WindowQualityScoreFilter, self).check_batch(records)
+        # Records no longer than the window are scored as a whole
+        whole = [i for i, q in enumerate(quals) if len(q) <= self.window_size]
+        windowed = [i for i, q in enumerate(quals)
+                    if len(q) > self.window_size]
+        checks = [None] * len(records)
+        means = quality.batch_means([quals[i] for i in whole])
+        for i, mean_score in zip(whole, means):
+            if mean_score >= self.min_mean_score:
+                checks[i] = PASSED, records[i]
+            else:
+                checks[i] = FAILED, mean_score
+        clips = quality.batch_window_clips([quals[i] for i in windowed],
+                                           self.window_size,
+                                           self.min_mean_score)
+        for i, clip_right in zip(windowed, clips):
+            if clip_right:
+                checks[i] = PASSED, records[i][:clip_right]
+            else:
+                checks[i] = FAILED, None
+        return checks
 
 
 class AmbiguousBaseFilter(BaseFilter):
@@ -514,17 +1125,17 @@ class AmbiguousBaseFilter(BaseFilter):
         self.action = action
         self.name = AmbiguousBaseFilter.name + " [{0}]".format(action)
 
-    def filter_record(self, record):
+    def check(self, record):
         """
         Filter a record, truncating or dropping at an 'N'
         """
-        nloc = record.seq.find('N')
+        nloc = _sequence_bytes(record).find(b'N')
         if nloc == -1:
-            return record
+            return PASSED, record
         elif self.action == 'truncate':
-            return record[:nloc]
+            return PASSED, record[:nloc]
         elif self.action == 'drop':
-            raise FailedFilter()
+            return FAILED, None
         else:
             assert False
 
@@ -541,13 +1152,22 @@ class MaxAmbiguousFilter(BaseFilter):
         self.max_ambiguous = max_ambiguous
         self.name = self.name + ' [{0}]'.format(max_ambiguous)
 
-    def filter_record(self, record):
-        n_count = record.seq.upper().count('N')
+    def check(self, record):
+        return self._check(record,
+                           quality.ambiguous_count(_sequence_bytes(record)))
+
+    def check_batch(self, records):
+        counts = quality.batch_ambiguous_counts(
+            [_sequence_bytes(record) for record in records])
+        return [self._check(record, n_count)
+                for record, n_count in zip(records, counts)]
+
+    def _check(self, record, n_count):
         if n_count > self.max_ambiguous:
-            raise FailedFilter(n_count)
+            return FAILED, n_count
         else:
             assert n_count <= self.max_ambiguous
-            return record
+            return PASSED, record
 
 
 class PctAmbiguousFilter(BaseFilter):
@@ -562,16 +1182,25 @@ class PctAmbiguousFilter(BaseFilter):
         self.pct_ambiguous = pct_ambiguous
         self.name = self.name + ' [{0}]'.format(pct_ambiguous)
 
-    def filter_record(self, record):
-        n_count = record.seq.upper().count('N')
+    def check(self, record):
+        return self._check(record,
+                           quality.ambiguous_count(_sequence_bytes(record)))
+
+    def check_batch(self, records):
+        counts = quality.batch_ambiguous_counts(
+            [_sequence_bytes(record) for record in records])
+        return [self._check(record, n_count)
+                for record, n_count in zip(records, counts)]
+
+    def _check(self, record, n_count):
         if n_count == 0:
-            return record
+            return PASSED, record
         pct_ambig = n_count / float(len(record.seq))
         if pct_ambig > self.pct_ambiguous:
-            raise FailedFilter(pct_ambig)
+            return FAILED, pct_ambig
         else:
             assert pct_ambig <= self.pct_ambiguous
-            return record
+            return PASSED, record
 
 
 class MinLengthFilter(BaseFilter):
@@ -585,15 +1214,15 @@ class MinLengthFilter(BaseFilter):
         self.min_length = min_length
         self.name = "Minimum Length [{0}]".format(min_length)
 
-    def filter_record(self, record):
+    def check(self, record):
         """
         Filter record, dropping any that don't meet minimum length
         """
 
         if len(record) >= self.min_length:
-            return record
+            return PASSED, record
         else:
-            raise FailedFilter(len(record))
+            return FAILED, len(record)
 
 
 class MaxLengthFilter(BaseFilter):
@@ -607,14 +1236,14 @@ class MaxLengthFilter(BaseFilter):
         self.max_length = max_length
         self.name = self.name + " [{0}]".format(max_length)
 
-    def filter_record(self, record):
+    def check(self, record):
         """
         Filter record, truncating any over some maximum length
         """
         if len(record) >= self.max_length:
-            return record[:self.max_length]
+            return PASSED, record[:self.max_length]
         else:
-            return record
+            return PASSED, record
 
 
 class PrimerBarcodeFilter(BaseFilter):
@@ -633,33 +1262,38 @@ class PrimerBarcodeFilter(BaseFilter):
                  trie,
                  output_file=None,
                  trim=True,
-                 quoting=csv.QUOTE_MINIMAL):
+                 quoting=csv.QUOTE_MINIMAL,
+                 mismatches=0):
         super(PrimerBarcodeFilter, self).__init__()
         self.trim = True
+        if not isinstance(trie, BarcodeTrie):
+            trie = BarcodeTrie(trie.items())
         self.trie = trie
+        self.mismatches = mismatches
 
-    def filter_record(self, record):
-        m = trie_match(str(record.seq), self.trie)
+    def check(self, record):
+        m = self.trie.longest_prefix(_sequence_str(record), self.mismatches)
         if m:
             if self.listener:
                 self.listener(
                     'found_barcode', record, barcode=m, sample=self.trie[m])
             if self.trim:
                 record = record[len(m):]
-            return record
+            return PASSED, record
         else:
-            raise FailedFilter()
+            return FAILED, None
 
 
-def parse_barcode_file(fp, primer=None, header=False):
+def parse_barcode_file(fp, primer=None, header=False, mismatches=0):
     """
     Load label, barcode, primer records from a CSV file.
 
     Returns a map from barcode -> label
 
-    Any additional columns are ignored
+    Any additional columns are ignored. Barcodes must be longer than the
+    ``mismatches`` allowed when matching them.
     """
-    tr = trie.StringTrie()
+    tr = BarcodeTrie()
     reader = csv.reader(fp)
 
     if header:
@@ -671,6 +1305,10 @@ def parse_barcode_file(fp, primer=None, header=False):
 
     for record in records:
         specimen, barcode = record[:2]
+        if len(barcode) <= mismatches:
+            raise ValueError(
+                "Barcode {0} of {1} is too short for {2} mismatches".format(
+                    barcode, specimen, mismatches))
         if primer is not None:
             pr = primer
         else:
@@ -693,25 +1331,45 @@ def action(arguments):
         raise ValueError("--quality-window-mean-qual specified without "
                          "--quality-window")
 
+    paired = arguments.mate_file or arguments.interleaved
+    if arguments.mate_file and not arguments.mate_output:
+        raise ValueError("--mate-file specified without --mate-output")
+    if arguments.mate_output and not arguments.mate_file:
+        raise ValueError("--mate-output specified without --mate-file")
+    if arguments.singletons and not paired:
+        raise ValueError("--singletons requires --mate-file or --interleaved")
+    if paired and arguments.input_qual:
+        raise ValueError("--input-qual is not supported for paired reads")
+
     filters = []
+    # Opened here rather than by argparse, for the compression options
+    arguments.output_file = output_file_type(arguments, 'w')(
+        arguments.output_file)
     input_type = fileformat.from_handle(arguments.sequence_file)
     output_type = fileformat.from_handle(arguments.output_file)
     with arguments.sequence_file as fp:
+        # FASTQ qualities are decoded straight from the quality strings
+        output_types = [output_type] + [
+            fileformat.from_filename(path)
+            for path in (arguments.mate_output, arguments.singletons) if path]
+        native = (not arguments.input_qual and input_type == 'fastq' and
+                  all(t in fastrecord.FORMATS for t in output_types))
+        parse = fastrecord.parse if native else SeqIO.parse
         if arguments.input_qual:
             sequences = QualityIO.PairedFastaQualIterator(
                 fp, arguments.input_qual)
         else:
-            sequences = SeqIO.parse(fp, input_type)
+            sequences = parse(fp, input_type)
+        mates = None
+        if arguments.mate_file:
+            mates = parse(arguments.mate_file, input_type)
 
         listener = RecordEventListener()
+        handlers = []
         if arguments.details_out:
-            rh = RecordReportHandler(arguments.details_out, arguments.argv,
-                                     arguments.details_comment)
-            rh.register_with(listener)
-
-        # Track read sequences
-        sequences = listener.iterable_hook('read', sequences)
-        sequences = maybe_profile_iterable('quality_filter.read', sequences)
+            handlers.append(RecordReportHandler(arguments.details_out,
+                                                arguments.argv,
+                                                arguments.details_comment))
 
         # Add filters
         if arguments.min_mean_quality and input_type == 'fastq':
@@ -743,30 +1401,45 @@ def action(arguments):
             with arguments.barcode_file:
                 tr = parse_barcode_file(arguments.barcode_file,
                                         arguments.primer,
-                                        arguments.barcode_header)
-            f = PrimerBarcodeFilter(tr)
+                                        arguments.barcode_header,
+                                        arguments.barcode_mismatches)
+            f = PrimerBarcodeFilter(tr,
+                                    mismatches=arguments.barcode_mismatches)
             filters.append(f)
 
             if arguments.map_out:
-                barcode_writer = csv.writer(
-                    arguments.map_out,
-                    quoting=getattr(csv, arguments.quoting),
-                    lineterminator='\n')
-
-                def barcode_handler(record, sample, barcode=None):
-                    barcode_writer.writerow((record.id, sample))
-
-                listener.register_handler('found_barcode', barcode_handler)
+                handlers.append(BarcodeMapHandler(
+                    arguments.map_out, getattr(csv, arguments.quoting)))
+        for handler in handlers:
+            handler.register_with(listener)
+        # Without handlers, filters skip firing events
         for f in filters:
-            f.listener = listener
-            sequences = f.filter_records(sequences)
-
-        # Track sequences which passed all filters
-        sequences = listener.iterable_hook('write', sequences)
-        sequences = maybe_profile_iterable('quality_filter.write', sequences)
+            f.listener = listener or None
+        if paired:
+            filters.append(_write_pairs(arguments, sequences, mates, filters,
+                                        listener, native))
+        else:
+            sequences = maybe_profile_iterable('quality_filter.read',
+                                               sequences)
+            # Filtered in batches; read, filter and write events are
+            # replayed for each record in turn
+            sequences = imap_filters(sequences, filters, listener,
+                                     arguments.threads)
+        if not paired:
+            sequences = maybe_profile_iterable('quality_filter.write',
+                                               sequences)
+            with arguments.output_file:
+                if native:
+                    fastrecord.write(sequences, arguments.output_file,
+                                     output_type)
+                else:
+                    SeqIO.write(sequences, arguments.output_file,
+                                output_type)
+        for handler in handlers:
+            handler.flush()
 
-        with arguments.output_file:
-            SeqIO.write(sequences, arguments.output_file, output_type)
+    if arguments.mate_file:
+        arguments.mate_file.close()
 
     rpt_rows = (f.report_dict() for f in filters)
 
@@ -0,0 +1,26 @@
+"""
+Test helpers
+
+Timing comparisons are skipped unless the SEQMAGICK2_BENCHMARKS environment
+variable is set, as they depend on the load of the machine running them.
+"""
+import os
+import time
+import unittest
+
+benchmark = unittest.skipUnless(os.environ.get('SEQMAGICK2_BENCHMARKS'),
+                                'set SEQMAGICK2_BENCHMARKS to run benchmarks')
+
+
+def best_time(function, *args, repeats=3):
+    """
+    Fastest of ``repeats`` calls of ``function(*args)``, in seconds, and the
+    result of the last
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        result = function(*args)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
@@ -0,0 +1,103 @@
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from seqmagick2.scripts import cli
+
+examples_dir = os.path.join(os.path.dirname(__file__), '..', '..', '..',
+                            'examples', 'backtrans')
+
+EXPECTED = """>seq1
+ATGAAAACT---GGTCTT
+>seq2
+ATGAAAACTGAAGGTCTT
+>seq3
+ATGAAAACTGAA---CTT
+"""
+
+
+class BatchMixin(object):
+    threads = 1
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        for name in ('protein.aln', 'nuc.fasta'):
+            shutil.copy(os.path.join(examples_dir, name), self.tempdir)
+        with open(self._path('short.fasta'), 'w') as fp:
+            fp.write('>seq1\nATGAAAACTGGTCTT\n>seq2\nATGAAAACTGAAGGTCTT\n')
+        self.manifest = self._path('manifest.tsv')
+        with open(self.manifest, 'w') as fp:
+            fp.write('{0}\t{1}\n'.format(self._path('protein.aln'),
+                                          self._path('nuc.fasta')))
+            fp.write('{0}\t{1}\t{2}\n'.format(self._path('protein.aln'),
+                                               self._path('short.fasta'),
+                                               self._path('out', 'short.fa')))
+            fp.write('{0}\t{1}\t{2}\n'.format(self._path('protein.aln'),
+                                               self._path('nuc.fasta'),
+                                               self._path('out', 'again.fa')))
+
+    def _path(self, *names):
+        return os.path.join(self.tempdir, *names)
+
+    def test_batch(self):
+        out_dir = self._path('out')
+        summary = self._path('summary.tsv')
+        with self.assertRaises(SystemExit) as context:
+            cli.main(['backtrans-align', '--manifest', self.manifest,
+                      '--out-dir', out_dir, '--summary', summary,
+                      '-output', 'fasta', '-nostderr',
+                      '--threads', str(self.threads)])
+        self.assertEqual(1, context.exception.code)
+
+        self.assertEqual(['again.fa', 'protein.fasta'],
+                         sorted(os.listdir(out_dir)))
+        for name in ('again.fa', 'protein.fasta'):
+            with open(os.path.join(out_dir, name)) as fp:
+                self.assertEqual(EXPECTED, fp.read())
+        with open(summary) as fp:
+            rows = [line.rstrip('\n').split('\t') for line in fp]
+        self.assertEqual(['ok', 'error', 'ok'], [row[4] for row in rows[1:]])
+        self.assertEqual('ERROR: number of input seqs differ (aa: 3;  nuc: 2)!!',
+                         rows[2][5])
+
+
+class BatchTestCase(BatchMixin, unittest.TestCase):
+    pass
+
+
+class MultiprocessBatchTestCase(BatchMixin, unittest.TestCase):
+    threads = 2
+
+
+class UsageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.protein = os.path.join(examples_dir, 'protein.aln')
+        self.manifest = os.path.join(self.tempdir, 'manifest.tsv')
+        with open(self.manifest, 'w') as fp:
+            fp.write('{0}\n'.format(self.protein))
+
+    def _usage_error(self, *args):
+        with mock.patch('sys.stderr'), \
+                self.assertRaises(SystemExit) as context:
+            cli.main(['backtrans-align'] + list(args))
+        self.assertEqual(2, context.exception.code)
+
+    def test_missing_inputs(self):
+        self._usage_error()
+        self._usage_error(self.protein)
+
+    def test_manifest_with_inputs(self):
+        self._usage_error('--manifest', self.manifest, self.protein)
+
+    def test_manifest_with_out_file(self):
+        self._usage_error('--manifest', self.manifest,
+                          '-o', os.path.join(self.tempdir, 'out.aln'))
+
+    def test_malformed_manifest(self):
+        self._usage_error('--manifest', self.manifest)
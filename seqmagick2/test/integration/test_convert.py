@@ -9,6 +9,7 @@ import sys
 import unittest
 import tempfile
 
+from seqmagick2 import compression
 from seqmagick2.subcommands.common import FileType
 from seqmagick2.scripts import cli
 
@@ -56,7 +57,6 @@ class BasicConvertTestCase(CommandLineTestMixIn, unittest.TestCase):
     command = 'convert {input} {output}'
 
 
-@unittest.skipIf(sys.version_info.major == 3, 'bzip2 not supported')
 class BzipInputConvertTestCase(CommandLineTestMixIn, unittest.TestCase):
     in_suffix = '.fasta.bz2'
     out_suffix = '.phy'
@@ -65,7 +65,6 @@ class BzipInputConvertTestCase(CommandLineTestMixIn, unittest.TestCase):
     command = 'convert {input} {output}'
 
 
-@unittest.skipIf(sys.version_info.major == 3, 'bzip2 not supported')
 class BzipOutputConvertTestCase(CommandLineTestMixIn, unittest.TestCase):
     in_suffix = '.fasta'
     out_suffix = '.phy.bz2'
@@ -90,6 +89,19 @@ class GzipOutputConvertTestCase(CommandLineTestMixIn, unittest.TestCase):
     command = 'convert {input} {output}'
 
 
+class BgzfOutputConvertTestCase(CommandLineTestMixIn, unittest.TestCase):
+    in_suffix = '.fasta'
+    out_suffix = '.phy.gz'
+    input_path = p('input2.fasta')
+    expected_path = p('output2.phy')
+    command = ('convert --compress-level 1 --compress-threads 2 '
+               '{input} {output}')
+
+    def test_run(self):
+        super(BgzfOutputConvertTestCase, self).test_run()
+        self.assertTrue(compression.is_bgzf(self.output_file))
+
+
 class ConvertToNexusTestCase(CommandLineTestMixIn, unittest.TestCase):
     in_suffix = '.fasta'
     input_path = p('input2.fasta')
@@ -220,3 +232,11 @@ class TestConvertFromStdin(TestTranslateAmbiguous, unittest.TestCase):
         super(TestConvertFromStdin, self).tearDown()
         sys.stdin.close()
         sys.stdin = self.orig_stdin
+
+
+class TestTranslateThreaded(TestTranslateAmbiguous):
+    command = 'convert --threads 2 --translate dna2protein {input} {output}'
+
+
+class ConvertUngapCutThreadedTestCase(ConvertUngapCutTestCase):
+    command = 'convert --threads 2 --ungap --cut 1:3 --tail 2 {input} {output}'
@@ -0,0 +1,57 @@
+import gzip
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from seqmagick2 import fileformat, seqindex
+from seqmagick2.scripts import cli
+from seqmagick2.test.integration import data_path
+
+
+class IndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.input_path = os.path.join(self.tempdir, 'input.fasta')
+        shutil.copy(data_path('input2.fasta'), self.input_path)
+        self.output_path = os.path.join(self.tempdir, 'output.fasta')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _convert(self, *args):
+        cli.main(['convert'] + list(args) +
+                 [self.input_path, self.output_path])
+        with open(self.output_path) as fp:
+            return fp.read()
+
+    def test_index(self):
+        cli.main(['index', self.input_path])
+        with open(self.input_path + '.fai') as fp:
+            self.assertEqual('test1\t5\t23\t5\t6\n', fp.readline())
+
+    def test_reused(self):
+        commands = [['--sort', 'length-desc'], ['--sort', 'name-asc'],
+                    ['--cut', '2:3', '--relative-to', 'test2'],
+                    ['--mask', '1:2', '--relative-to', 'test3', '--upper']]
+        expected = [self._convert(*args) for args in commands]
+        cli.main(['index', self.input_path])
+        self.assertIsNotNone(seqindex.open_fresh(self.input_path, 'fasta'))
+        self.assertEqual(expected, [self._convert(*args) for args in commands])
+
+    def test_compressed(self):
+        path = os.path.join(self.tempdir, 'input.FASTA.GZ')
+        with open(self.input_path, 'rb') as src, gzip.open(path, 'wb') as fp:
+            fp.write(src.read())
+        self.assertEqual('fasta', fileformat.from_filename(path))
+        self.assertRaises(ValueError, cli.main, ['index', path])
+        self.assertFalse(os.path.exists(path + '.fai'))
+        self.assertIsNone(seqindex._source_path(path))
+        self.assertEqual(self.input_path,
+                         seqindex._source_path(self.input_path))
+
+    def test_relative_to_missing(self):
+        cli.main(['index', self.input_path])
+        self.assertRaises(ValueError, self._convert, '--cut', '2:3',
+                          '--relative-to', 'missing')
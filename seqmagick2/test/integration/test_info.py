@@ -1,3 +1,5 @@
+import os
+import shutil
 import sys
 import unittest
 import tempfile
@@ -12,6 +14,7 @@ class InfoMixin(object):
 {0}\tTRUE\t5\t5\t5.00\t3
 """
     threads = 1
+    extra_args = ()
 
     def setUp(self):
         self.infile = tempfile.NamedTemporaryFile()
@@ -24,7 +27,7 @@ class InfoMixin(object):
     def test_info(self):
         args = ['info', self.seq_file,
                 '--out-file', self.tempfile.name,
-                '--threads', str(self.threads)]
+                '--threads', str(self.threads)] + list(self.extra_args)
 
         cli.main(args)
         self.assertEqual(self.expected.format(self.seq_file), self.tempfile.read())
@@ -39,6 +42,30 @@ class MultithreadedInfoTestCase(InfoMixin, unittest.TestCase):
     threads = 2
 
 
+class CachedInfoTestCase(InfoMixin, unittest.TestCase):
+    seq_file = data_path('input2.fasta')
+
+    def setUp(self):
+        super(CachedInfoTestCase, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.extra_args = ('--cache-dir', self.cache_dir)
+
+    def tearDown(self):
+        super(CachedInfoTestCase, self).tearDown()
+        shutil.rmtree(self.cache_dir)
+
+    def test_cached(self):
+        self.test_info()
+        self.tempfile.seek(0)
+        self.tempfile.truncate()
+        self.test_info()
+
+    def test_no_cache(self):
+        self.extra_args += ('--no-cache',)
+        self.test_info()
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+
 class SimpleGzipInfoTestCase(InfoMixin, unittest.TestCase):
     seq_file = data_path('input2.fasta.gz')
 
@@ -0,0 +1,68 @@
+"""
+Startup time budget and lazy imports of the command line interface
+"""
+import os
+import os.path
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from seqmagick2 import subcommands
+from seqmagick2.test import benchmark, best_time
+from seqmagick2.test.integration import data_path
+
+package_root = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__)))))
+
+# Budgets, in seconds, for the fastest of several runs, checked only with
+# SEQMAGICK2_BENCHMARKS set: a regression to eager imports roughly
+# quintuples --help time.
+HELP_BUDGET = 1.0
+CONVERT_BUDGET = 2.5
+REPEATS = 3
+
+
+def _run(*args):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        p for p in (package_root, env.get('PYTHONPATH')) if p)
+    command = [sys.executable, '-m', 'seqmagick2'] + list(args)
+    elapsed, _ = best_time(
+        lambda: subprocess.run(command, env=env, check=True,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL),
+        repeats=REPEATS)
+    return elapsed
+
+
+@benchmark
+class StartupTimeTestCase(unittest.TestCase):
+    def test_help(self):
+        elapsed = _run('--help')
+        self.assertLess(elapsed, HELP_BUDGET)
+
+    def test_convert(self):
+        with tempfile.NamedTemporaryFile(suffix='.fasta') as tf:
+            elapsed = _run('convert', data_path('input2.fasta'), tf.name)
+        self.assertLess(elapsed, CONVERT_BUDGET)
+
+
+class LazyImportTestCase(unittest.TestCase):
+    def test_only_selected_imported(self):
+        code = ("import sys\n"
+                "from seqmagick2.scripts import cli\n"
+                "cli.parse_arguments(['extract-ids', '-'])\n"
+                "print(' '.join(sorted(m for m in sys.modules\n"
+                "                      if m.startswith('seqmagick2.'))))\n")
+        env = dict(os.environ, PYTHONPATH=package_root)
+        output = subprocess.run([sys.executable, '-c', code], env=env,
+                                check=True, stdout=subprocess.PIPE,
+                                universal_newlines=True).stdout.split()
+        self.assertIn('seqmagick2.subcommands.extract_ids', output)
+        self.assertNotIn('seqmagick2.subcommands.convert', output)
+        self.assertNotIn('seqmagick2.pal2nal', output)
+
+    def test_descriptions_match_modules(self):
+        for name, description in subcommands.itercommands():
+            self.assertEqual(subcommands.load(name).__doc__, description)
@@ -0,0 +1,82 @@
+"""
+Tests for seqmagick2.alignment
+"""
+import random
+import unittest
+from unittest import mock
+
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from seqmagick2 import alignment, transform
+
+
+def _alignment(n=40, width=57, seed=1):
+    rng = random.Random(seed)
+    return [SeqRecord(Seq(''.join(rng.choice('ACGT--.') for _ in range(width))),
+                      id='s{0}'.format(i), description='s{0} x'.format(i))
+            for i in range(n)]
+
+
+def _strings(records):
+    return [(r.id, r.description, str(r.seq)) for r in records]
+
+
+@unittest.skipUnless(alignment.available(), 'numpy not installed')
+class AlignmentMatrixTestCase(unittest.TestCase):
+    def test_column_counts(self):
+        aln = alignment.AlignmentMatrix.from_records(
+            [SeqRecord(Seq('A-.')), SeqRecord(Seq('--A'))])
+        self.assertEqual([1, 2, 0], aln.column_counts('-').tolist())
+        self.assertEqual([1, 2, 1], aln.column_counts('-.').tolist())
+
+    def test_spill(self):
+        records = _alignment()
+        aln = alignment.AlignmentMatrix.from_records(records, max_memory=100)
+        self.assertTrue(aln.spilled)
+        self.assertEqual(str(records[5].seq),
+                         aln.matrix()[5].tobytes().decode('ascii'))
+        aln.close()
+
+    def test_not_alignment(self):
+        records = [SeqRecord(Seq('ACGT')), SeqRecord(Seq('ACG'))]
+        self.assertRaises(ValueError, list, alignment.squeeze(records))
+
+
+@unittest.skipUnless(alignment.available(), 'numpy not installed')
+class SameAsPythonTestCase(unittest.TestCase):
+    """
+    Vectorized results match the pure-Python implementations
+    """
+
+    def _python(self, function, *args):
+        with mock.patch.object(alignment, 'np', None):
+            return list(function(_alignment(), *args))
+
+    def test_squeeze(self):
+        for threshold in (0.2, 0.5, 1.0):
+            expected = self._python(transform.squeeze, threshold)
+            actual = list(transform.squeeze(_alignment(), threshold))
+            self.assertEqual(_strings(expected), _strings(actual))
+
+    def test_squeeze_spilled(self):
+        expected = self._python(transform.squeeze, 0.3)
+        actual = list(alignment.squeeze(_alignment(), 0.3, max_memory=64))
+        self.assertEqual(_strings(expected), _strings(actual))
+
+    def test_gap_proportion(self):
+        with mock.patch.object(alignment, 'np', None):
+            expected = transform.gap_proportion(_alignment())
+        self.assertEqual(expected, transform.gap_proportion(_alignment()))
+
+    def test_drop_columns(self):
+        slices = [slice(2, 10), slice(-5, None), slice(8, 12)]
+        expected = self._python(transform.drop_columns, slices)
+        actual = list(transform.drop_columns(_alignment(), slices))
+        self.assertEqual(_strings(expected), _strings(actual))
+
+    def test_mask(self):
+        slices = [slice(0, 3), slice(-8, -2)]
+        expected = self._python(transform.multi_mask_sequences, slices)
+        actual = list(transform.multi_mask_sequences(_alignment(), slices))
+        self.assertEqual(_strings(expected), _strings(actual))
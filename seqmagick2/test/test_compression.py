@@ -0,0 +1,189 @@
+"""
+Tests for seqmagick2.compression
+"""
+import bz2
+import gzip
+import lzma
+import os
+import os.path
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+from unittest import mock
+
+from seqmagick2 import compression
+from seqmagick2.subcommands import common
+
+CONTENT = ''.join('>seq{0} description {0}\n{1}\n'.format(i, 'ACGT' * (i % 50))
+                  for i in range(5000))
+
+
+def _bgzf(data, block_size=10000):
+    """
+    Compress ``data`` into BGZF blocks
+    """
+    result = bytearray()
+    for i in range(0, len(data), block_size):
+        chunk = data[i:i + block_size]
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        body = compressor.compress(chunk) + compressor.flush()
+        result += struct.pack('<4BI2BH2BHH', 0x1f, 0x8b, 8, 4, 0, 0, 255, 6,
+                              66, 67, 2, len(body) + 25)
+        result += body + struct.pack('<II', zlib.crc32(chunk), len(chunk))
+    return bytes(result + compression.BGZF_EOF)
+
+
+class CompressedReadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _write(self, name, data):
+        path = os.path.join(self.tempdir, name)
+        with open(path, 'wb') as fp:
+            fp.write(data)
+        return path
+
+    def _check(self, path):
+        with common.FileType('rt')(path) as fp:
+            self.assertEqual(path, fp.name)
+            self.assertEqual(CONTENT, fp.read())
+        with common.FileType('r')(path) as fp:
+            self.assertEqual(CONTENT.splitlines()[:3],
+                             [fp.readline().rstrip('\n') for _ in range(3)])
+        with common.FileType('rb')(path) as fp:
+            self.assertEqual(CONTENT.encode('ascii'), fp.read())
+
+    def test_gzip(self):
+        path = self._write('x.fasta.gz', gzip.compress(CONTENT.encode()))
+        self.assertFalse(compression.is_bgzf(path))
+        self._check(path)
+
+    def test_bgzf(self):
+        path = self._write('x.fasta.gz', _bgzf(CONTENT.encode()))
+        self.assertTrue(compression.is_bgzf(path))
+        self._check(path)
+        # Also readable as ordinary multi-member gzip
+        with gzip.open(path, 'rt') as fp:
+            self.assertEqual(CONTENT, fp.read())
+
+    def test_bgzf_single_thread(self):
+        path = self._write('x.fasta.gz', _bgzf(CONTENT.encode()))
+        with mock.patch.object(compression, 'DEFAULT_THREADS', 1):
+            reader = compression.BgzfReader(path, threads=1)
+            with compression._wrap(reader, 'rt') as fp:
+                self.assertEqual(CONTENT, fp.read())
+
+    def test_bgzf_corrupt(self):
+        data = bytearray(_bgzf(CONTENT.encode()))
+        data[-100] ^= 0xff
+        path = self._write('x.fasta.gz', bytes(data))
+        with common.FileType('rt')(path) as fp:
+            self.assertRaises((ValueError, zlib.error), fp.read)
+
+    def test_bzip2(self):
+        self._check(self._write('x.fasta.bz2', bz2.compress(CONTENT.encode())))
+
+    def test_xz(self):
+        self._check(self._write('x.fasta.xz', lzma.compress(CONTENT.encode())))
+
+    @unittest.skipIf(compression.zstd is None, 'zstandard not installed')
+    def test_zstd(self):
+        path = os.path.join(self.tempdir, 'x.fasta.zst')
+        with compression.open_zstd(path, 'w') as fp:
+            fp.write(CONTENT)
+        self._check(path)
+
+    def test_gzip_error(self):
+        path = self._write('x.fasta.gz', gzip.compress(CONTENT.encode())[:-20])
+        with common.FileType('rt')(path) as fp:
+            self.assertRaises(EOFError, fp.read)
+
+    def test_close_early(self):
+        path = self._write('x.fasta.gz', gzip.compress(CONTENT.encode()))
+        fp = common.FileType('rt')(path)
+        fp.readline()
+        fp.close()
+        self.assertTrue(fp.closed)
+
+    def test_write_text(self):
+        path = os.path.join(self.tempdir, 'x.fasta.bz2')
+        with common.FileType('w')(path) as fp:
+            fp.write(CONTENT)
+        self._check(path)
+
+    def test_bzip2_level(self):
+        written = []
+        for level in (None, 0, 1):
+            path = os.path.join(self.tempdir, 'x.fasta.bz2')
+            with common.FileType('w', compress_level=level)(path) as fp:
+                fp.write(CONTENT)
+            self._check(path)
+            with open(path, 'rb') as fp:
+                written.append(fp.read())
+        self.assertTrue(written[0].startswith(b'BZh9'))
+        self.assertTrue(written[1].startswith(b'BZh1'))
+        self.assertEqual(written[1], written[2])
+
+
+def _blocks(data):
+    """
+    Sizes of the BGZF blocks in ``data``
+    """
+    sizes, offset = [], 0
+    while offset < len(data):
+        size = struct.unpack_from('<H', data, offset + 16)[0] + 1
+        sizes.append(size)
+        offset += size
+    return sizes
+
+
+class BgzfWriteTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'x.fasta.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _write(self, data, **kwargs):
+        with compression.open_gzip(self.path, 'wb', **kwargs) as fp:
+            for i in range(0, len(data), 1000):
+                fp.write(data[i:i + 1000])
+        with open(self.path, 'rb') as fp:
+            return fp.read()
+
+    def test_valid_gzip(self):
+        data = CONTENT.encode()
+        written = self._write(data)
+        self.assertEqual(data, gzip.decompress(written))
+        self.assertTrue(compression.is_bgzf(self.path))
+        self.assertTrue(written.endswith(compression.BGZF_EOF))
+        sizes = _blocks(written)
+        self.assertEqual(len(written), sum(sizes))
+        self.assertGreater(len(sizes), 2)
+        with common.FileType('rt')(self.path) as fp:
+            self.assertEqual(CONTENT, fp.read())
+
+    def test_deterministic(self):
+        data = CONTENT.encode()
+        self.assertEqual(self._write(data, threads=1),
+                         self._write(data, threads=3))
+
+    def test_level(self):
+        data = CONTENT.encode()
+        self.assertLess(len(self._write(data, level=9)),
+                        len(self._write(data, level=0)))
+
+    def test_incompressible(self):
+        data = os.urandom(200000)
+        written = self._write(data, level=9)
+        self.assertEqual(data, gzip.decompress(written))
+        self.assertTrue(all(s <= 1 << 16 for s in _blocks(written)))
+
+    def test_empty(self):
+        self.assertEqual(compression.BGZF_EOF, self._write(b''))
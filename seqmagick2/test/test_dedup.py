@@ -0,0 +1,96 @@
+"""
+Tests for seqmagick2.dedup
+"""
+import collections
+import io
+import random
+import unittest
+from unittest import mock
+
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+from Bio.SeqUtils.CheckSum import seguid
+
+from seqmagick2 import dedup, transform
+
+
+class _Handle(io.StringIO):
+    def close(self):
+        self.final = self.getvalue()
+        super(_Handle, self).close()
+
+
+def _records(n=500, seed=1):
+    rng = random.Random(seed)
+    return [SeqRecord(Seq(rng.choice(['ACGT', 'acgt', 'AAAA', 'AC-GT', 'T']) *
+                          rng.randint(1, 5)),
+                      id='r{0}'.format(i))
+            for i in range(n)]
+
+
+def _seguid_groups(records):
+    groups = collections.defaultdict(list)
+    for record in records:
+        groups[seguid(record.seq)].append(record.id)
+    return list(groups.values())
+
+
+class DeduplicateMixIn(object):
+    memory = dedup.DEFAULT_MEMORY
+
+    def _run(self, records):
+        handle = _Handle()
+        kept = list(dedup.deduplicate(records, lambda r: bytes(r.seq), handle,
+                                      memory=self.memory))
+        return ([r.id for r in kept],
+                [line.split() for line in handle.final.splitlines()])
+
+    def test_matches_seguid(self):
+        records = _records()
+        expected = _seguid_groups(records)
+        kept, groups = self._run(_records())
+        self.assertEqual([g[0] for g in expected], kept)
+        self.assertEqual(expected, groups)
+
+    def test_without_members(self):
+        records = _records()
+        expected = [g[0] for g in _seguid_groups(records)]
+        table = dedup.SequenceTable(memory=self.memory)
+        kept = [r.id for r in records if table.add(bytes(r.seq).upper())]
+        self.assertEqual(expected, kept)
+        self.assertEqual([], table._members)
+        self.assertRaises(ValueError, list, table.groups())
+        table.close()
+
+    def test_sha1(self):
+        with mock.patch.object(dedup, 'digest', dedup._sha1_digest):
+            self.test_matches_seguid()
+
+
+class InMemoryTestCase(DeduplicateMixIn, unittest.TestCase):
+    pass
+
+
+class SpilledTestCase(DeduplicateMixIn, unittest.TestCase):
+    memory = 1000
+
+    def test_runs_compacted(self):
+        table = dedup.SequenceTable(memory=dedup._ENTRY_SIZE)
+        for i in range(64):
+            table.add(str(i).encode('ascii'))
+        # Every entry spilled; 64 = 2 ** 6 merges into a single run
+        self.assertEqual(1, len(table._runs))
+        self.assertFalse(table.add(b'17'))
+        self.assertTrue(table.add(b'64'))
+        table.close()
+
+
+class TransformTestCase(unittest.TestCase):
+    def test_deduplicate_sequences(self):
+        handle = _Handle()
+        records = _records(50)
+        kept = list(transform.deduplicate_sequences(records, handle))
+        expected = _seguid_groups(records)
+        self.assertEqual([g[0] for g in expected], [r.id for r in kept])
+        self.assertEqual(expected,
+                         [l.split() for l in handle.final.splitlines()])
@@ -0,0 +1,200 @@
+"""
+Tests for seqmagick2.fastrecord
+"""
+from io import StringIO
+import argparse
+import unittest
+
+from Bio import SeqIO
+
+from seqmagick2 import fastrecord
+from seqmagick2.subcommands import convert
+
+FASTA = """>seq1 first sequence
+ACGT-AC.GT
+ACgt
+>seq2/1-4
+NNNN----
+>seq3
+ACGTACGTACGTACGTACGTACGTACGTACGTACGTACGTACGTACGTACGTACGTACGTACGTAA
+>seq1_dup
+acgt-ac.gtacgt
+>empty
+"""
+
+FASTQ = """@read1 desc here
+ACGTNACGTA
++
+IIIIIIIII#
+@read2
+ACGT
++read2
+!!5I
+@read3/2-3
+AC-GA
++
+@@@@@
+"""
+
+
+def _fast(text, file_type, destination_type, transforms, wrap=60):
+    records = fastrecord.parse(StringIO(text), file_type)
+    for f in fastrecord.convert_transforms(transforms):
+        records = f(records)
+    out = StringIO()
+    fastrecord.write(records, out, destination_type, wrap=wrap)
+    return out.getvalue()
+
+
+def _slow(text, file_type, destination_type, transforms):
+    records = SeqIO.parse(StringIO(text), file_type)
+    for f in transforms:
+        records = f(records)
+    out = StringIO()
+    SeqIO.write(records, out, destination_type)
+    return out.getvalue()
+
+
+class ParseTestCase(unittest.TestCase):
+    def test_parse_fasta(self):
+        records = list(fastrecord.parse(StringIO(FASTA), 'fasta'))
+        self.assertEqual(['seq1', 'seq2/1-4', 'seq3', 'seq1_dup', 'empty'],
+                         [r.id for r in records])
+        self.assertEqual('seq1 first sequence', records[0].description)
+        self.assertEqual(b'ACGT-AC.GTACgt', records[0].seq)
+        self.assertIsNone(records[0].qual)
+        self.assertEqual(b'', records[-1].seq)
+
+    def test_parse_fastq(self):
+        records = list(fastrecord.parse(StringIO(FASTQ), 'fastq'))
+        self.assertEqual(3, len(records))
+        self.assertEqual(b'!!5I', records[1].qual)
+
+    def test_fastq_caption_mismatch(self):
+        text = "@a\nAC\n+b\nII\n"
+        self.assertRaises(ValueError, list,
+                          fastrecord.parse(StringIO(text), 'fastq'))
+
+    def test_fastq_length_mismatch(self):
+        text = "@a\nACG\n+\nII\n"
+        self.assertRaises(ValueError, list,
+                          fastrecord.parse(StringIO(text), 'fastq'))
+
+    def test_fasta_text_before_first_record(self):
+        # Errors wherever Bio.SeqIO does
+        for text in ['junk\n>a\nACGT\n', '\n>a\nACGT\n', ' \n>a\nACGT\n',
+                     'junk\n', '', '>a\n\nACGT\n\n']:
+            parsers = [lambda: [(r.id, str(r.seq))
+                                for r in SeqIO.parse(StringIO(text), 'fasta')],
+                       lambda: [(r.id, r.seq.decode())
+                                for r in fastrecord.parse(StringIO(text),
+                                                          'fasta')]]
+            results = []
+            for parse in parsers:
+                try:
+                    results.append(parse())
+                except ValueError:
+                    results.append(ValueError)
+            self.assertEqual(results[0], results[1], text)
+
+    def test_slice(self):
+        record = fastrecord.FastRecord('a', 'a', b'ACGT', b'!!II')
+        r = record[1:3]
+        self.assertEqual(b'CG', r.seq)
+        self.assertEqual(b'!I', r.qual)
+
+
+class SameAsSeqRecordMixIn(object):
+    """
+    Output of the fast path must equal that of the SeqRecord path
+    """
+    transforms = []
+
+    def test_fasta(self):
+        self.assertEqual(_slow(FASTA, 'fasta', 'fasta', self.transforms),
+                         _fast(FASTA, 'fasta', 'fasta', self.transforms))
+
+    def test_fastq(self):
+        try:
+            expected = _slow(FASTQ, 'fastq', 'fastq', self.transforms)
+        except ValueError:
+            self.assertRaises(ValueError, _fast, FASTQ, 'fastq', 'fastq',
+                              self.transforms)
+        else:
+            self.assertEqual(
+                expected, _fast(FASTQ, 'fastq', 'fastq', self.transforms))
+
+    def test_fastq_to_fasta(self):
+        self.assertEqual(_slow(FASTQ, 'fastq', 'fasta', self.transforms),
+                         _fast(FASTQ, 'fastq', 'fasta', self.transforms))
+
+
+def _transforms(*args):
+    """
+    Build partial transforms as argparse would
+    """
+    parser = argparse.ArgumentParser()
+    convert.add_options(parser)
+    return parser.parse_args(list(args)).transforms
+
+
+class NoTransformTestCase(SameAsSeqRecordMixIn, unittest.TestCase):
+    pass
+
+
+class SequenceTransformTestCase(SameAsSeqRecordMixIn, unittest.TestCase):
+    transforms = _transforms('--dash-gap', '--upper', '--reverse-complement',
+                             '--reverse', '--lower', '--min-length', '3',
+                             '--max-length', '20')
+
+
+class UngapTestCase(SameAsSeqRecordMixIn, unittest.TestCase):
+    transforms = _transforms('--ungap', '--min-ungapped-length', '1',
+                             '--prune-empty')
+
+
+class CutTestCase(SameAsSeqRecordMixIn, unittest.TestCase):
+    transforms = _transforms('--cut', '2:3,5:')
+
+
+class SingleCutTestCase(SameAsSeqRecordMixIn, unittest.TestCase):
+    transforms = _transforms('--cut=-3:')
+
+
+class NameTransformTestCase(SameAsSeqRecordMixIn, unittest.TestCase):
+    transforms = _transforms('--name-suffix', '_s', '--name-prefix', 'p_',
+                             '--pattern-replace', 'seq', 'SEQ',
+                             '--pattern-exclude', 'dup',
+                             '--seq-pattern-include', '(?i)ac')
+
+
+class FirstNameTestCase(SameAsSeqRecordMixIn, unittest.TestCase):
+    transforms = _transforms('--first-name', '--head', '-1')
+
+
+class StripRangeTestCase(SameAsSeqRecordMixIn, unittest.TestCase):
+    transforms = _transforms('--strip-range', '--tail', '2')
+
+
+class WrapTestCase(unittest.TestCase):
+    def test_no_wrap(self):
+        actual = _fast(FASTA, 'fasta', 'fasta', [], wrap=0)
+        self.assertTrue(actual.startswith(
+            '>seq1 first sequence\nACGT-AC.GTACgt\n>seq2/1-4\n'))
+
+
+class FastTransformsTestCase(unittest.TestCase):
+    def test_unsupported(self):
+        transforms = _transforms('--upper', '--squeeze')
+        self.assertIsNone(fastrecord.convert_transforms(transforms))
+
+    def test_supports(self):
+        self.assertTrue(fastrecord.supports('fastq', 'fasta'))
+        self.assertFalse(fastrecord.supports('fasta', 'fastq'))
+        self.assertFalse(fastrecord.supports('fasta', 'phylip'))
+
+    def test_deduplicate(self):
+        records = fastrecord.parse(StringIO(FASTA), 'fasta')
+        result = fastrecord.deduplicate_sequences(records, None)
+        self.assertEqual(['seq1', 'seq2/1-4', 'seq3', 'empty'],
+                         [r.id for r in result])
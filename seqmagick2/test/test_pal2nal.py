@@ -0,0 +1,371 @@
+"""
+Tests for seqmagick2.pal2nal
+"""
+import argparse
+import gzip
+import io
+import os
+import random
+import re
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from seqmagick2 import pal2nal
+from seqmagick2.test import benchmark, best_time
+
+d = os.path.dirname(__file__)
+EXAMPLES = os.path.join(d, '..', '..', 'examples', 'backtrans')
+
+CODONS = {'A': 'GCT', 'C': 'TGC', 'D': 'GAT', 'E': 'GAA', 'F': 'TTC',
+          'G': 'GGA', 'H': 'CAT', 'K': 'AAG', 'L': 'CTG', 'M': 'ATG',
+          'N': 'AAC', 'P': 'CCA', 'Q': 'CAG', 'R': 'CGT', 'S': 'TCC',
+          'T': 'ACC', 'V': 'GTT', 'W': 'TGG', 'Y': 'TAC'}
+
+
+def _options(**kwargs):
+    options = dict(outform='fasta', blockonly=False, nogap=False,
+                   nomismatch=False, html=False, nostderr=False, codontable=1)
+    options.update(kwargs)
+    return argparse.Namespace(**options)
+
+
+def _run(aln_path, nuc_paths, **kwargs):
+    out, err = io.StringIO(), io.StringIO()
+    pal2nal.run(aln_path, nuc_paths, out, err, _options(**kwargs))
+    return out.getvalue(), err.getvalue()
+
+
+def _family(n=20, length=100, seed=1):
+    """
+    A random protein alignment with its coding sequences
+    """
+    rng = random.Random(seed)
+    residues = sorted(CODONS)
+    aaseq, codonseq = [], []
+    for _ in range(n):
+        protein = 'M' + ''.join(rng.choice(residues) for _ in range(length - 1))
+        codonseq.append(''.join(CODONS[aa] for aa in protein))
+        aaseq.append(''.join(('-' if rng.random() < 0.1 else '') + aa
+                             for aa in protein))
+    width = max(len(seq) for seq in aaseq)
+    aaseq = [seq.ljust(width, '-') for seq in aaseq]
+    return ['s{0}'.format(i) for i in range(n)], aaseq, codonseq
+
+
+def _concat_codon_alignment(aaid, aaseq, codonseq, aaidpos2mismatch):
+    """
+    The column-by-column string concatenation replaced by
+    pal2nal._codon_alignment and pal2nal._remove_gap_columns
+    """
+    tmppos = [0] * len(aaid)
+    codonaln = ["" for _ in aaid]
+    coloraln = ["" for _ in aaid]
+    maskseq = ""
+    for i in range(len(aaseq[0])):
+        tmpmax = 0
+        for seq in aaseq:
+            tmpaa = seq[i]
+            tmplen = 3 if not tmpaa.isdigit() else (int((int(tmpaa) - 1) / 3) + 1) * 3
+            tmpmax = max(tmpmax, tmplen)
+        for k, seq in enumerate(aaseq):
+            tmpaa = seq[i]
+            mismatch = aaidpos2mismatch.get(f"{aaid[k]} {i + 1}")
+            if tmpaa == "-":
+                codonaln[k] += "-" * tmpmax
+                coloraln[k] += ("R" * tmpmax) if mismatch else ("-" * tmpmax)
+            elif re.match(r"[A-Z\*]", tmpaa):
+                codonaln[k] += codonseq[k][tmppos[k]:tmppos[k] + 3]
+                coloraln[k] += "RRR" if mismatch else "---"
+                tmppos[k] += 3
+        maskseq += " " * tmpmax
+
+    alilen = len(codonaln[0])
+    tmppos = 0
+    nogapaln = ["" for _ in codonaln]
+    nogapcoloraln = ["" for _ in codonaln]
+    nogapmaskseq = ""
+    while tmppos < alilen:
+        outok = 1
+        for row in codonaln:
+            tmpcodon = row[tmppos:tmppos + 3]
+            if "-" in tmpcodon or pal2nal.STOP_RE.search(tmpcodon):
+                outok = 0
+        if outok:
+            for i in range(len(codonaln)):
+                nogapaln[i] += codonaln[i][tmppos:tmppos + 3]
+                nogapcoloraln[i] += coloraln[i][tmppos:tmppos + 3]
+            nogapmaskseq += maskseq[tmppos:tmppos + 3]
+        tmppos += 3
+    return (codonaln, coloraln, maskseq), (nogapaln, nogapcoloraln, nogapmaskseq)
+
+
+def _built_codon_alignment(aaid, aaseq, codonseq, aaidpos2mismatch):
+    aligned = pal2nal._codon_alignment(aaid, aaseq, codonseq, aaidpos2mismatch,
+                                       '', {}, _options())
+    return aligned, pal2nal._remove_gap_columns(*aligned)
+
+
+class RunTestCase(unittest.TestCase):
+    def setUp(self):
+        self.aln = os.path.join(EXAMPLES, 'protein.aln')
+        self.nuc = [os.path.join(EXAMPLES, 'nuc.fasta')]
+
+    def test_fasta(self):
+        out, err = _run(self.aln, self.nuc)
+        self.assertEqual('>seq1\nATGAAAACT---GGTCTT\n'
+                         '>seq2\nATGAAAACTGAAGGTCTT\n'
+                         '>seq3\nATGAAAACTGAA---CTT\n', out)
+        self.assertEqual('', err)
+
+    def test_nogap(self):
+        out, _ = _run(self.aln, self.nuc, nogap=True)
+        self.assertEqual('>seq1\nATGAAAACTCTT\n>seq2\nATGAAAACTCTT\n'
+                         '>seq3\nATGAAAACTCTT\n', out)
+
+    def test_paml(self):
+        out, _ = _run(self.aln, self.nuc, outform='paml')
+        self.assertEqual('   3     18\nseq1\nATGAAAACT---GGTCTT\n'
+                         'seq2\nATGAAAACTGAAGGTCTT\nseq3\nATGAAAACTGAA---CTT\n',
+                         out)
+
+
+class ReadAlignmentTestCase(unittest.TestCase):
+    expected = ['seq1', 'seq2', 'seq3'], ['MKT-GL', 'MKTEGL', 'MKTE-L']
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+
+    def _write(self, name, text, opener=open):
+        path = os.path.join(self.tempdir, name)
+        with opener(path, 'wt') as fp:
+            fp.write(text)
+        return path
+
+    def _read(self, name, text, opener=open):
+        aaid, aaseq, _, gblockseq = pal2nal._read_alignment(
+            self._write(name, text, opener))
+        return (aaid, aaseq), gblockseq
+
+    def test_clustal(self):
+        actual, gblockseq = self._read(
+            'aln.txt', 'CLUSTAL W\r\n\r\nseq1  MKT-GL\r\nseq2  MKTEGL\r\n'
+            'seq3  mkte-l\r\n      ***  *\r\n')
+        self.assertEqual(self.expected, actual)
+        self.assertEqual('***  *', gblockseq)
+
+    def test_phylip(self):
+        actual, _ = self._read('aln.phy', ' 3 6\nseq1      MKT\nseq2      MKT\n'
+                               'seq3      MKT\n\n-GL\nEGL\nE-L\n')
+        self.assertEqual(self.expected, actual)
+
+    def test_phylip_relaxed(self):
+        actual, _ = self._read('aln.phyx', '3 6\nseq1 MKT-GL\nseq2 MKTEGL\n'
+                               'seq3 MKT E-L\n')
+        self.assertEqual(self.expected, actual)
+
+    def test_phylip_invalid(self):
+        self.assertRaises(ValueError, self._read, 'aln.phy', 'seq1 MKT\n')
+        self.assertRaises(ValueError, self._read, 'aln.phy', '3 6\nseq1 MKT\n')
+
+    def test_stockholm(self):
+        text = ('# STOCKHOLM 1.0\n#=GF ID test\n\nseq1 MKT.GL\nseq2 MKTEGL\n'
+                '#=GR seq2 SS ......\nseq3 MKTE-L\n#=GC RF xxxxxx\n//\n'
+                'other MKTEGL\n')
+        actual, gblockseq = self._read('aln.txt', text)
+        self.assertEqual(self.expected, actual)
+        self.assertEqual('', gblockseq)
+
+    def test_stockholm_extension(self):
+        actual, _ = self._read('aln.sto', 'seq1 MKT-GL\nseq2 MKTEGL\n'
+                               'seq3 MKTE-L\n//\n')
+        self.assertEqual(self.expected, actual)
+
+    def test_content_before_extension(self):
+        actual, _ = self._read('aln.phy', '>seq1\nMKT-GL\n>seq2\nMKTEGL\n'
+                               '>seq3\nMKTE-L\n')
+        self.assertEqual(self.expected, actual)
+
+    def test_gzip(self):
+        with open(os.path.join(EXAMPLES, 'protein.aln')) as fp:
+            aln = self._write('protein.aln.gz', fp.read(), gzip.open)
+        with open(os.path.join(EXAMPLES, 'nuc.fasta')) as fp:
+            nuc = self._write('nuc.fasta.gz', fp.read(), gzip.open)
+        self.assertEqual(
+            _run(os.path.join(EXAMPLES, 'protein.aln'),
+                 [os.path.join(EXAMPLES, 'nuc.fasta')]),
+            _run(aln, [nuc]))
+
+    def test_nuc_sequences(self):
+        nuc = self._write('nuc.fasta', '# comment\r\n>a x\r\nATG\r\nA-A\r\n\r\n'
+                          '>b\nCCC\n>a\nGGG')
+        self.assertEqual((['a', 'b', 'a'], {'a': 'ATGAAGGG', 'b': 'CCC'}),
+                         pal2nal._read_nuc_sequences([nuc]))
+
+
+class CodonAlignmentTestCase(unittest.TestCase):
+    def test_frameshift(self):
+        aligned = pal2nal._codon_alignment(
+            ['a', 'b'], ['M2K', 'MAK'], ['ATGGCAAG', 'ATGGCTAAG'], {}, '', {},
+            _options())
+        self.assertEqual(['ATGGC-AAG', 'ATGGCTAAG'], aligned[0])
+        self.assertEqual(' ' * 9, aligned[2])
+
+    def test_mismatch_colour(self):
+        aligned = pal2nal._codon_alignment(
+            ['a', 'b'], ['M-K', 'MAK'], ['ATGAAG', 'ATGGCTAAG'],
+            {'a 2': 1, 'b 3': 1}, '', {}, _options())
+        self.assertEqual(['---RRR---', '------RRR'], aligned[1])
+
+    def test_blockonly(self):
+        aligned = pal2nal._codon_alignment(
+            ['a'], ['MAK'], ['ATGGCTAAG'], {}, '#.#', {},
+            _options(blockonly=True))
+        self.assertEqual((['ATGAAG'], ['------'], ''), aligned)
+
+    def test_matches_concatenation(self):
+        aaid, aaseq, codonseq = _family()
+        mismatches = {'s3 5': 1, 's7 40': 1}
+        self.assertEqual(_concat_codon_alignment(aaid, aaseq, codonseq, mismatches),
+                         _built_codon_alignment(aaid, aaseq, codonseq, mismatches))
+
+
+class RemoveGapColumnsMixIn(object):
+    def test_remove_gap_columns(self):
+        removed = pal2nal._remove_gap_columns(
+            ['ATGTAAGCT', 'ATG---GCT'], ['---------', 'RRR------'], '   ###   ')
+        self.assertEqual((['ATGGCT', 'ATGGCT'], ['------', 'RRR---'], '      '),
+                         removed)
+
+    def test_stops(self):
+        removed = pal2nal._remove_gap_columns(
+            ['ATGtarTGAuaaTRA', 'ATGCCCCCCCCCCCC'], ['-' * 15] * 2, '')
+        self.assertEqual((['ATGTRA', 'ATGCCC'], ['------'] * 2, ''), removed)
+
+    def test_ragged(self):
+        removed = pal2nal._remove_gap_columns(
+            ['ATGAAAGC', 'ATGTAA'], ['--------', '------'], '#' * 8)
+        self.assertEqual((['ATGGC', 'ATG'], ['-----', '---'], '#####'), removed)
+
+    def test_matches_python(self):
+        rng = random.Random(2)
+        for _ in range(200):
+            width = rng.choice([0, 3, 12, 30])
+            codonaln = [''.join(rng.choice('ACGTURagtu-') for _ in range(width))
+                        for _ in range(rng.randint(1, 5))]
+            coloraln = [''.join(rng.choice('R-') for _ in range(width))
+                        for _ in codonaln]
+            maskseq = rng.choice(['', ''.join(rng.choice('# ') for _ in range(width))])
+            with mock.patch.object(pal2nal, 'np', None):
+                expected = pal2nal._remove_gap_columns(codonaln, coloraln, maskseq)
+            self.assertEqual(expected, pal2nal._remove_gap_columns(
+                codonaln, coloraln, maskseq))
+
+
+@unittest.skipUnless(pal2nal.np is not None, 'numpy not installed')
+class NumpyRemoveGapColumnsTestCase(RemoveGapColumnsMixIn, unittest.TestCase):
+    def test_vectorized(self):
+        self.assertIsNotNone(pal2nal._codon_column_filter(
+            ['ATGAAA', 'ATG---'], ['------'] * 2, ''))
+        self.assertIsNone(pal2nal._codon_column_filter(
+            ['ATGAAA', 'ATG'], ['------', '---'], ''))
+
+
+class PythonRemoveGapColumnsTestCase(RemoveGapColumnsMixIn, unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(pal2nal, 'np', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class CodonMatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.matcher = pal2nal._codon_matcher(1)
+
+    def test_cached(self):
+        self.assertIs(self.matcher, pal2nal._codon_matcher(1))
+        self.assertRaises(ValueError, pal2nal._codon_matcher, 7)
+
+    def test_matches(self):
+        self.assertTrue(self.matcher.matches('L', 'CTN'))
+        self.assertTrue(self.matcher.matches('L', 'uur'))
+        self.assertTrue(self.matcher.matches('*', 'TAR'))
+        self.assertFalse(self.matcher.matches('K', 'AAC'))
+        self.assertIn('uur', self.matcher.codons['L'])
+
+    def test_find(self):
+        tokens = [('B', 3), ('K', 3), (None, 2)]
+        self.assertEqual(2, self.matcher.find(tokens, 'CCATGAAGTTCC'))
+        self.assertEqual(-1, self.matcher.find(tokens, 'CCATGAACTTCC'))
+        self.assertEqual(0, self.matcher.find([], ''))
+
+
+class Pn2codonTestCase(unittest.TestCase):
+    def test_exact(self):
+        result = pal2nal._pn2codon('M-KF', 'GGATGAAGTTCTAA', 1)
+        self.assertEqual({'message': [], 'codonseq': 'ATGAAGTTC', 'result': 1},
+                         result)
+
+    def test_frameshift(self):
+        result = pal2nal._pn2codon('M2F', 'ATGAATTC', 1)
+        self.assertEqual('ATGAATTC', result['codonseq'])
+        self.assertEqual(1, result['result'])
+
+    def test_unknown(self):
+        result = pal2nal._pn2codon('MOF', 'ATGCCCTTC', 1)
+        self.assertEqual(["pepAlnPos 2: O unknown AA type. Taken as 'X'"],
+                         result['message'])
+        self.assertEqual(1, result['result'])
+
+    def test_mismatch(self):
+        protein = 'MKTEGLAVFDSTRPWQHNYCMK'
+        nuc = ''.join(CODONS[aa] for aa in protein)
+        nuc = nuc[:12] + 'CCC' + nuc[15:]
+        result = pal2nal._pn2codon(protein, 'GG' + nuc, 1)
+        self.assertEqual(2, result['result'])
+        self.assertEqual(nuc, result['codonseq'])
+        self.assertEqual(['pepAlnPos 5: G does not correspond to CCC'],
+                         result['message'])
+
+    def test_inconsistent(self):
+        result = pal2nal._pn2codon('MKTEGLAVFDSTRPW', 'ATGAAA', 1)
+        self.assertEqual(-1, result['result'])
+
+    def test_codontable(self):
+        self.assertEqual(1, pal2nal._pn2codon('MW', 'ATGTGA', 2)['result'])
+        self.assertNotEqual(1, pal2nal._pn2codon('MW', 'ATGTGA', 1)['result'])
+
+
+class CodonSequencesTestCase(unittest.TestCase):
+    def test_threads(self):
+        _, aaseq, codonseq = _family(30, 50)
+        codonseq[4] = codonseq[4][:30] + 'CCC' + codonseq[4][33:]
+        expected = [pal2nal._pn2codon(pep, nuc, 1)
+                    for pep, nuc in zip(aaseq, codonseq)]
+        actual = list(pal2nal._codon_sequences(aaseq, codonseq, 1, threads=2))
+        self.assertEqual(expected, actual)
+        self.assertEqual(2, actual[4]['result'])
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    """
+    Codon alignment construction against column-by-column string
+    concatenation, on a 300 sequence x 1,000 residue family
+    """
+
+    def test_matches_concat(self):
+        family = _family(30, 200) + ({'s3 5': 1},)
+        self.assertEqual(_concat_codon_alignment(*family),
+                         _built_codon_alignment(*family))
+
+    @benchmark
+    def test_benchmark(self):
+        family = _family(300, 1000) + ({},)
+        concat_time, expected = best_time(_concat_codon_alignment, *family,
+                                          repeats=2)
+        built_time, actual = best_time(_built_codon_alignment, *family,
+                                       repeats=2)
+        self.assertEqual(expected, actual)
+        self.assertLess(built_time, concat_time)
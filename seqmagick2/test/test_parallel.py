@@ -0,0 +1,57 @@
+"""
+Tests for seqmagick2.parallel
+"""
+from io import StringIO
+import functools
+import unittest
+
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from seqmagick2 import parallel, transform
+
+
+def _records(n):
+    return [SeqRecord(Seq('ACGT-' * (i % 4 + 1)), id='seq{0}'.format(i),
+                      description='seq{0} d'.format(i))
+            for i in range(n)]
+
+
+class StatelessPrefixTestCase(unittest.TestCase):
+    def test_prefix(self):
+        transforms = [functools.partial(transform.upper_sequences),
+                      functools.partial(transform.ungap_sequences),
+                      functools.partial(transform.head, head='5'),
+                      functools.partial(transform.lower_sequences)]
+        self.assertEqual(2, parallel.stateless_prefix_length(transforms))
+
+    def test_not_partial(self):
+        self.assertEqual(0, parallel.stateless_prefix_length([lambda r: r]))
+
+    def test_materialize_handles(self):
+        handle = StringIO('seq1\nseq2\n')
+        transforms = [functools.partial(transform.include_from_file,
+                                        handle=handle)]
+        result = parallel.materialize_handles(transforms)
+        self.assertEqual(['seq1\n', 'seq2\n'], result[0].keywords['handle'])
+
+
+class ImapTransformsTestCase(unittest.TestCase):
+    def test_order_preserved(self):
+        transforms = [
+            functools.partial(transform.include_from_file,
+                              handle=StringIO('seq1\nseq7\nseq10\nseq99\n')),
+            functools.partial(transform.ungap_sequences),
+            functools.partial(transform.min_length_discard, min_length=12),
+            functools.partial(transform.name_append_suffix, suffix='_x'),
+        ]
+        records = _records(100)
+        actual = list(parallel.imap_transforms(iter(records), transforms, 3,
+                                               batch_size=7))
+        self.assertEqual(['seq7_x', 'seq10_x', 'seq99_x'],
+                         [r.id for r in actual])
+        self.assertEqual([16, 12, 16], [len(r) for r in actual])
+
+    def test_empty(self):
+        transforms = [functools.partial(transform.upper_sequences)]
+        self.assertEqual([], list(parallel.imap_transforms([], transforms, 2)))
@@ -0,0 +1,58 @@
+"""
+Tests for seqmagick2.protein
+"""
+import random
+import unittest
+
+from Bio.SeqUtils import ProtParam
+
+from seqmagick2 import protein
+
+
+def _histogram(seq):
+    histogram = [0] * 256
+    for b in seq:
+        histogram[b] += 1
+    return histogram
+
+
+class PropertiesTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(2)
+        letters = protein.CANONICAL + 'XBZ*-'
+        self.sequences = [
+            ''.join(rng.choice(letters) for _ in range(rng.randint(1, 300)))
+            for _ in range(300)]
+        self.sequences.extend(['PETER', 'INGAR', 'X-M', 'AG', 'KD'])
+
+    def test_matches_protparam(self):
+        for seq in self.sequences:
+            canonical = ''.join(c for c in seq if c in protein.CANONICAL)
+            if not canonical:
+                continue
+            analysis = ProtParam.ProteinAnalysis(canonical)
+            seq = seq.encode('ascii')
+            pi, gravy = protein.properties(seq, _histogram(seq))
+            self.assertEqual(analysis.isoelectric_point(), pi)
+            self.assertEqual('{0:.2f}'.format(analysis.gravy()),
+                             '{0:.2f}'.format(gravy))
+
+    def test_zero_gravy_sign(self):
+        # Summed in order, as ProtParam does: 1.8 - 0.4 - 1.4 ...
+        for seq in (b'AGGGGGGGGGGGGGGGGGGGGSTTTTT', b'GGA', b'AGG'):
+            canonical = seq.decode('ascii')
+            expected = ProtParam.ProteinAnalysis(canonical).gravy()
+            self.assertEqual(
+                '{0:.2f}'.format(expected),
+                '{0:.2f}'.format(protein.properties(seq, _histogram(seq))[1]))
+
+    def test_no_canonical(self):
+        self.assertEqual((None, None),
+                         protein.properties(b'XB*-', _histogram(b'XB*-')))
+
+    def test_cached(self):
+        protein.isoelectric_point.cache_clear()
+        for seq in (b'MKTAYIAKQR', b'MKTAYIAKQR', b'MQRKTAYIAK'):
+            protein.properties(seq, _histogram(seq))
+        info = protein.isoelectric_point.cache_info()
+        self.assertEqual((2, 1), (info.hits, info.misses))
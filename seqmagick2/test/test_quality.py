@@ -0,0 +1,106 @@
+"""
+Tests for seqmagick2.quality
+"""
+import random
+import unittest
+from unittest import mock
+
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from seqmagick2 import quality
+from seqmagick2.fastrecord import FastRecord
+from seqmagick2.subcommands import quality_filter
+
+
+def _window_clip(scores, window_size, min_mean):
+    # As previously calculated by WindowQualityScoreFilter
+    clip_right = 0
+    for i, a in enumerate(
+            quality_filter.moving_average(scores, window_size)):
+        if a >= min_mean:
+            clip_right = i + window_size
+        else:
+            break
+    return clip_right
+
+
+def _quals(n=300, seed=1):
+    rng = random.Random(seed)
+    quals = []
+    for _ in range(n):
+        base = rng.randint(5, 40)
+        quals.append(bytes(33 + max(0, min(41, base + rng.randint(-12, 12) -
+                                           j // 15))
+                           for j in range(rng.randint(12, 200))))
+    return quals
+
+
+class QualityKernelMixIn(object):
+    def setUp(self):
+        self.quals = _quals()
+        self.scores = [[q - 33 for q in qual] for qual in self.quals]
+
+    def test_decode(self):
+        self.assertEqual([0, 40, 20], list(quality.decode('!I5')))
+        self.assertEqual([0, 40, 20], list(quality.decode(b'!I5')))
+
+    def test_mean(self):
+        for qual, scores in zip(self.quals, self.scores):
+            self.assertEqual(quality_filter.mean(scores),
+                             quality.mean(quality.decode(qual)))
+        self.assertRaises(ZeroDivisionError, quality.mean, quality.decode(b''))
+
+    def test_window_clip(self):
+        for qual, scores in zip(self.quals, self.scores):
+            for window_size, min_mean in ((10, 25), (8, 12.5), (5, 30)):
+                if len(scores) <= window_size:
+                    continue
+                self.assertEqual(
+                    _window_clip(scores, window_size, min_mean),
+                    quality.window_clip(quality.decode(qual), window_size,
+                                        min_mean))
+
+    def test_ambiguous_count(self):
+        self.assertEqual(3, quality.ambiguous_count(b'ANCnGTN'))
+        self.assertEqual(0, quality.ambiguous_count(b''))
+
+    def test_batch_means(self):
+        self.assertEqual([quality_filter.mean(s) for s in self.scores],
+                         quality.batch_means(self.quals))
+        self.assertEqual([], quality.batch_means([]))
+        self.assertRaises(ZeroDivisionError, quality.batch_means,
+                          [b'II', b''])
+
+    def test_batch_window_clips(self):
+        quals = [q for q in self.quals if len(q) > 10]
+        expected = [_window_clip([q - 33 for q in qual], 10, 25)
+                    for qual in quals]
+        self.assertEqual(expected, quality.batch_window_clips(quals, 10, 25))
+        self.assertEqual([], quality.batch_window_clips([], 10, 25))
+
+    def test_batch_ambiguous_counts(self):
+        seqs = [b'ACGT', b'NNnA', b'', b'ACNGTn']
+        self.assertEqual([0, 3, 0, 2], quality.batch_ambiguous_counts(seqs))
+
+    def test_scores(self):
+        record = FastRecord('r1', 'r1', b'ACG', b'!I5')
+        self.assertEqual([0, 40, 20], list(quality.scores(record)))
+        record = SeqRecord(Seq('ACG'), id='r1',
+                           letter_annotations={'phred_quality': [0, 40, 20]})
+        self.assertEqual([0, 40, 20], list(quality.scores(record)))
+        self.assertIsNone(quality.scores(SeqRecord(Seq('ACG'))))
+        self.assertIsNone(quality.scores(FastRecord('r1', 'r1', b'ACG')))
+
+
+@unittest.skipIf(quality.np is None, 'numpy not installed')
+class NumpyQualityTestCase(QualityKernelMixIn, unittest.TestCase):
+    pass
+
+
+class PurePythonQualityTestCase(QualityKernelMixIn, unittest.TestCase):
+    def setUp(self):
+        super(PurePythonQualityTestCase, self).setUp()
+        patcher = mock.patch.object(quality, 'np', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
@@ -0,0 +1,151 @@
+"""
+Tests for seqmagick2.recordstore
+"""
+import pickle
+import random
+import tempfile
+import unittest
+
+from Bio.Seq import Seq
+from Bio.SeqFeature import SeqFeature, SimpleLocation
+from Bio.SeqRecord import SeqRecord
+
+from seqmagick2 import recordstore
+from seqmagick2.fastrecord import FastRecord
+from seqmagick2.test import benchmark, best_time
+
+
+def _reads(n=200, length=150, seed=1):
+    rng = random.Random(seed)
+    return [SeqRecord(Seq(''.join(rng.choice('ACGT') for _ in range(length))),
+                      id='r{0}'.format(i), name='r{0}'.format(i),
+                      description='r{0} sample=1'.format(i),
+                      letter_annotations={'phred_quality': [
+                          rng.randint(2, 40) for _ in range(length)]})
+            for i in range(n)]
+
+
+def _fields(record):
+    return (record.id, record.name, record.description, str(record.seq),
+            record.letter_annotations.get('phred_quality'))
+
+
+class RecordStoreMixIn(object):
+    buffer_size = recordstore.DEFAULT_BUFFER_SIZE
+
+    def _store(self, records):
+        store = recordstore.RecordStore(self.buffer_size)
+        self.addCleanup(store.close)
+        store.extend(records)
+        return store
+
+    def test_seqrecords(self):
+        records = _reads(20)
+        records[3].name = 'other'
+        del records[4].letter_annotations['phred_quality']
+        store = self._store(records)
+        self.assertEqual(20, len(store))
+        self.assertEqual([_fields(r) for r in records],
+                         [_fields(r) for r in store()])
+
+    def test_multi_pass(self):
+        records = _reads(20)
+        store = self._store(records)
+        outer = store()
+        first = next(outer)
+        # Passes may be interleaved
+        self.assertEqual([r.id for r in records], [r.id for r in store()])
+        self.assertEqual([r.id for r in records[1:]], [r.id for r in outer])
+        self.assertEqual(records[0].id, first.id)
+
+    def test_fastrecords(self):
+        records = [FastRecord('a', 'a desc', b'ACGT', b'IIII'),
+                   FastRecord('b', 'b \udcff', b'AC-T')]
+        actual = list(self._store(records)())
+        self.assertEqual([(r.id, r.description, r.seq, r.qual)
+                          for r in records],
+                         [(r.id, r.description, r.seq, r.qual)
+                          for r in actual])
+
+    def test_annotated_pickled(self):
+        record = SeqRecord(Seq('ACGTACGT'), id='g', description='gene',
+                           annotations={'molecule_type': 'DNA'})
+        record.features.append(SeqFeature(SimpleLocation(0, 4), type='CDS'))
+        solexa = SeqRecord(Seq('AC'), id='s',
+                           letter_annotations={'solexa_quality': [-5, 10]})
+        actual = list(self._store([record, solexa])())
+        self.assertEqual({'molecule_type': 'DNA'}, actual[0].annotations)
+        self.assertEqual('CDS', actual[0].features[0].type)
+        self.assertEqual([-5, 10], actual[1].letter_annotations['solexa_quality'])
+
+    def test_find(self):
+        store = self._store(_reads(20))
+        self.assertEqual('r7 sample=1', store.find('r7').description)
+        self.assertRaises(KeyError, store.find, 'missing')
+
+    def test_append_after_replay(self):
+        store = self._store(_reads(2))
+        list(store())
+        self.assertRaises(ValueError, store.append, _reads(1)[0])
+
+
+class InMemoryTestCase(RecordStoreMixIn, unittest.TestCase):
+    def test_not_spilled(self):
+        self.assertFalse(self._store(_reads(5)).spilled)
+
+
+class SpilledTestCase(RecordStoreMixIn, unittest.TestCase):
+    buffer_size = 100
+
+    def test_spilled(self):
+        self.assertTrue(self._store(_reads(5)).spilled)
+
+
+def _pickle_buffer(records, passes):
+    """
+    The pickle-based record buffer replaced by RecordStore
+    """
+    with tempfile.TemporaryFile() as tf:
+        pickler = pickle.Pickler(tf)
+        for record in records:
+            pickler.dump(record)
+        size = tf.tell()
+        for _ in range(passes):
+            tf.seek(0)
+            unpickler = pickle.Unpickler(tf)
+            while True:
+                try:
+                    unpickler.load()
+                except EOFError:
+                    break
+    return size
+
+
+def _record_store(records, passes):
+    with recordstore.RecordStore(0) as store:
+        store.extend(records)
+        size = store.size
+        for _ in range(passes):
+            for _ in store():
+                pass
+    return size
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    """
+    Throughput and temporary space of RecordStore against the pickle buffer,
+    on spilled FASTQ-like reads
+    """
+    passes = 2
+
+    def test_size(self):
+        records = _reads(3000)
+        self.assertLess(_record_store(records, 0),
+                        _pickle_buffer(records, 0))
+
+    @benchmark
+    def test_benchmark(self):
+        records = _reads(3000)
+        pickle_time, _ = best_time(_pickle_buffer, records, self.passes)
+        store_time, _ = best_time(_record_store, records, self.passes)
+        self.assertLess(store_time, pickle_time)
@@ -0,0 +1,149 @@
+"""
+Tests for seqmagick2.resultcache
+"""
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from seqmagick2 import resultcache
+from seqmagick2.subcommands import info
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tempdir, 'cache')
+        self.path = self.write('a.fasta', '>s1\nACGT\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, name, content, mtime=None):
+        path = os.path.join(self.tempdir, name)
+        with open(path, 'w') as fp:
+            fp.write(content)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def test_round_trip(self):
+        with resultcache.ResultCache(self.cache_dir) as cache:
+            self.assertIsNone(cache.get('summary', self.path))
+            cache.put('summary', self.path, None, ['TRUE', 4, 4, 4.0, 1])
+        with resultcache.ResultCache(self.cache_dir) as cache:
+            self.assertEqual(['TRUE', 4, 4, 4.0, 1],
+                             cache.get('summary', self.path))
+            self.assertIsNone(cache.get('details', self.path))
+            self.assertIsNone(cache.get('summary', self.path, 'fasta'))
+            self.assertEqual((1, 2), (cache.hits, cache.misses))
+
+    def test_changed_file(self):
+        with resultcache.ResultCache(self.cache_dir) as cache:
+            cache.put('summary', self.path, None, [1])
+        self.write('a.fasta', '>s1\nACGTA\n')
+        with resultcache.ResultCache(self.cache_dir) as cache:
+            self.assertIsNone(cache.get('summary', self.path))
+
+    def test_content_hash(self):
+        self.write('a.fasta', '>s1\nACGT\n', mtime=1000000)
+        with resultcache.ResultCache(self.cache_dir,
+                                     hash_contents=True) as cache:
+            cache.put('summary', self.path, None, [1])
+        # Same size and modification time, different contents
+        self.write('a.fasta', '>s1\nACGA\n', mtime=1000000)
+        with resultcache.ResultCache(self.cache_dir) as cache:
+            self.assertIsNone(cache.get('summary', self.path))
+        with resultcache.ResultCache(self.cache_dir,
+                                     hash_contents=True) as cache:
+            self.assertIsNone(cache.get('summary', self.path))
+
+    def test_version(self):
+        with resultcache.ResultCache(self.cache_dir) as cache:
+            cache.put('summary', self.path, None, [1])
+        with mock.patch.object(resultcache, '__version__', '0.0.1'):
+            with resultcache.ResultCache(self.cache_dir) as cache:
+                self.assertIsNone(cache.get('summary', self.path))
+
+    def test_stdin(self):
+        with resultcache.ResultCache(self.cache_dir) as cache:
+            cache.put('summary', '-', None, [1])
+            self.assertIsNone(cache.get('summary', '-'))
+
+    def test_evict(self):
+        paths = [self.write('f{0}.fasta'.format(i), '>s\nA\n')
+                 for i in range(4)]
+        with resultcache.ResultCache(self.cache_dir) as cache:
+            for path in paths:
+                cache.put('summary', path, None, [os.urandom(40).hex()])
+            # Most recently used: paths[0]
+            cache.get('summary', paths[0])
+        with resultcache.ResultCache(self.cache_dir, max_size=200) as cache:
+            pass
+        with resultcache.ResultCache(self.cache_dir) as cache:
+            kept = [cache.get('summary', path) is not None
+                    for path in paths]
+        self.assertTrue(kept[0])
+        self.assertFalse(kept[1])
+        self.assertLess(sum(kept), 4)
+
+
+class CachedInfoTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tempdir, 'cache')
+        self.files = []
+        for name, content in [('a.fasta', '>s1\nACGT\n>s2\nMKVL\n'),
+                              ('empty.fasta', ''),
+                              ('b.fasta', '>s3\nAC-GU\n')]:
+            path = os.path.join(self.tempdir, name)
+            with open(path, 'w') as fp:
+                fp.write(content)
+            self.files.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_details_by_file(self):
+        files = self.files + self.files[:1]
+        for threads in (1, 2):
+            by_file = list(info._details_by_file(files, threads=threads,
+                                                 batch_size=1))
+            self.assertEqual([2, 0, 1, 2], [len(rows) for rows in by_file])
+            self.assertEqual(
+                [row for f in files for row in info.iter_sequence_details(f)],
+                [row for rows in by_file for row in rows])
+
+    def test_details_by_file_lazy(self):
+        details = mock.Mock(side_effect=info.sequence_details)
+        with mock.patch.object(info, 'sequence_details', details):
+            by_file = info._details_by_file(self.files)
+            self.assertEqual(2, len(next(by_file)))
+            # Only the rows of the first file, and the row ending it
+            self.assertEqual(3, details.call_count)
+
+    def test_cached(self):
+        files = self.files
+        expected = [info.summarize_sequence_file(f) for f in files]
+        computed = []
+
+        def compute(misses):
+            computed.extend(misses)
+            return info._summaries(misses)
+
+        for _ in range(2):
+            with resultcache.ResultCache(self.cache_dir) as cache:
+                self.assertEqual(expected, list(info._cached(
+                    cache, 'summary', files, None, compute)))
+        self.assertEqual(files, computed)
+
+        expected = [list(info.iter_sequence_details(f)) for f in files]
+        with resultcache.ResultCache(self.cache_dir) as cache:
+            self.assertEqual(expected, list(info._cached(
+                cache, 'details', files, None, info._details_by_file)))
+        with resultcache.ResultCache(self.cache_dir) as cache:
+            self.assertEqual(expected, list(info._cached(
+                cache, 'details', files, None, info._details_by_file)))
+            self.assertEqual(3, cache.hits)
@@ -0,0 +1,159 @@
+"""
+Tests for seqmagick2.scan
+"""
+import gzip
+import os.path
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from Bio import SeqIO
+
+from seqmagick2 import scan
+from seqmagick2.subcommands import info
+
+FASTA = """>s1 first sequence
+ACGTACGTAC
+ACGT ACGTA\t
+ACG
+>s2
+
+ACGTACGTAC
+>empty nothing here
+>s3 third
+AC"""
+
+FASTQ = """@r1 first
+ACGTACGT
++
+IIII@III
+@r2
+AC
++r2
+@I
+@r3
+
++
+
+"""
+
+
+def _random_fasta(rng, count=200):
+    lines = []
+    for i in range(count):
+        length = rng.randint(0, 300)
+        seq = ''.join(rng.choice('ACGT-N') for _ in range(length))
+        lines.append('>r{0} description'.format(i))
+        lines.extend(seq[j:j + 60] for j in range(0, len(seq), 60))
+    return '\n'.join(lines) + '\n'
+
+
+def _random_fastq(rng, count=200):
+    lines = []
+    for i in range(count):
+        length = rng.randint(0, 150)
+        lines.extend(['@r{0} 1:N:0'.format(i),
+                      ''.join(rng.choice('ACGTN') for _ in range(length)),
+                      '+',
+                      ''.join(rng.choice('!#5@I') for _ in range(length))])
+    return '\n'.join(lines) + '\n'
+
+
+class ScanMixIn(object):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        rng = random.Random(1)
+        self.files = {'fasta': FASTA, 'fastq': FASTQ,
+                      'random.fasta': _random_fasta(rng),
+                      'random.fastq': _random_fastq(rng)}
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, name, content, newline=None):
+        path = os.path.join(self.tempdir, name)
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'wt', newline=newline) as fp:
+            fp.write(content)
+        return path
+
+    def assertLengths(self, path, file_type):
+        with open(path) as fp:
+            expected = [len(r) for r in SeqIO.parse(fp, file_type)]
+        for chunk_size in (1, 7, 100, scan.CHUNK_SIZE):
+            for use_mmap in (True, False):
+                lengths = [length for chunk in scan.sequence_lengths(
+                    path, file_type, chunk_size, use_mmap) for length in chunk]
+                self.assertEqual(expected, lengths)
+
+    def assertUnsupported(self, path, file_type):
+        self.assertRaises(scan.Unsupported, list,
+                          scan.sequence_lengths(path, file_type))
+
+    def test_lengths(self):
+        for name, content in self.files.items():
+            file_type = name.rsplit('.', 1)[-1]
+            for newline in ('\n', '\r\n'):
+                path = self.write(file_type + '.' + file_type, content,
+                                  newline)
+                self.assertLengths(path, file_type)
+
+    def test_compressed(self):
+        path = self.write('test.fastq.gz', self.files['random.fastq'])
+        lengths = [length for chunk in scan.sequence_lengths(path, 'fastq')
+                   for length in chunk]
+        with gzip.open(path, 'rt') as fp:
+            self.assertEqual([len(r) for r in SeqIO.parse(fp, 'fastq')],
+                             lengths)
+
+    def test_trailing_whitespace(self):
+        # Stripped by Bio.SeqIO too
+        path = self.write('trailing.fastq', '@r1\nACGT  \n+\nIIII\n')
+        self.assertLengths(path, 'fastq')
+
+    def test_empty(self):
+        path = self.write('empty.fasta', '')
+        self.assertEqual([], list(scan.sequence_lengths(path, 'fasta')))
+
+    def test_unsupported(self):
+        cases = [
+            ('comment.fasta', ';comment\n>s1\nACGT\n'),
+            ('mac.fasta', '>s1\rACGT\r'),
+            ('multiline.fastq', '@r1\nACGT\nAC\n+\nIIII\nII\n'),
+            ('captions.fastq', '@r1\nACGT\n+r2\nIIII\n'),
+            ('lengths.fastq', '@r1\nACGT\n+\nIII\n'),
+            ('quality.fastq', '@r1\nACGT\n+\nII I\n'),
+            ('truncated.fastq', '@r1\nACGT\n+\n'),
+        ]
+        for name, content in cases:
+            self.assertUnsupported(self.write(name, content),
+                                   name.rsplit('.', 1)[-1])
+
+    def test_summarize_fallback(self):
+        path = self.write('multiline.fastq', '@r1\nACGT\nAC\n+\nIIII\nII\n')
+        self.assertEqual((path, 'FALSE', 6, 6, 6.0, 1),
+                         info.summarize_sequence_file(path))
+        path = self.write('lengths.fastq', '@r1\nACGT\n+\nIII\n')
+        self.assertRaises(ValueError, info.summarize_sequence_file, path)
+
+    def test_summarize(self):
+        path = self.write('random.fasta', self.files['random.fasta'])
+        with mock.patch.object(scan, 'sequence_lengths',
+                               side_effect=scan.Unsupported):
+            expected = info.summarize_sequence_file(path)
+        self.assertEqual(expected, info.summarize_sequence_file(path))
+
+
+@unittest.skipIf(scan.np is None, 'numpy not installed')
+class NumpyScanTestCase(ScanMixIn, unittest.TestCase):
+    pass
+
+
+class PurePythonScanTestCase(ScanMixIn, unittest.TestCase):
+    def setUp(self):
+        super(PurePythonScanTestCase, self).setUp()
+        patcher = mock.patch.object(scan, 'np', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
@@ -0,0 +1,138 @@
+"""
+Tests for seqmagick2.seqindex
+"""
+import io
+import os
+import os.path
+import shutil
+import tempfile
+import time
+import unittest
+
+from Bio import SeqIO
+
+from seqmagick2 import seqindex, transform
+
+FASTA = """>s1 first sequence
+ACGTACGTAC
+ACGTACGTAC
+ACG
+>s2
+ACGTACGTAC
+>empty nothing here
+>s3 third
+AC
+"""
+
+FASTQ = """@r1 first
+ACGTA
+CGT
++
+IIIII
+!!!
+@r2
+AC
++r2
+@I
+"""
+
+
+class IndexMixIn(object):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'seqs.' + self.file_type)
+        with open(self.path, 'w') as fp:
+            fp.write(self.content)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _expected(self):
+        return list(SeqIO.parse(self.path, self.file_type))
+
+    def test_fetch(self):
+        with seqindex.SequenceIndex.build(self.path, self.file_type) as index:
+            actual = [index.fetch(entry) for entry in index]
+        expected = self._expected()
+        self.assertEqual([r.id for r in expected], [r.id for r in actual])
+        for e, a in zip(expected, actual):
+            self.assertEqual(e.description, a.description)
+            self.assertEqual(str(e.seq), str(a.seq))
+            self.assertEqual(e.letter_annotations, a.letter_annotations)
+
+    def test_round_trip(self):
+        index = seqindex.SequenceIndex.build(self.path, self.file_type)
+        sidecar = seqindex.index_path(self.path, self.file_type)
+        with open(sidecar, 'w') as fp:
+            index.write(fp)
+        loaded = seqindex.SequenceIndex.load(self.path, self.file_type)
+        self.assertEqual(index.entries, loaded.entries)
+
+    def test_open_fresh(self):
+        sidecar = seqindex.index_path(self.path, self.file_type)
+        self.assertIsNone(seqindex.open_fresh(self.path, self.file_type))
+        with open(sidecar, 'w') as fp:
+            seqindex.SequenceIndex.build(self.path, self.file_type).write(fp)
+        self.assertIsNotNone(seqindex.open_fresh(self.path, self.file_type))
+        # Input modified since indexing
+        later = time.time() + 10
+        os.utime(self.path, (later, later))
+        self.assertIsNone(seqindex.open_fresh(self.path, self.file_type))
+
+    def test_sort(self):
+        sidecar = seqindex.index_path(self.path, self.file_type)
+        expected = {}
+        for key in ('length', 'name'):
+            for direction in (0, 1):
+                sort = getattr(transform, 'sort_' + key)
+                with open(self.path) as fp:
+                    expected[key, direction] = [
+                        r.id for r in sort(fp, self.file_type, direction)]
+        with open(sidecar, 'w') as fp:
+            seqindex.SequenceIndex.build(self.path, self.file_type).write(fp)
+        for (key, direction), ids in expected.items():
+            sort = getattr(transform, 'sort_' + key)
+            with open(self.path) as fp:
+                self.assertEqual(
+                    ids, [r.id for r in sort(fp, self.file_type, direction)])
+
+
+class FastaIndexTestCase(IndexMixIn, unittest.TestCase):
+    file_type = 'fasta'
+    content = FASTA
+
+    def test_layout(self):
+        index = seqindex.SequenceIndex.build(self.path, self.file_type)
+        s1 = index.entries[0]
+        self.assertEqual(('s1', 23, 19, 10, 11, None), tuple(s1))
+        self.assertEqual('s1\t23\t19\t10\t11\n', s1.format())
+        self.assertEqual(0, index.entries[2].length)
+        self.assertIn('s3', index)
+
+    def test_long_header(self):
+        title = 'long ' + 'x' * 10000
+        with open(self.path, 'w') as fp:
+            fp.write('>a\nAC\n>{0}\nACGT\n'.format(title))
+        with seqindex.SequenceIndex.build(self.path, self.file_type) as index:
+            self.assertEqual(title, index['long'].description)
+
+    def test_irregular_lines(self):
+        with open(self.path, 'w') as fp:
+            fp.write('>a\nACGT\nAC\nACGT\n')
+        self.assertRaises(ValueError, seqindex.SequenceIndex.build,
+                          self.path, self.file_type)
+
+
+class FastqIndexTestCase(IndexMixIn, unittest.TestCase):
+    file_type = 'fastq'
+    content = FASTQ
+
+    def test_layout(self):
+        index = seqindex.SequenceIndex.build(self.path, self.file_type)
+        self.assertEqual('r1\t8\t10\t5\t6\t22\n', index.entries[0].format())
+
+    def test_truncated(self):
+        with open(self.path, 'w') as fp:
+            fp.write('@a\nACGT\n+\nII\n')
+        self.assertRaises(ValueError, seqindex.SequenceIndex.build,
+                          self.path, self.file_type)
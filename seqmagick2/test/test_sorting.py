@@ -0,0 +1,72 @@
+"""
+Tests for seqmagick2.sorting
+"""
+import io
+import random
+import unittest
+from unittest import mock
+
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from seqmagick2 import sorting, transform
+
+
+def _records(n=300, seed=1):
+    rng = random.Random(seed)
+    # Few distinct lengths and names, so that there are many ties
+    return [SeqRecord(Seq('A' * rng.randint(1, 8)),
+                      id='s{0}'.format(rng.randint(0, 20)),
+                      description='input {0}'.format(i))
+            for i in range(n)]
+
+
+def _keys(records):
+    return [(r.id, r.description, str(r.seq)) for r in records]
+
+
+class SortRecordsTestCase(unittest.TestCase):
+    def _check(self, key, reverse, memory):
+        records = _records()
+        expected = sorted(records, key=key, reverse=reverse)
+        actual = list(sorting.sort_records(
+            _records(), key=key, reverse=reverse, memory=memory))
+        self.assertEqual(_keys(expected), _keys(actual))
+
+    def test_in_memory(self):
+        for reverse in (False, True):
+            self._check(lambda r: (len(r), r.id), reverse,
+                        sorting.DEFAULT_SORT_MEMORY)
+
+    def test_runs(self):
+        for reverse in (False, True):
+            self._check(lambda r: (len(r), r.id), reverse, 20000)
+            self._check(lambda r: r.id, reverse, 20000)
+
+    def test_multi_level_merge(self):
+        with mock.patch.object(sorting, 'MAX_MERGE_RUNS', 3):
+            for reverse in (False, True):
+                self._check(lambda r: r.id, reverse, 5000)
+
+    def test_empty(self):
+        self.assertEqual([], list(sorting.sort_records([], key=len)))
+
+
+class SortTransformTestCase(unittest.TestCase):
+    def setUp(self):
+        self.handle = io.StringIO(''.join(
+            '>{0} {1}\n{2}\n'.format(r.id, r.description, r.seq)
+            for r in _records()))
+
+    def test_sort_length(self):
+        expected = [r.id for r in transform.sort_length(self.handle, 'fasta')]
+        self.handle.seek(0)
+        actual = [r.id for r in transform.sort_length(self.handle, 'fasta',
+                                                      memory=10000)]
+        self.assertEqual(expected, actual)
+
+    def test_sort_name_desc(self):
+        records = list(transform.sort_name(self.handle, 'fasta', 0,
+                                           memory=10000))
+        ids = [r.id for r in records]
+        self.assertEqual(sorted(ids, reverse=True), ids)
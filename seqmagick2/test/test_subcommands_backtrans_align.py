@@ -1,3 +1,5 @@
+import io
+import os
 import unittest
 
 from Bio.Seq import Seq
@@ -74,3 +76,49 @@ class AlignmentMapperTestCase(unittest.TestCase):
                 SeqRecord(Seq('KV-'), id='2')]
         mapped = self.instance.map_all(prot, nucl)
         self.assertRaises(ValueError, list, mapped)
+
+
+class ReadManifestTestCase(unittest.TestCase):
+    def _read(self, text, out_dir='out', outform='clustal'):
+        fp = io.StringIO(text)
+        fp.name = 'manifest.tsv'
+        return backtrans_align.read_manifest(fp, out_dir, outform)
+
+    def test_read(self):
+        families = self._read('# family\tnucleotides\n\n'
+                              'a/fam1.aln\ta/fam1.fasta\n'
+                              'b/fam2.fasta\tb/fam2.fna\tcodon/fam2.fa\r\n',
+                              outform='fasta')
+        self.assertEqual(
+            [backtrans_align.Family('fam1', 'a/fam1.aln', 'a/fam1.fasta',
+                                    os.path.join('out', 'fam1.fasta')),
+             backtrans_align.Family('fam2', 'b/fam2.fasta', 'b/fam2.fna',
+                                    'codon/fam2.fa')],
+            families)
+
+    def test_invalid_line(self):
+        self.assertRaisesRegex(ValueError, r'manifest.tsv, line 2',
+                               self._read, 'a.aln\ta.fasta\na.aln\n')
+
+    def test_duplicate_output(self):
+        self.assertRaisesRegex(ValueError, r'also written by line 1',
+                               self._read, 'a/f.aln\ta.fasta\nb/f.aln\tb.fasta\n')
+
+    def test_overwrite_input(self):
+        self.assertRaisesRegex(ValueError, r'would overwrite an input',
+                               self._read, 'f.aln\tf.fasta\n', out_dir='.')
+
+
+class ErrorSummaryTestCase(unittest.TestCase):
+    def test_inconsistent(self):
+        messages = ('#---  ERROR: inconsistency between the following pep '
+                    'and nuc seqs  ---#\n>seq2\nMKTEGL\n>seq2\nATGAAA\n')
+        self.assertEqual('ERROR: inconsistency between the following pep and '
+                         'nuc seqs (seq2)',
+                         backtrans_align._error_summary(messages))
+
+    def test_html(self):
+        messages = ('<pre>\n\nERROR: number of input seqs differ '
+                    '(aa: 3;  nuc: 2)!!\n\n')
+        self.assertEqual('ERROR: number of input seqs differ (aa: 3;  nuc: 2)!!',
+                         backtrans_align._error_summary(messages))
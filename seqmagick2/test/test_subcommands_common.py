@@ -1,10 +1,13 @@
 import argparse
 import os
 import os.path
+import shutil
 import sys
 import unittest
 import tempfile
+from unittest import mock
 
+from seqmagick2 import compression
 from seqmagick2.subcommands import common
 
 d = os.path.dirname(__file__)
@@ -66,6 +69,18 @@ class PositiveValueTestCase(unittest.TestCase):
     def test_zero(self):
         self.assertEqual(0, common.positive_value(int)('0'))
 
+class MemorySizeTestCase(unittest.TestCase):
+    def test_suffixes(self):
+        self.assertEqual(100, common.memory_size('100'))
+        self.assertEqual(512 << 20, common.memory_size('512M'))
+        self.assertEqual(3 << 29, common.memory_size('1.5g'))
+        self.assertEqual(2 << 10, common.memory_size('2KB'))
+
+    def test_invalid(self):
+        for value in ('', 'M', '-1G', 'lots'):
+            self.assertRaises(argparse.ArgumentTypeError,
+                              common.memory_size, value)
+
 class CutRangeTestCase(unittest.TestCase):
     def test_out_of_order(self):
         self.assertRaises(argparse.ArgumentTypeError,
@@ -133,6 +148,33 @@ class AtomicWriteTestCase(unittest.TestCase):
         with open(self.input_file) as fp:
             self.assertEqual(self.new_content, fp.read())
 
+    def test_factory_error_removes_temp(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+
+        def factory(path):
+            raise IOError()
+
+        path = os.path.join(tempdir, 'out.fasta')
+        with self.assertRaises(IOError):
+            with common.atomic_write(path, file_factory=factory):
+                pass
+        self.assertEqual([], os.listdir(tempdir))
+
+    def test_missing_zstd(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        path = os.path.join(tempdir, 'out.fasta.zst')
+        with mock.patch.object(compression, 'zstd', None):
+            with self.assertRaises(ValueError) as context:
+                with common.atomic_write(
+                        path, file_factory=common.FileType('w')):
+                    pass
+        self.assertEqual(
+            'Writing {0} requires the zstandard package'.format(path),
+            str(context.exception))
+        self.assertEqual([], os.listdir(tempdir))
+
     def tearDown(self):
         os.remove(self.input_file)
 
@@ -195,7 +237,6 @@ class FileTypeTestCase(unittest.TestCase):
         with common.FileType('rt')(p(self.testfile + '.gz')) as fp:
             self.assertEqual(fp.read(), self.expected)
 
-    @unittest.skipIf(sys.version_info.major == 3, 'bzip2 not supported')
     def test_read_bz2(self):
         with common.FileType('rt')(p(self.testfile + '.bz2')) as fp:
             self.assertEqual(fp.read(), self.expected)
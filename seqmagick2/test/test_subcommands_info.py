@@ -0,0 +1,85 @@
+"""
+Tests for seqmagick2.subcommands.info
+"""
+import os.path
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from seqmagick2.subcommands import info
+
+SEQUENCES = [
+    ('dna', b'ACGTNacgtn--..'),
+    ('rna', b'ACGUUacgu-'),
+    ('mixed', b'ACGTU'),
+    ('protein', b'MKTAYIAKQRQISFVKSHFSRQ*x'),
+    ('gaps', b'---...'),
+    ('empty', b''),
+    ('unknown', b'ACGT123'),
+]
+
+
+class SequenceDetailsMixIn(object):
+    def test_sequence_details(self):
+        rows = {name: info.sequence_details('f.fasta', name, seq)
+                for name, seq in SEQUENCES}
+        self.assertEqual(
+            ('f.fasta', 'dna', 14, 40.0, 2, 4, 'DNA', 2, 2, 2, 2, 0, None,
+             None), rows['dna'])
+        self.assertEqual(
+            ('f.fasta', 'rna', 10, (4 / 9.0) * 100.0, 0, 1, 'RNA', 2, 2, 2,
+             0, 3, None, None), rows['rna'])
+        self.assertEqual('PROTEIN', rows['mixed'][6])
+        self.assertEqual((None, None, None, None, None),
+                         rows['protein'][7:12])
+        self.assertEqual('PROTEIN', rows['protein'][6])
+        self.assertIsNotNone(rows['protein'][12])
+        self.assertEqual(('f.fasta', 'gaps', 6, None, 0, 6, 'UNKNOWN', None,
+                          None, None, None, None, None, None), rows['gaps'])
+        self.assertEqual(0, rows['empty'][2])
+        self.assertEqual('UNKNOWN', rows['unknown'][6])
+
+    def test_seq_type(self):
+        for _, seq in SEQUENCES:
+            self.assertEqual(
+                info._detect_seq_type(seq.upper().decode('ascii')),
+                info.sequence_details('f', 'id', seq)[6])
+
+
+@unittest.skipIf(info.np is None, 'numpy not installed')
+class NumpySequenceDetailsTestCase(SequenceDetailsMixIn, unittest.TestCase):
+    pass
+
+
+class PurePythonSequenceDetailsTestCase(SequenceDetailsMixIn,
+                                        unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(info, 'np', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class ImapSequenceDetailsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.files = []
+        for i in range(3):
+            path = os.path.join(self.tempdir, 'f{0}.fasta'.format(i))
+            with open(path, 'w') as fp:
+                for name, seq in SEQUENCES * (i + 1):
+                    fp.write('>{0}\n{1}\n'.format(name, seq.decode('ascii')))
+            self.files.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_ordered(self):
+        expected = [row for f in self.files
+                    for row in info.iter_sequence_details(f)]
+        self.assertEqual(len(SEQUENCES) * 6, len(expected))
+        actual = list(info.imap_sequence_details(self.files, threads=2,
+                                                 batch_size=4))
+        self.assertEqual(expected, actual)
+        self.assertEqual(expected,
+                         list(info.imap_sequence_details(self.files)))
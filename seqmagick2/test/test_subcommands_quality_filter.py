@@ -1,11 +1,21 @@
+import argparse
 from io import StringIO
+import itertools
+import os
+import random
+import shutil
 import sys
+import tempfile
 import unittest
+from unittest import mock
 
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 
+from seqmagick2 import fastrecord
+from seqmagick2.fastrecord import FastRecord
 from seqmagick2.subcommands import quality_filter
+from seqmagick2.test import benchmark, best_time
 
 IS_PYPY = hasattr(sys, 'pypy_version_info')
 
@@ -215,6 +225,320 @@ class PrimerBarcodeFilterTestCase(unittest.TestCase):
         self.assertEqual(['CGAT', 'CGCT'], [str(s.seq) for s in actual])
 
 
+class FastRecordFilterTestCase(unittest.TestCase):
+    """
+    Filters give the same results on FastRecords, with raw quality strings,
+    as on SeqRecords
+    """
+
+    def setUp(self):
+        self.records = [
+            SeqRecord(Seq('ACGTNACGTACGTAC'), 'seq1', description='seq1 a',
+                      letter_annotations={'phred_quality':
+                                          [30] * 8 + [10] * 7}),
+            SeqRecord(Seq('ACGTACGTAC'), 'seq2', description='seq2',
+                      letter_annotations={'phred_quality': [12] * 10}),
+            SeqRecord(Seq('NNGTACGTACGTAAN'), 'seq3', description='seq3',
+                      letter_annotations={'phred_quality': [40] * 15}),
+        ]
+        self.fast_records = [
+            FastRecord(r.id, r.description, bytes(r.seq),
+                       bytes(q + 33 for q in
+                             r.letter_annotations['phred_quality']))
+            for r in self.records]
+
+    def _check(self, make_filter):
+        expected = [(r.id, str(r.seq))
+                    for r in make_filter().filter_records(self.records)]
+        actual = [(r.id, r.seq.decode('ascii')) for r in
+                  make_filter().filter_records(self.fast_records)]
+        self.assertEqual(expected, actual)
+
+    def test_filters(self):
+        self._check(lambda: quality_filter.QualityScoreFilter(20))
+        self._check(lambda: quality_filter.WindowQualityScoreFilter(4, 20))
+        self._check(lambda: quality_filter.AmbiguousBaseFilter('truncate'))
+        self._check(lambda: quality_filter.MaxAmbiguousFilter(1))
+        self._check(lambda: quality_filter.PctAmbiguousFilter(0.1))
+
+    def test_check_batch(self):
+        FAILED = quality_filter.FAILED
+        filters = [quality_filter.QualityScoreFilter(20),
+                   quality_filter.WindowQualityScoreFilter(4, 20),
+                   quality_filter.WindowQualityScoreFilter(12, 20),
+                   quality_filter.MaxAmbiguousFilter(1),
+                   quality_filter.PctAmbiguousFilter(0.1)]
+        for f in filters:
+            for records in (self.records, self.fast_records):
+                expected = [f.check(r) for r in records]
+                actual = f.check_batch(records)
+                self.assertEqual([(c, r if c == FAILED else len(r))
+                                  for c, r in expected],
+                                 [(c, r if c == FAILED else len(r))
+                                  for c, r in actual])
+
+
+class FilterPlanTestCase(unittest.TestCase):
+    def setUp(self):
+        self.records = [
+            SeqRecord(Seq('ACGTNACGTACGTAC'), 'seq1'),
+            SeqRecord(Seq('ACGTA'), 'seq2'),
+            SeqRecord(Seq('NNGTACGTACGTAAN'), 'seq3'),
+            SeqRecord(Seq('ACGTACGTACGTACGTACGT'), 'seq4'),
+        ]
+
+    def _filters(self, listener):
+        filters = [quality_filter.MaxLengthFilter(12),
+                   quality_filter.MaxAmbiguousFilter(1),
+                   quality_filter.AmbiguousBaseFilter('truncate'),
+                   quality_filter.MinLengthFilter(5)]
+        for f in filters:
+            f.listener = listener
+        return filters
+
+    def _run(self, fused):
+        events = []
+        listener = quality_filter.RecordEventListener()
+        listener.register_handler(
+            'failed_filter',
+            lambda record, filter_name, value=None:
+                events.append((record.id, filter_name, value)))
+        filters = self._filters(listener)
+        if fused:
+            records = quality_filter.FilterPlan(filters).filter_records(
+                self.records)
+        else:
+            records = self.records
+            for f in filters:
+                records = f.filter_records(records)
+        result = [(r.id, str(r.seq)) for r in records]
+        return result, events, [f.report_dict() for f in filters]
+
+    def test_matches_chained(self):
+        expected = self._run(False)
+        self.assertEqual(expected, self._run(True))
+        result, events, reports = expected
+        self.assertEqual([('seq2', 'ACGTA'), ('seq4', 'ACGTACGTACGT')],
+                         result)
+        self.assertEqual([('seq1', 'Minimum Length [5]', 4),
+                          ('seq3', 'Maximum Ambiguous Bases [1]', 2)], events)
+        self.assertEqual(1, reports[0]['passed_unchanged'])
+        self.assertEqual(3, reports[0]['passed_changed'])
+
+    def test_check(self):
+        f = quality_filter.MinLengthFilter(10)
+        self.assertEqual((quality_filter.FAILED, 5),
+                         f.check(self.records[1]))
+        code, record = f.check(self.records[0])
+        self.assertEqual(quality_filter.PASSED, code)
+        self.assertIs(self.records[0], record)
+
+    def test_filter_record_subclass(self):
+        class ShortFilter(quality_filter.BaseFilter):
+            name = 'Short'
+
+            def filter_record(self, record):
+                if len(record) > 10:
+                    raise quality_filter.FailedFilter(len(record))
+                return record[:3]
+
+        f = ShortFilter()
+        self.assertEqual((quality_filter.FAILED, 15),
+                         f.check(self.records[0]))
+        actual = list(f.filter_records(self.records))
+        self.assertEqual(['ACG'], [str(r.seq) for r in actual])
+        self.assertEqual((0, 1, 3), (f.passed_unchanged, f.passed_changed,
+                                     f.failed))
+
+    def test_base_not_implemented(self):
+        self.assertRaises(NotImplementedError,
+                          quality_filter.BaseFilter().filter_record,
+                          self.records[0])
+
+
+class ImapFiltersTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(1)
+        self.records = []
+        for i in range(50):
+            seq = ''.join(rng.choice('ACGTN' if i % 3 else 'ACGT')
+                          for _ in range(rng.randint(5, 40)))
+            barcode = rng.choice(['ACC', 'ACT', 'GGG'])
+            self.records.append(SeqRecord(
+                Seq(barcode + 'GTTA' + seq), 'seq{0}'.format(i),
+                letter_annotations={'phred_quality': [
+                    rng.randint(5, 40) for _ in range(len(seq) + 7)]}))
+        self.trie = quality_filter.parse_barcode_file(
+            StringIO('Sample1,ACC\nSample2,ACT\n'), primer='GTTA')
+
+    def _run(self, threads, fast=False):
+        records = self.records
+        if fast:
+            records = [FastRecord(r.id, r.description, bytes(r.seq),
+                                  bytes(q + 33 for q in
+                                        r.letter_annotations['phred_quality']))
+                       for r in records]
+        filters = [quality_filter.WindowQualityScoreFilter(5, 15),
+                   quality_filter.QualityScoreFilter(20),
+                   quality_filter.MaxAmbiguousFilter(2),
+                   quality_filter.PrimerBarcodeFilter(self.trie),
+                   quality_filter.MinLengthFilter(8)]
+        details, barcodes = StringIO(), []
+        listener = quality_filter.RecordEventListener()
+        quality_filter.RecordReportHandler(details, [], False).register_with(
+            listener)
+        listener.register_handler(
+            'found_barcode',
+            lambda record, sample, barcode=None:
+                barcodes.append((record.id, sample)))
+        for f in filters:
+            f.listener = listener
+        if threads:
+            records = quality_filter.imap_filters(
+                records, filters, listener, threads, batch_size=7)
+        else:
+            records = listener.iterable_hook('read', records)
+            records = quality_filter.FilterPlan(filters).filter_records(
+                records)
+            records = listener.iterable_hook('write', records)
+        result = [(r.id, quality_filter._sequence_str(r)) for r in records]
+        return (result, details.getvalue(), barcodes,
+                [f.report_dict() for f in filters])
+
+    def test_matches_single_process(self):
+        expected = self._run(0)
+        self.assertTrue(expected[0])
+        self.assertEqual(expected, self._run(1))
+        self.assertEqual(expected, self._run(2))
+
+    def test_fast_records(self):
+        expected = self._run(0)
+        self.assertEqual(expected, self._run(0, fast=True))
+        self.assertEqual(expected, self._run(1, fast=True))
+
+
+class PairedFilterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.first = [SeqRecord(Seq('ACGTACGTAC'), 'r1/1'),
+                      SeqRecord(Seq('ACGTA'), 'r2/1'),
+                      SeqRecord(Seq('ACGTACGTAC'), 'r3/1'),
+                      SeqRecord(Seq('ACG'), 'r4/1')]
+        self.second = [SeqRecord(Seq('TTGTACGTAC'), 'r1/2'),
+                       SeqRecord(Seq('TTGTACGTAC'), 'r2/2'),
+                       SeqRecord(Seq('TTG'), 'r3/2'),
+                       SeqRecord(Seq('TT'), 'r4/2')]
+
+    def test_read_pairs(self):
+        pairs = list(quality_filter.read_pairs(self.first, self.second))
+        self.assertEqual(list(zip(self.first, self.second)), pairs)
+        interleaved = [r for pair in pairs for r in pair]
+        self.assertEqual(pairs,
+                         list(quality_filter.read_pairs(interleaved)))
+
+    def test_read_pairs_unsynchronized(self):
+        self.assertRaises(
+            ValueError, list,
+            quality_filter.read_pairs(self.first, self.second[1:]))
+        self.assertRaises(
+            ValueError, list,
+            quality_filter.read_pairs(self.first, self.second[:-1]))
+        self.assertRaises(
+            ValueError, list,
+            quality_filter.read_pairs(self.first + self.second[:1]))
+
+    def _run(self, keep_singletons, threads=1):
+        events = []
+        listener = quality_filter.RecordEventListener()
+        for event in ('read', 'write'):
+            listener.register_handler(
+                event, lambda record, event=event:
+                    events.append((event, record.id)))
+        listener.register_handler(
+            'failed_filter', lambda record, filter_name, value=None:
+                events.append((filter_name, record.id)))
+        filters = [quality_filter.MinLengthFilter(5)]
+        pair_filter = quality_filter.MatePairFilter()
+        pairs = quality_filter.read_pairs(self.first, self.second)
+        result = [tuple(r and r.id for r in pair) for pair in
+                  quality_filter.filter_pairs(
+                      pairs, filters, pair_filter, listener,
+                      keep_singletons, threads, batch_size=3)]
+        return result, events, pair_filter.report_dict()
+
+    def test_filter_pairs(self):
+        result, events, report = self._run(False)
+        self.assertEqual([('r1/1', 'r1/2'), ('r2/1', 'r2/2')], result)
+        self.assertEqual(
+            [('read', 'r1/1'), ('write', 'r1/1'),
+             ('read', 'r1/2'), ('write', 'r1/2'),
+             ('read', 'r2/1'), ('write', 'r2/1'),
+             ('read', 'r2/2'), ('write', 'r2/2'),
+             ('read', 'r3/1'), ('Mate Pair', 'r3/1'),
+             ('read', 'r3/2'), ('Minimum Length [5]', 'r3/2'),
+             ('read', 'r4/1'), ('Minimum Length [5]', 'r4/1'),
+             ('read', 'r4/2'), ('Minimum Length [5]', 'r4/2')], events)
+        self.assertEqual((2, 2), (report['passed_unchanged'],
+                                  report['failed']))
+
+    def test_filter_pairs_singletons(self):
+        result, events, _ = self._run(True)
+        self.assertEqual([('r1/1', 'r1/2'), ('r2/1', 'r2/2'),
+                          ('r3/1', None)], result)
+        self.assertIn(('write', 'r3/1'), events)
+
+    def test_filter_pairs_threads(self):
+        self.assertEqual(self._run(True), self._run(True, threads=2))
+
+
+class WritePairsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.first = [
+            FastRecord('r{0}/1'.format(i), '', b'ACGTA'[:n], b'IIIII'[:n])
+            for i, n in enumerate([5, 2, 5, 5])]
+        self.second = [
+            FastRecord('r{0}/2'.format(i), '', b'TTGCA'[:n], b'IIIII'[:n])
+            for i, n in enumerate([5, 5, 2, 5])]
+
+    def _path(self, name):
+        return os.path.join(self.tempdir, name)
+
+    def _read(self, name):
+        with open(self._path(name)) as fp:
+            return [line[1:].strip() for line in fp.readlines()[::4]]
+
+    def _write(self, mates, **kwargs):
+        arguments = argparse.Namespace(
+            output_file=open(self._path('out.fastq'), 'w'), mate_output=None,
+            singletons=None, threads=1, compress_level=None,
+            compress_threads=None)
+        for key, name in kwargs.items():
+            setattr(arguments, key, self._path(name))
+        write = mock.Mock(side_effect=fastrecord.write)
+        with mock.patch.object(fastrecord, 'write', write):
+            quality_filter._write_pairs(
+                arguments, self.first, mates,
+                [quality_filter.MinLengthFilter(3)],
+                quality_filter.RecordEventListener(), True)
+        return write.call_count
+
+    def test_mate_output(self):
+        calls = self._write(self.second, mate_output='mates.fastq',
+                            singletons='singletons.fastq')
+        self.assertEqual(3, calls)
+        self.assertEqual(['r0/1', 'r3/1'], self._read('out.fastq'))
+        self.assertEqual(['r0/2', 'r3/2'], self._read('mates.fastq'))
+        self.assertEqual(['r1/2', 'r2/1'], self._read('singletons.fastq'))
+
+    def test_interleaved(self):
+        records = [r for pair in zip(self.first, self.second) for r in pair]
+        self.first = records
+        self.assertEqual(1, self._write(None))
+        self.assertEqual(['r0/1', 'r0/2', 'r3/1', 'r3/2'],
+                         self._read('out.fastq'))
+
+
 class RecordEventListenerTestCase(unittest.TestCase):
     def test_send(self):
         events = []
@@ -236,6 +560,56 @@ class RecordEventListenerTestCase(unittest.TestCase):
         rle('other', record, n=5)
         self.assertEqual(events, [1, 5])
 
+    def test_no_handlers(self):
+        rle = quality_filter.RecordEventListener()
+        self.assertFalse(rle)
+        records = [object()]
+        self.assertIs(records, rle.iterable_hook('read', records))
+
+        events = []
+        rle.register_handler('read', events.append)
+        self.assertTrue(rle)
+        self.assertIs(records, rle.iterable_hook('write', records))
+        self.assertEqual(records, list(rle.iterable_hook('read', records)))
+        self.assertEqual(records, events)
+
+
+class BatchedHandlerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.records = [SeqRecord(Seq('ACGT'), 'seq{0}'.format(i))
+                        for i in range(5)]
+
+    def test_report_handler(self):
+        fp = StringIO()
+        handler = quality_filter.RecordReportHandler(fp, [], False)
+        handler.BATCH_SIZE = 2
+        listener = quality_filter.RecordEventListener()
+        handler.register_with(listener)
+        for i, record in enumerate(self.records):
+            listener('read', record)
+            if i % 2:
+                listener('failed_filter', record, filter_name='f', value=i)
+            else:
+                listener('write', record[1:])
+        # Header and two batches of rows
+        self.assertEqual(5, len(fp.getvalue().splitlines()))
+        handler.flush()
+        lines = fp.getvalue().splitlines()
+        self.assertEqual(6, len(lines))
+        self.assertEqual('"seq1",4,"","","","","f",1', lines[2])
+        self.assertEqual('"seq4",4,"","",3,"","",""', lines[5])
+
+    def test_barcode_map_handler(self):
+        fp = StringIO()
+        handler = quality_filter.BarcodeMapHandler(fp)
+        listener = quality_filter.RecordEventListener()
+        handler.register_with(listener)
+        for record in self.records[:2]:
+            listener('found_barcode', record, sample='s1', barcode='ACG')
+        self.assertEqual('', fp.getvalue())
+        handler.flush()
+        self.assertEqual('seq0,s1\nseq1,s1\n', fp.getvalue())
+
 
 class BarcodePrimerTrieTestCase(unittest.TestCase):
     def setUp(self):
@@ -268,6 +642,141 @@ p1d1bc213,TACGAGAC,CAYGGCTA"""
         self.assertIsNone(res.get('TACGTCTCCAAGGCTA'))
         self.assertIsNone(res.get('TACGTCTCCAGGGCTA'))
 
+    def test_mismatches(self):
+        res = quality_filter.parse_barcode_file(self.fp, mismatches=7)
+        self.assertEqual(13, len(list(res.keys())))
+        self.fp.seek(0)
+        self.assertRaises(ValueError, quality_filter.parse_barcode_file,
+                          self.fp, mismatches=8)
+
+    def test_mismatches_argument(self):
+        parser = argparse.ArgumentParser()
+        quality_filter.build_parser(parser)
+        args = ['-', 'out.fastq', '--barcode-mismatches']
+        self.assertEqual(
+            2, parser.parse_args(args + ['2']).barcode_mismatches)
+        with mock.patch('sys.stderr'):
+            self.assertRaises(SystemExit, parser.parse_args, args + ['-1'])
+
+
+class BarcodeTrieTestCase(unittest.TestCase):
+    def setUp(self):
+        self.trie = quality_filter.BarcodeTrie([('ACGT', 's1'),
+                                                ('ACGTAA', 's2'),
+                                                ('TTGG', 's3')])
+
+    def test_mapping(self):
+        self.assertEqual(3, len(self.trie))
+        self.assertEqual(['ACGT', 'ACGTAA', 'TTGG'], sorted(self.trie.keys()))
+        self.assertIn('ACGT', self.trie)
+        self.assertNotIn('ACG', self.trie)
+        self.assertEqual('s2', self.trie['ACGTAA'])
+        self.assertRaises(KeyError, lambda: self.trie['ACG'])
+        self.trie['ACGT'] = 's4'
+        self.assertEqual(3, len(self.trie))
+        self.assertEqual('s4', self.trie.get('ACGT'))
+
+    def test_longest_prefix(self):
+        self.assertEqual('ACGTAA', self.trie.longest_prefix('ACGTAACC'))
+        self.assertEqual('ACGT', self.trie.longest_prefix('ACGTACC'))
+        self.assertEqual('TTGG', self.trie.longest_prefix('TTGG'))
+        self.assertIsNone(self.trie.longest_prefix('ACG'))
+        self.assertIsNone(self.trie.longest_prefix('TAGGCC'))
+
+    def test_mismatches(self):
+        self.assertIsNone(self.trie.longest_prefix('TAGGCC'))
+        self.assertEqual('TTGG', self.trie.longest_prefix('TAGGCC', 1))
+        self.assertEqual('ACGTAA', self.trie.longest_prefix('ACGAAACC', 1))
+        self.assertEqual('ACGT', self.trie.longest_prefix('ACGTCGCC', 1))
+        # Exact matches win over mismatched ones of the same length
+        self.trie['ACGA'] = 's5'
+        self.assertEqual('ACGA', self.trie.longest_prefix('ACGACC', 1))
+
+    def test_ambiguous(self):
+        trie = quality_filter.BarcodeTrie([('AACC', 's1'), ('AAGG', 's2')])
+        self.assertIsNone(trie.longest_prefix('AACGTT', 1))
+        self.assertEqual('AAGG', trie.longest_prefix('AAGGTT', 1))
+
+    def test_trie_match_mapping(self):
+        self.assertEqual('ACGTAA', quality_filter.trie_match(
+            'ACGTAAT', {'ACGT': 's1', 'ACGTAA': 's2'}))
+
+    def test_filter_mismatches(self):
+        trie = quality_filter.parse_barcode_file(StringIO('s1,ACC\ns2,TGT\n'),
+                                                 primer='GTTA')
+        instance = quality_filter.PrimerBarcodeFilter(trie, mismatches=1)
+        records = [SeqRecord(Seq('ACCGTTACGAT'), 'seq1'),
+                   SeqRecord(Seq('AGCGTTACGAT'), 'seq2'),
+                   SeqRecord(Seq('AGGGTTACGAT'), 'seq3')]
+        actual = list(instance.filter_records(records))
+        self.assertEqual(['seq1', 'seq2'], [r.id for r in actual])
+        self.assertEqual(['CGAT', 'CGAT'], [str(r.seq) for r in actual])
+
+
+def _has_prefix(string, keys):
+    return any(key.startswith(string) for key in keys)
+
+
+def _scan_match(string, keys):
+    """
+    Longest-prefix search as previously implemented: scanning every key for
+    each prefix length
+    """
+    longest = None
+    for i in range(len(string)):
+        substr = string[:i + 1]
+        if not _has_prefix(substr, keys):
+            break
+        if substr in keys:
+            longest = substr
+    return longest
+
+
+class BarcodeBenchmarkTestCase(unittest.TestCase):
+    """
+    Longest-prefix matching of reads against 96, 384 and 1536 barcodes with a
+    degenerate primer, by trie against scanning the keys
+    """
+    primer = 'CAYGGCTA'
+    reads = 100
+
+    def _barcodes(self, n, rng):
+        barcodes = itertools.product('ACGT', repeat=6)
+        return ['s{0},{1}'.format(i, ''.join(bc))
+                for i, bc in enumerate(rng.sample(list(barcodes), n))]
+
+    def _reads(self, barcodes, rng):
+        reads = []
+        for i in range(self.reads):
+            prefix = rng.choice(barcodes).split(',')[1] + 'CATGGCTA'
+            if i % 4 == 0:
+                prefix = 'G' + prefix
+            reads.append(prefix + ''.join(rng.choice('ACGT')
+                                          for _ in range(100)))
+        return reads
+
+    def _cases(self):
+        rng = random.Random(1)
+        for n in (96, 384, 1536):
+            barcodes = self._barcodes(n, rng)
+            trie = quality_filter.parse_barcode_file(
+                StringIO('\n'.join(barcodes)), primer=self.primer)
+            yield trie, set(trie.keys()), self._reads(barcodes, rng)
+
+    def test_matches_scan(self):
+        for trie, keys, reads in self._cases():
+            self.assertEqual([_scan_match(read, keys) for read in reads],
+                             [trie.longest_prefix(read) for read in reads])
+
+    @benchmark
+    def test_benchmark(self):
+        for trie, keys, reads in self._cases():
+            scan_time, _ = best_time(
+                lambda: [_scan_match(read, keys) for read in reads])
+            trie_time, _ = best_time(
+                lambda: [trie.longest_prefix(read) for read in reads])
+            self.assertLess(trie_time, scan_time)
+
 
 class AllUnambiguousTestCase(unittest.TestCase):
     def test_one_nt(self):
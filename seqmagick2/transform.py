@@ -1,87 +1,28 @@
 """
 Functions to transform / filter sequences
 """
-import collections
 import contextlib
 import csv
-import os
-import pickle as pickle
-import gzip
 import itertools
 import logging
 import re
 import string
-import tempfile
 import random
 
 from Bio import SeqIO
 from Bio.Data import CodonTable
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
-from Bio.SeqUtils.CheckSum import seguid
 from functools import reduce
 
+from seqmagick2 import alignment, dedup, recordstore, seqindex, sorting
+
 # Characters to be treated as gaps
 GAP_CHARS = "-."
 GAP_TABLE = {ord(c): None for c in GAP_CHARS}
 
 # Size of temporary file buffer: default to 256MB
-DEFAULT_BUFFER_SIZE = 268435456  # 256 * 2**20
-
-
-def _stream_copy(source, destination, chunk_size=1024 * 1024):
-    """
-    Copy a text stream in chunks to avoid loading the entire file into memory.
-    """
-    while True:
-        chunk = source.read(chunk_size)
-        if not chunk:
-            break
-        destination.write(chunk)
-
-
-@contextlib.contextmanager
-def _materialize_source_path(source_file):
-    """
-    Provide a real file path suitable for SeqIO.index.
-
-    If the source is gzip or lacks a stable on-disk path (e.g. stdin), stream
-    contents to a temporary file to avoid a full in-memory read.
-    """
-    source_name = getattr(source_file, "name", None)
-    is_gzip = False
-    if isinstance(source_file, gzip.GzipFile):
-        is_gzip = True
-    elif source_name and source_name.lower().endswith('.gz'):
-        is_gzip = True
-    elif hasattr(source_file, "buffer") and isinstance(source_file.buffer, gzip.GzipFile):
-        is_gzip = True
-
-    needs_materialize = (
-        is_gzip or
-        not source_name or
-        source_name in ("<stdin>", "<fdopen>")
-    )
-
-    if not needs_materialize:
-        yield source_name
-        return
-
-    tmp = tempfile.NamedTemporaryFile(delete=False, mode='w+t')
-    try:
-        try:
-            source_file.seek(0)
-        except Exception:
-            pass
-        _stream_copy(source_file, tmp)
-        tmp.flush()
-        tmp.close()
-        yield tmp.name
-    finally:
-        try:
-            os.unlink(tmp.name)
-        except OSError:
-            pass
+DEFAULT_BUFFER_SIZE = recordstore.DEFAULT_BUFFER_SIZE
 
 
 @contextlib.contextmanager
@@ -89,25 +30,12 @@ def _record_buffer(records, buffer_size=DEFAULT_BUFFER_SIZE):
     """
     Buffer for transform functions which require multiple passes through data.
 
-    Value returned by context manager is a function which returns an iterator
-    through records.
+    Value returned by context manager is a seqmagick2.recordstore.RecordStore:
+    calling it returns an iterator through records.
     """
-    with tempfile.SpooledTemporaryFile(buffer_size, mode='wb+') as tf:
-        pickler = pickle.Pickler(tf)
-        for record in records:
-            pickler.dump(record)
-
-        def record_iter():
-            tf.seek(0)
-            # _file is used below because it implements the necessary methods for pickle.Unpickler(), namely 'readinto' which is newly required in 3.8. See https://docs.python.org/3/library/tempfile.html#tempfile.SpooledTemporaryFile for details on the _file attribute of tempfile.SpooledTemporaryFile.
-            unpickler = pickle.Unpickler(tf._file)
-            while True:
-                try:
-                    yield unpickler.load()
-                except EOFError:
-                    break
-
-        yield record_iter
+    with recordstore.RecordStore(buffer_size) as store:
+        store.extend(records)
+        yield store
 
 
 def dashes_cleanup(records, prune_chars='.:?~'):
@@ -131,18 +59,9 @@ def deduplicate_sequences(records, out_file):
 
     logging.info('Applying _deduplicate_sequences generator: '
                  'removing any duplicate records with identical sequences.')
-    checksum_sequences = collections.defaultdict(list)
-    for record in records:
-        checksum = seguid(record.seq)
-        sequences = checksum_sequences[checksum]
-        if not sequences:
-            yield record
-        sequences.append(record.id)
-
-    if out_file is not None:
-        with out_file:
-            for sequences in checksum_sequences.values():
-                out_file.write('%s\n' % (' '.join(sequences),))
+    # Case-insensitive, as Bio.SeqUtils.CheckSum.seguid
+    return dedup.deduplicate(records, lambda record: bytes(record.seq),
+                             out_file)
 
 
 def deduplicate_taxa(records):
@@ -337,6 +256,9 @@ def drop_columns(records, slices):
     """
     Drop all columns present in ``slices`` from records
     """
+    if alignment.available():
+        yield from alignment.drop_columns(records, slices)
+        return
     for record in records:
         # Generate a set of indices to remove
         drop = set(i for slice in slices
@@ -391,14 +313,21 @@ def _update_slices(record, slices):
 
     return [update_slice(s) for s in slices]
 
-def cut_sequences_relative(records, slices, record_id):
+def cut_sequences_relative(records, slices, record_id, reference=None):
     """
     Cuts records to slices, indexed by non-gap positions in record_id
+
+    If given, ``reference`` is the record with ID record_id, and records are
+    read in a single pass.
     """
+    if reference is not None:
+        yield from multi_cut_sequences(records,
+                                       _update_slices(reference, slices))
+        return
     with _record_buffer(records) as r:
         try:
-            record = next(i for i in r() if i.id == record_id)
-        except StopIteration:
+            record = r.find(record_id)
+        except KeyError:
             raise ValueError("Record with id {0} not found.".format(record_id))
 
         new_slices = _update_slices(record, slices)
@@ -409,6 +338,9 @@ def multi_mask_sequences(records, slices):
     """
     Replace characters sliced by slices with gap characters.
     """
+    if alignment.available():
+        yield from alignment.multi_mask_sequences(records, slices)
+        return
     for record in records:
         record_indices = list(range(len(record)))
         keep_indices = reduce(lambda i, s: i - frozenset(record_indices[s]),
@@ -418,11 +350,15 @@ def multi_mask_sequences(records, slices):
         record.seq = Seq(seq)
         yield record
 
-def mask_sequences_relative(records, slices, record_id):
+def mask_sequences_relative(records, slices, record_id, reference=None):
+    if reference is not None:
+        yield from multi_mask_sequences(records,
+                                        _update_slices(reference, slices))
+        return
     with _record_buffer(records) as r:
         try:
-            record = next(i for i in r() if i.id == record_id)
-        except StopIteration:
+            record = r.find(record_id)
+        except KeyError:
             raise ValueError("Record with id {0} not found.".format(record_id))
 
         new_slices = _update_slices(record, slices)
@@ -672,7 +608,7 @@ def head(records, head):
             yield record
     elif '-' in head:
         with _record_buffer(records) as r:
-            record_count = sum(1 for record in r())
+            record_count = len(r)
             end_index = max(record_count + int(head), 0)
             for record in itertools.islice(r(), end_index):
                 yield record
@@ -697,7 +633,7 @@ def tail(records, tail):
             yield record
     else:
         with _record_buffer(records) as r:
-            record_count = sum(1 for record in r())
+            record_count = len(r)
             start_index = max(record_count - int(tail), 0)
             for record in itertools.islice(r(), start_index, None):
                 yield record
@@ -708,6 +644,8 @@ def gap_proportion(sequences, gap_chars='-'):
     Generates a list with the proportion of gaps by index in a set of
     sequences.
     """
+    if alignment.available():
+        return alignment.gap_proportion(sequences, gap_chars)
     aln_len = None
     gaps = []
     for i, sequence in enumerate(sequences):
@@ -735,6 +673,10 @@ def squeeze(records, gap_threshold=1.0):
     in an alignment.  Takes a second sequence iterator for determining gap
     positions.
     """
+    if alignment.available():
+        # Single pass into a column-oriented matrix
+        yield from alignment.squeeze(records, gap_threshold)
+        return
     with _record_buffer(records) as r:
         gap_proportions = gap_proportion(r())
 
@@ -898,66 +840,61 @@ def min_ungap_length_discard(records, min_length):
             yield record
 
 
-def sort_length(source_file, source_file_type, direction=1):
+def _iter_index(index, entries):
     """
-    Sort sequences by length. 1 is ascending (default) and 0 is descending.
+    Records at ``entries`` of a seqmagick2.seqindex.SequenceIndex
     """
-    direction_text = 'ascending' if direction == 1 else 'descending'
-
-    logging.info('Indexing sequences by length: %s', direction_text)
+    with index:
+        for entry in entries:
+            yield index.fetch(entry)
 
-    # Adapted from the Biopython tutorial example.
 
-    with _materialize_source_path(source_file) as source_path:
-        with open(source_path, 'rt') as handle:
-            len_and_ids = sorted(
-                (len(rec), rec.id)
-                for rec in SeqIO.parse(handle, source_file_type)
-            )
+def _sort(source_file, source_file_type, direction, record_key, entry_key,
+          memory):
+    """
+    Records of ``source_file`` sorted by ``record_key``, stable, ascending if
+    direction is 1.
 
-        if direction == 0:
-            ids = reversed([seq_id for (length, seq_id) in len_and_ids])
-        else:
-            ids = [seq_id for (length, seq_id) in len_and_ids]
-        del len_and_ids  # free this memory
+    Entries of an up to date sidecar index are sorted with ``entry_key`` if
+    one is available; otherwise records are read once and merge sorted in
+    external memory.
+    """
+    reverse = direction == 0
+    index = seqindex.open_fresh(source_file, source_file_type)
+    if index is not None:
+        entries = sorted(index, key=entry_key, reverse=reverse)
+        return _iter_index(index, entries)
 
-        record_index = SeqIO.index(source_path, source_file_type)
-        try:
-            for seq_id in ids:
-                yield record_index[seq_id]
-        finally:
-            try:
-                record_index.close()
-            except Exception:
-                pass
+    records = SeqIO.parse(source_file, source_file_type)
+    return sorting.sort_records(records, key=record_key, reverse=reverse,
+                                memory=memory)
 
 
-def sort_name(source_file, source_file_type, direction=1):
+def sort_length(source_file, source_file_type, direction=1,
+                memory=sorting.DEFAULT_SORT_MEMORY):
     """
-    Sort sequences by name. 1 is ascending (default) and 0 is descending.
+    Sort sequences by length, then ID. 1 is ascending (default) and 0 is
+    descending.
     """
-
     direction_text = 'ascending' if direction == 1 else 'descending'
 
-    logging.info("Indexing sequences by name: %s", direction_text)
+    logging.info('Sorting sequences by length: %s', direction_text)
+
+    return _sort(source_file, source_file_type, direction,
+                 record_key=lambda r: (len(r), r.id),
+                 entry_key=lambda e: (e.length, e.name), memory=memory)
+
 
-    # Adapted from the Biopython tutorial example.
+def sort_name(source_file, source_file_type, direction=1,
+              memory=sorting.DEFAULT_SORT_MEMORY):
+    """
+    Sort sequences by name. 1 is ascending (default) and 0 is descending.
+    """
 
-    with _materialize_source_path(source_file) as source_path:
-        with open(source_path, 'rt') as handle:
-            ids = sorted(
-                rec.id for rec in SeqIO.parse(handle, source_file_type)
-            )
+    direction_text = 'ascending' if direction == 1 else 'descending'
 
-        if direction == 0:
-            ids = reversed(ids)
+    logging.info("Sorting sequences by name: %s", direction_text)
 
-        record_index = SeqIO.index(source_path, source_file_type)
-        try:
-            for seq_id in ids:
-                yield record_index[seq_id]
-        finally:
-            try:
-                record_index.close()
-            except Exception:
-                pass
+    return _sort(source_file, source_file_type, direction,
+                 record_key=lambda r: r.id, entry_key=lambda e: e.name,
+                 memory=memory)
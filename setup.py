@@ -72,7 +72,8 @@ setup(name='seqmagick2',
           'seqmagick2.test.integration': ['data/*']
       },
       python_requires='>=3.9',
-      install_requires=['biopython>=1.78', 'pygtrie>=2.1'],
+      install_requires=['biopython>=1.78'],
+      extras_require={'numpy': ['numpy'], 'xxhash': ['xxhash']},
       classifiers=[
           'License :: OSI Approved :: GNU General Public License (GPL)',
           'Development Status :: 4 - Beta',